@@ -1,43 +1,135 @@
-import os
+import hmac, io, os, sys, uuid
+from datetime import datetime, timedelta, timezone
 
-from flask import Flask, render_template, request, flash, redirect, session, g, url_for
+import click
+
+from flask import (Blueprint, Flask, Response, abort, jsonify, render_template, request, flash, redirect, send_file,
+                   session, current_app, g, url_for, stream_with_context)
 from dotenv import load_dotenv
-from models import db, connect_db, User, Recipe, Favorite, Friend
-from forms import UserAddForm, RecipeAddForm, LoginForm, SearchForm
+from models import (db, connect_db, include_object, User, Recipe, Favorite, Friend, Friendship, FriendSuggestion,
+                    Activity, Rating, RecipeRating)
+from current_user import load_current_user
+from autocomplete import get_username_index
+from random_pool import get_random_pool
+from ingredients import get_pantry_index, index_recipes
+from passwords import PasswordHashingBusy, calibrate
+from jobs import enqueue, get_queue, run_workers, PRIORITY_HIGH, PRIORITY_LOW
+import fragments, images, metrics, profiling
+from forms import UserAddForm, RecipeAddForm, LoginForm, SearchForm, RatingForm, RecipeImportForm
+from recipe_io import (FORMATS, IMPORT_BATCH_SIZE, format_for, import_recipes as import_recipe_stream,
+                       export_recipes, export_favorites)
 from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import joinedload
 
-from flask_bcrypt import Bcrypt
-
-load_dotenv()
 
 CURR_USER_KEY = "curr_user"
 
-app = Flask(__name__)
-bcrypt = Bcrypt()
-
-app.config['SQLALCHEMY_DATABASE_URI'] = (
-    os.environ.get('DATABASE_URL', 'postgresql:///food_friends'))
-app.config['SECRET_KEY'] = os.environ.get('SECRET_KEY')
-app.config['SPOONACULAR_API_KEY'] = os.getenv('SPOONACULAR_API_KEY')
+PANTRY_RESULTS = 24
+
+BUSY_MESSAGE = "Lots of people are signing in right now. Please try again in a moment."
+
+# Every route and CLI command is registered on this blueprint, which
+# create_app adds to each app it makes. CLI commands stay top level
+# (`flask worker`, not `flask main worker`).
+bp = Blueprint('main', __name__, cli_group=None)
+
+
+def configure(app):
+    """Read settings from the environment (and .env) into app.config."""
+
+    app.config['SQLALCHEMY_DATABASE_URI'] = (
+        os.environ.get('DATABASE_URL', 'postgresql:///food_friends'))
+    if os.environ.get('DATABASE_POOL_SIZE'):
+        # Set by gunicorn.conf.py in async mode, so every in-flight request can hold a connection
+        app.config['SQLALCHEMY_ENGINE_OPTIONS'] = {
+            'pool_size': int(os.environ['DATABASE_POOL_SIZE']),
+            'max_overflow': int(os.environ.get('DATABASE_MAX_OVERFLOW', 0)),
+        }
+    app.config['SECRET_KEY'] = os.environ.get('SECRET_KEY')
+    app.config['SPOONACULAR_API_KEY'] = os.getenv('SPOONACULAR_API_KEY')
+    app.config['SPOONACULAR_BASE_URL'] = os.environ.get('SPOONACULAR_BASE_URL', 'https://api.spoonacular.com')
+    app.config['SPOONACULAR_POOL_SIZE'] = int(os.environ.get('SPOONACULAR_POOL_SIZE', 10))
+    app.config['SPOONACULAR_CONNECT_TIMEOUT'] = float(os.environ.get('SPOONACULAR_CONNECT_TIMEOUT', 3.05))
+    app.config['SPOONACULAR_READ_TIMEOUT'] = float(os.environ.get('SPOONACULAR_READ_TIMEOUT', 10))
+    app.config['SPOONACULAR_MAX_RETRIES'] = int(os.environ.get('SPOONACULAR_MAX_RETRIES', 2))
+    app.config['SPOONACULAR_CACHE_BACKEND'] = os.environ.get('SPOONACULAR_CACHE_BACKEND', 'memory')
+    app.config['SPOONACULAR_CACHE_PATH'] = os.environ.get(
+        'SPOONACULAR_CACHE_PATH', os.path.join(app.instance_path, 'spoonacular_cache.sqlite3'))
+    app.config['SPOONACULAR_CACHE_SIZE'] = int(os.environ.get('SPOONACULAR_CACHE_SIZE', 2048))
+    app.config['SEARCH_MIN_LOCAL_RESULTS'] = int(os.environ.get('SEARCH_MIN_LOCAL_RESULTS', 6))
+    app.config['CURRENT_USER_CACHE_TTL'] = int(os.environ.get('CURRENT_USER_CACHE_TTL', 30))
+    app.config['AUTOCOMPLETE_REFRESH_SECONDS'] = int(os.environ.get('AUTOCOMPLETE_REFRESH_SECONDS', 30))
+    app.config['JOB_QUEUE_BACKEND'] = os.environ.get('JOB_QUEUE_BACKEND', 'database')
+    app.config['JOB_QUEUE_PATH'] = os.environ.get('JOB_QUEUE_PATH', os.path.join(app.instance_path, 'jobs.sqlite3'))
+    app.config['JOB_LEASE_SECONDS'] = int(os.environ.get('JOB_LEASE_SECONDS', 300))
+    app.config['METRICS_TOKEN'] = os.environ.get('METRICS_TOKEN')
+    # Each web worker process saves its metrics here, and /metrics merges them (gunicorn.conf.py sets it)
+    app.config['METRICS_MULTIPROC_DIR'] = os.environ.get('METRICS_MULTIPROC_DIR')
+    app.config['PROFILER_TOKEN'] = os.environ.get('PROFILER_TOKEN')
+    app.config['PROFILER_DIR'] = os.environ.get('PROFILER_DIR', os.path.join(app.instance_path, 'profiles'))
+    # Uploads bigger than this are imported by `flask worker` from IMPORT_DIR, which workers must be able to read
+    app.config['IMPORT_INLINE_MAX_BYTES'] = int(os.environ.get('IMPORT_INLINE_MAX_BYTES', 5 * 1024 * 1024))
+    app.config['IMPORT_DIR'] = os.environ.get('IMPORT_DIR', os.path.join(app.instance_path, 'imports'))
+    app.config['IMAGE_CACHE_DIR'] = os.environ.get('IMAGE_CACHE_DIR', os.path.join(app.instance_path, 'images'))
+    app.config['IMAGE_CACHE_MAX_BYTES'] = int(os.environ.get('IMAGE_CACHE_MAX_BYTES', 512 * 1024 * 1024))
+    app.config['FRAGMENT_CACHE_BACKEND'] = os.environ.get('FRAGMENT_CACHE_BACKEND', 'memory')
+    app.config['FRAGMENT_CACHE_PATH'] = os.environ.get(
+        'FRAGMENT_CACHE_PATH', os.path.join(app.instance_path, 'fragment_cache.sqlite3'))
+    app.config['FRAGMENT_VERSION_BACKEND'] = os.environ.get('FRAGMENT_VERSION_BACKEND', 'sqlite')
+    app.config['FRAGMENT_VERSION_PATH'] = os.environ.get(
+        'FRAGMENT_VERSION_PATH', os.path.join(app.instance_path, 'fragment_versions.sqlite3'))
+    app.config['FRAGMENT_CACHE_SIZE'] = int(os.environ.get('FRAGMENT_CACHE_SIZE', 10000))
+    app.config['FRAGMENT_CACHE_TTL'] = int(os.environ.get('FRAGMENT_CACHE_TTL', 60 * 60))
+    app.config['RANDOM_POOL_BATCH_SIZE'] = int(os.environ.get('RANDOM_POOL_BATCH_SIZE', 100))
+    app.config['RANDOM_POOL_LOW_WATER'] = int(os.environ.get('RANDOM_POOL_LOW_WATER', 30))
+    app.config['RANDOM_POOL_MAX_SERVES'] = int(os.environ.get('RANDOM_POOL_MAX_SERVES', 20))
+    app.config['PANTRY_INDEX_REFRESH_SECONDS'] = int(os.environ.get('PANTRY_INDEX_REFRESH_SECONDS', 5 * 60))
+    # bcrypt cost; when unset, it's calibrated so a hash takes about BCRYPT_TARGET_MS
+    app.config['BCRYPT_LOG_ROUNDS'] = int(os.environ.get('BCRYPT_LOG_ROUNDS', 0)) or None
+    app.config['BCRYPT_TARGET_MS'] = int(os.environ.get('BCRYPT_TARGET_MS', 250))
+    # Hashes run at once (default: one per CPU), and how many more may wait before logins are turned away
+    app.config['PASSWORD_HASH_WORKERS'] = int(os.environ.get('PASSWORD_HASH_WORKERS', 0)) or None
+    app.config['PASSWORD_HASH_MAX_QUEUE'] = int(os.environ.get('PASSWORD_HASH_MAX_QUEUE', 0)) or None
+
+
+def create_app(config=None):
+    """Create the app. Keys in `config` override settings from the environment.
+
+    This does no network or database I/O. The schema is created and
+    upgraded by migrations (`flask db upgrade`), and connections, API
+    clients and caches are made on first use.
+    """
 
-connect_db(app)
+    load_dotenv()
+    app = Flask(__name__)
+    configure(app)
+    if config:
+        app.config.update(config)
+
+    connect_db(app)
+    if click.get_current_context(silent=True) is not None:
+        # Only the CLI (`flask db ...`) needs Flask-Migrate, which imports alembic and mako
+        from flask_migrate import Migrate
+        Migrate(app, db, include_object=include_object)
+    metrics.init_app(app)
+    profiling.init_app(app)
+    images.init_app(app)
+    fragments.init_app(app)
+    app.register_blueprint(bp)
+    return app
 
-with app.app_context():
-    # db.drop_all()
-    db.create_all()
-    
 
 ##############################################################################
 # User signup/login/logout
 
 
-@app.before_request
+@bp.before_app_request
 def add_user_to_g():
     """If we're logged in, add curr user to Flask global."""
 
     if CURR_USER_KEY in session:
-        # Get the user by ID from the database using the session
-        g.user = User.query.get(session[CURR_USER_KEY])
+        # Cached id/username/image_url; the full row is only loaded if a view needs it
+        g.user = load_current_user(session[CURR_USER_KEY])
     else:
         g.user = None
 
@@ -57,7 +149,7 @@ def do_logout():
     session.modified = True
 
 
-@app.route('/signup', methods=["GET", "POST"])
+@bp.route('/signup', methods=["GET", "POST"])
 def signup():
     """Handle user signup.
 
@@ -85,6 +177,11 @@ def signup():
             flash("Username already taken", 'danger')
             return render_template('users/signup.html', form=form)
 
+        except PasswordHashingBusy:
+            flash(BUSY_MESSAGE, 'danger')
+            return render_template('users/signup.html', form=form), 503
+
+        get_username_index().add(user.username, user.id)
         do_login(user)
 
         return redirect("/")
@@ -93,17 +190,23 @@ def signup():
         return render_template('users/signup.html', form=form)
     
 
-@app.route('/login', methods=["GET", "POST"])
+@bp.route('/login', methods=["GET", "POST"])
 def login():
     """Handle user login."""
 
     form = LoginForm()
 
     if form.validate_on_submit():
-        user = User.authenticate(form.username.data,
-                                 form.password.data)
+        try:
+            user = User.authenticate(form.username.data,
+                                     form.password.data)
+        except PasswordHashingBusy:
+            flash(BUSY_MESSAGE, 'danger')
+            return render_template('users/login.html', form=form), 503
 
         if user:
+            # Saves the password hash if authenticate upgraded it
+            db.session.commit()
             do_login(user)
             flash(f"Hello, {user.username}!", "success")
             return redirect("/")
@@ -113,7 +216,7 @@ def login():
     return render_template('users/login.html', form=form)
 
 
-@app.route('/logout')
+@bp.route('/logout')
 def logout():
     """Handle logout of user."""
     # pdb.set_trace()
@@ -128,13 +231,13 @@ def logout():
 # Site-Homepage
 
 
-@app.route('/')
+@bp.route('/')
 def homepage():
     """Show homepage"""
 
     if g.user:
         form = SearchForm()
-        random_recipes = Recipe.get_random_recipes(3)
+        random_recipes = get_random_pool().take(g.user.id, 3)
         return render_template('home.html', form=form, random_recipes=random_recipes)
 
     else:
@@ -144,58 +247,52 @@ def homepage():
 ##############################################################################
 # User Routes
 
-@app.route('/users')
+@bp.route('/users')
 def find_users():
-    """Show page of all users with pagination."""
-    page = request.args.get('page', 1, type=int)
-    users = User.query.paginate(page=page, per_page=12)  # 12 users per page
+    """Show page of all users, paged by username cursor."""
+    users = User.keyset_page(after=request.args.get('after'), before=request.args.get('before'),
+                             per_page=12)  # 12 users per page
+    users.total = User.approximate_count()
     return render_template('/users/all_users.html', users=users)
 
 
-@app.route('/users/<int:user_id>')
+@bp.route('/users/<int:user_id>')
 def user_homepage(user_id):
     """Show the profile page for any user, with conditional display for the current user."""
 
     user = User.query.get_or_404(user_id)  # Get the user being viewed
-    created_recipes = Recipe.query.filter_by(user_id=user_id).all()
-    favorites = user.favorites
-
-    # Count accepted friends where the user is either user_id or friend_id
-    friend_count = Friend.query.filter(
-        db.or_(
-            (Friend.user_id == user_id) & (Friend.status == 'accepted'),
-            (Friend.friend_id == user_id) & (Friend.status == 'accepted')
-        )
-    ).count()
 
-    # Determine if g.user is friends with this user
-    is_friend = False
-    if g.user:
-        is_friend = Friend.query.filter(
-            db.or_(
-                (Friend.user_id == g.user.id) & (Friend.friend_id == user_id) & (Friend.status == 'accepted'),
-                (Friend.user_id == user_id) & (Friend.friend_id == g.user.id) & (Friend.status == 'accepted')
-            )
-        ).first() is not None
+    # The page only shows how many recipes and favorites there are, so count them in SQL.
+    # The template calls these only when the cached profile card is missing.
+    recipe_count = lambda: Recipe.query.filter_by(user_id=user_id).count()
+    favorite_count = lambda: Favorite.query.filter_by(user_id=user_id).count()
+
+    # Both are maintained alongside the friendships edge table
+    friend_count = user.friend_count
+    is_friend = bool(g.user) and Friendship.are_friends(g.user.id, user_id)
 
     # Only show pending friend requests if the logged-in user is viewing their own profile
     pending_requests_info = []
     if g.user and g.user.id == user_id:
-        pending_requests = Friend.query.filter_by(friend_id=g.user.id, status='pending').all()
-        pending_requests_info = [{'sender': User.query.get(request.user_id)} for request in pending_requests]
+        # Load each request's sender in the same query
+        pending_requests = (Friend.query
+                            .options(joinedload(Friend.user))
+                            .filter_by(friend_id=g.user.id, status='pending')
+                            .all())
+        pending_requests_info = [{'sender': request.user} for request in pending_requests]
 
     return render_template(
         '/users/user-home.html', 
         user=user, 
-        recipes=created_recipes, 
-        favorites=favorites, 
+        recipe_count=recipe_count, 
+        favorite_count=favorite_count, 
         friends=friend_count,
         is_friend=is_friend,  # Pass the friendship status to the template
         pending_requests=pending_requests_info  # Pass pending requests only if viewing own profile
     )
 
 
-@app.route('/users/<int:user_id>/recipes')
+@bp.route('/users/<int:user_id>/recipes')
 def user_recipes(user_id):
     """Show all recipes created by the user."""
     
@@ -209,7 +306,7 @@ def user_recipes(user_id):
     return render_template('users/my-recipes.html', user=user, recipes=recipes)
 
 
-@app.route('/users/<int:user_id>/favorites')
+@bp.route('/users/<int:user_id>/favorites')
 def user_favorites(user_id):
     """Display the users favorite recipes page"""
 
@@ -218,8 +315,11 @@ def user_favorites(user_id):
         return redirect("/")
 
     user = User.query.get_or_404(user_id)
-    # Retrieve all favorites for the user
-    user_favorites = Favorite.query.filter_by(user_id=user_id).all()
+    # Retrieve all favorites for the user, with user-created recipes loaded in the same query
+    user_favorites = (Favorite.query
+                      .options(joinedload(Favorite.recipe))
+                      .filter_by(user_id=user_id)
+                      .all())
 
     # Separate user-created and Spoonacular favorites
     user_created_favorites = [f for f in user_favorites if f.recipe_id]
@@ -227,10 +327,12 @@ def user_favorites(user_id):
 
     # Ensure that each favorite has the related recipe data
     user_created_favorites = [
-        { 'favorite': f, 'recipe': Recipe.query.get(f.recipe_id) } for f in user_created_favorites
+        { 'favorite': f, 'recipe': f.recipe } for f in user_created_favorites
     ]
+    # Read Spoonacular favorites from our local copies, fetching any missing ones in bulk
+    spoonacular_recipes = Recipe.get_spoonacular_recipes([f.spoonacular_id for f in spoonacular_favorites])
     spoonacular_favorites = [
-        { 'favorite': f, 'spoonacular_recipe': Recipe.get_recipe_by_id(f.spoonacular_id) } for f in spoonacular_favorites
+        { 'favorite': f, 'spoonacular_recipe': recipe } for f, recipe in zip(spoonacular_favorites, spoonacular_recipes)
     ]
 
     return render_template(
@@ -241,7 +343,7 @@ def user_favorites(user_id):
     )
 
 
-@app.route('/users/<int:user_id>/friends')
+@bp.route('/users/<int:user_id>/friends')
 def user_friends(user_id):
     """Display the user's friends page."""
 
@@ -252,19 +354,41 @@ def user_friends(user_id):
 
     user = User.query.get_or_404(user_id)
 
-    # Find accepted friends where the current user is either user_id or friend_id
-    accepted_friends = db.session.query(User).join(
-        Friend,
-        db.or_(
-            (Friend.user_id == user_id) & (Friend.friend_id == User.id),
-            (Friend.friend_id == user_id) & (Friend.user_id == User.id)
-        )
-    ).filter(Friend.status == 'accepted').all()
+    # Every friendship is stored in both directions, so this is one index range scan
+    accepted_friends = (User.query
+                        .join(Friendship, Friendship.friend_id == User.id)
+                        .filter(Friendship.user_id == user_id)
+                        .all())
 
     return render_template('users/user_friends.html', user=user, friends=accepted_friends)
 
 
-@app.route('/favorites/<int:favorite_id>/remove', methods=["POST"])
+@bp.route('/feed')
+def feed():
+    """Show the current user's friends' recent activity, newest first."""
+
+    if not g.user:
+        flash("Access unauthorized.", "danger")
+        return redirect("/")
+
+    before = request.args.get('before', type=int)
+    activities, next_cursor = Activity.timeline(g.user.id, before=before)
+    return render_template('users/feed.html', activities=activities, next_cursor=next_cursor)
+
+
+@bp.route('/users/suggestions')
+def friend_suggestions():
+    """Show people the current user may know, ranked by mutual friends and shared favorites."""
+
+    if not g.user:
+        flash("Access unauthorized.", "danger")
+        return redirect("/")
+
+    suggestions = FriendSuggestion.for_user(g.user.id, limit=24)
+    return render_template('users/suggestions.html', suggestions=suggestions)
+
+
+@bp.route('/favorites/<int:favorite_id>/remove', methods=["POST"])
 def remove_favorite(favorite_id):
     """Remove a recipe from the user's favorites."""
     
@@ -276,17 +400,19 @@ def remove_favorite(favorite_id):
         return redirect("/")
 
     # Delete the favorite
+    FriendSuggestion.favorite_changed(g.user.id, favorite.recipe_id, favorite.spoonacular_id, -1)
+    Activity.retract(g.user.id, 'favorite', favorite.recipe_id, favorite.spoonacular_id)
     db.session.delete(favorite)
     db.session.commit()
 
     flash("Recipe removed from favorites.", "success")
-    return redirect(url_for('user_favorites', user_id=g.user.id))
+    return redirect(url_for('main.user_favorites', user_id=g.user.id))
 
 
 ##############################################################################
 # Recipe routes:
 
-@app.route('/recipes/new', methods=["GET", "POST"])
+@bp.route('/recipes/new', methods=["GET", "POST"])
 def recipes_add():
     """Add a new recipe:
     GET request will show form
@@ -309,6 +435,9 @@ def recipes_add():
         )
 
         db.session.add(recipe)
+        db.session.flush()
+        if recipe.is_public:
+            Activity.record(g.user.id, 'recipe', recipe_id=recipe.id, title=recipe.title)
         db.session.commit()
         flash('Recipe added successfully!', 'success')
         return redirect(f"/users/{g.user.id}/recipes")  # Redirect to user's recipe list
@@ -316,7 +445,65 @@ def recipes_add():
     return render_template('recipes/new.html', form=form)
 
 
-@app.route('/recipes/<int:recipe_id>/delete', methods=["POST"])
+@bp.route('/recipes/import', methods=["GET", "POST"])
+def import_recipes():
+    """Import recipes in bulk from an uploaded JSON Lines or CSV file.
+
+    Small files are imported during the request. Larger ones are saved to
+    IMPORT_DIR and imported by a background worker.
+    """
+
+    if not g.user:
+        flash("Access unauthorized.", "danger")
+        return redirect("/")
+
+    form = RecipeImportForm()
+
+    if form.validate_on_submit():
+        upload = form.file.data
+        format = format_for(upload.filename)
+        upload.stream.seek(0, os.SEEK_END)
+        size = upload.stream.tell()
+        upload.stream.seek(0)
+
+        if size > current_app.config['IMPORT_INLINE_MAX_BYTES']:
+            os.makedirs(current_app.config['IMPORT_DIR'], exist_ok=True)
+            path = os.path.join(current_app.config['IMPORT_DIR'], f"{uuid.uuid4().hex}.{format}")
+            upload.save(path)
+            # Batches are committed as they go, so a retry would import them twice
+            get_queue().enqueue('import_recipes', {'path': path, 'user_id': g.user.id, 'format': format},
+                                max_attempts=1)
+            flash("Your recipes are being imported in the background.", "info")
+            return redirect(f"/users/{g.user.id}/recipes")
+
+        stream = io.TextIOWrapper(upload.stream, encoding='utf-8', errors='replace', newline='')
+        result = import_recipe_stream(stream, g.user.id, format)
+        flash(f"Imported {result.imported} recipes.", "success")
+        if result.rejected:
+            line, errors = result.errors[0]
+            field, messages = next(iter(errors.items()))
+            flash(f"Skipped {result.rejected} invalid rows; the first was line {line} ({field}: {messages[0]})",
+                  "warning")
+        return redirect(f"/users/{g.user.id}/recipes")
+
+    return render_template('recipes/import.html', form=form)
+
+
+@bp.route('/export/<any(recipes, favorites):what>.<any(jsonl, csv):format>')
+def export_data(what, format):
+    """Download the logged-in user's recipes or favorites, streamed as they're read."""
+
+    if not g.user:
+        flash("Access unauthorized.", "danger")
+        return redirect("/")
+
+    export = export_recipes if what == 'recipes' else export_favorites
+    mimetype = 'text/csv' if format == 'csv' else 'application/x-ndjson'
+    return Response(stream_with_context(export(g.user.id, format)), mimetype=mimetype,
+                    headers={'Content-Disposition': f'attachment; filename="foodfriends-{what}.{format}"'})
+
+
+@bp.route('/recipes/<int:recipe_id>/delete', methods=["POST"])
 def delete_recipe(recipe_id):
     """Delete a recipe."""
     
@@ -326,8 +513,13 @@ def delete_recipe(recipe_id):
         flash("Access unauthorized.", "danger")
         return redirect("/")
     
-    # Delete any favorites associated with this recipe
+    # Delete any favorites and ratings associated with this recipe, and take it out of feeds
+    for (user_id,) in db.session.query(Favorite.user_id).filter_by(recipe_id=recipe_id):
+        fragments.touch(db.session, 'user', user_id)
     Favorite.query.filter_by(recipe_id=recipe_id).delete()
+    Rating.query.filter_by(recipe_id=recipe_id).delete()
+    RecipeRating.query.filter_by(recipe_id=recipe_id).delete()
+    Activity.forget_recipe(recipe_id)
 
     db.session.delete(recipe)
     db.session.commit()
@@ -336,8 +528,8 @@ def delete_recipe(recipe_id):
     return redirect(f"/users/{g.user.id}/recipes")
 
 
-@app.route('/recipes/<int:recipe_id>', methods=['GET'])
-@app.route('/recipes/spoonacular/<int:spoonacular_id>', methods=['GET'])
+@bp.route('/recipes/<int:recipe_id>', methods=['GET'])
+@bp.route('/recipes/spoonacular/<int:spoonacular_id>', methods=['GET'])
 def recipe_detail(recipe_id=None, spoonacular_id=None):
     """Display detailed information about a recipe."""
 
@@ -347,63 +539,199 @@ def recipe_detail(recipe_id=None, spoonacular_id=None):
         
         if recipe:
             # Render template for user-created recipe
-            return render_template('recipes/recipe_detail.html', recipe=recipe, is_user_created=True)
+            return render_template('recipes/recipe_detail.html', recipe=recipe, is_user_created=True,
+                                   **rating_context(recipe.id))
 
     elif spoonacular_id:
-        # Fetch the recipe from Spoonacular API using the spoonacular_id
-        api_recipe = Recipe.get_recipe_by_id(spoonacular_id)
+        # Use our local copy of the Spoonacular recipe, fetching it from the API the first time
+        api_recipe = Recipe.get_spoonacular_recipe(spoonacular_id)
         
         if api_recipe:
-            return render_template('recipes/recipe_detail.html', recipe=api_recipe, is_user_created=False)
+            # Ratings hang off the local row, which the fetch above wrote through
+            local_id = db.session.query(Recipe.id).filter_by(spoonacular_id=spoonacular_id).scalar()
+            return render_template('recipes/recipe_detail.html', recipe=api_recipe, is_user_created=False,
+                                   **rating_context(local_id))
 
     flash("Recipe not found.", "danger")
-    return redirect(url_for('homepage'))
+    return redirect(url_for('main.homepage'))
+
+
+def rating_context(recipe_id):
+    """Template variables for a recipe's ratings: its summary, recent reviews and the user's own rating."""
+
+    if recipe_id is None:
+        return {}
+
+    my_rating = Rating.query.filter_by(user_id=g.user.id, recipe_id=recipe_id).first() if g.user else None
+    return {
+        'rated_recipe_id': recipe_id,
+        'rating_summary': db.session.get(RecipeRating, recipe_id),
+        'reviews': Rating.reviews_for(recipe_id),
+        'my_rating': my_rating,
+        'rating_form': RatingForm(obj=my_rating),
+    }
+
+
+def recipe_url(recipe):
+    """The detail page URL for a local Recipe row."""
+
+    if recipe.spoonacular_id:
+        return url_for('main.recipe_detail', spoonacular_id=recipe.spoonacular_id)
+    return url_for('main.recipe_detail', recipe_id=recipe.id)
+
+
+@bp.route('/recipes/<int:recipe_id>/rate', methods=['POST'])
+def rate_recipe(recipe_id):
+    """Rate and optionally review a recipe, replacing any earlier rating by this user."""
+
+    if not g.user:
+        flash("You must be logged in to rate a recipe.", "danger")
+        return redirect(url_for('main.login'))
+
+    recipe = Recipe.query.get_or_404(recipe_id)
+    if not recipe.is_public and recipe.user_id != g.user.id:
+        flash("Access unauthorized.", "danger")
+        return redirect("/")
+
+    form = RatingForm()
+    if not form.validate_on_submit():
+        flash("Please choose a rating from 1 to 5 stars.", "danger")
+        return redirect(recipe_url(recipe))
+
+    Rating.rate(g.user.id, recipe.id, form.rating.data, (form.review.data or '').strip() or None)
+    if recipe.spoonacular_id or recipe.is_public:
+        # Friends see the latest rating only
+        source = {'spoonacular_id': recipe.spoonacular_id} if recipe.spoonacular_id else {'recipe_id': recipe.id}
+        Activity.retract(g.user.id, 'rating', **source)
+        Activity.record(g.user.id, 'rating', title=recipe.title, rating=form.rating.data, **source)
+    db.session.commit()
+
+    flash("Thanks for rating this recipe!", "success")
+    return redirect(recipe_url(recipe))
+
+
+@bp.route('/recipes/<int:recipe_id>/rating/delete', methods=['POST'])
+def delete_rating(recipe_id):
+    """Remove the logged-in user's rating of a recipe."""
+
+    if not g.user:
+        flash("Access unauthorized.", "danger")
+        return redirect("/")
+
+    recipe = Recipe.query.get_or_404(recipe_id)
+    if Rating.unrate(g.user.id, recipe.id):
+        Activity.retract(g.user.id, 'rating', recipe_id=None if recipe.spoonacular_id else recipe.id,
+                         spoonacular_id=recipe.spoonacular_id)
+        db.session.commit()
+        flash("Rating removed.", "info")
+    else:
+        flash("You haven't rated this recipe.", "warning")
+
+    return redirect(recipe_url(recipe))
+
+
+@bp.route('/recipes/top')
+def top_rated_recipes():
+    """Show the highest rated public recipes."""
+
+    return render_template('recipes/top_rated.html', top_rated=RecipeRating.top_rated(limit=20))
+
+
+@bp.route('/recipes/pantry')
+@bp.route('/recipes/pantry.<any(json):format>')
+def pantry_search(format='html'):
+    """Rank public recipes by how many of their ingredients are in the pantry (?items=eggs, flour, milk)."""
+
+    items = [item.strip() for item in request.args.get('items', '').replace('\n', ',').split(',') if item.strip()]
+    max_missing = request.args.get('max_missing', type=int)
+
+    results, unknown = [], []
+    if items:
+        index = get_pantry_index()
+        ingredient_ids, unknown = index.lookup(items)
+        ranked = index.search(ingredient_ids, limit=PANTRY_RESULTS, max_missing=max_missing)
+        recipes = {recipe.id: recipe for recipe in
+                   Recipe.query.filter(Recipe.id.in_([recipe_id for recipe_id, _, _ in ranked]),
+                                       Recipe.is_public.is_(True))}
+        results = [{'recipe': recipes[recipe_id], 'matched': matched, 'missing': missing,
+                    'coverage': matched / (matched + missing)}
+                   for recipe_id, matched, missing in ranked if recipe_id in recipes]
+
+    if format == 'json':
+        return jsonify(unknown=unknown, results=[
+            {'id': result['recipe'].id, 'spoonacular_id': result['recipe'].spoonacular_id,
+             'title': result['recipe'].title, 'url': recipe_url(result['recipe']),
+             'matched': result['matched'], 'missing': result['missing'], 'coverage': result['coverage']}
+            for result in results])
+
+    return render_template('recipes/pantry.html', items=items, max_missing=max_missing,
+                           unknown=unknown, results=results)
 
 
 ##############################################################################
 # General function routes:
 
-@app.route('/search', methods=["GET", "POST"])
+@bp.route('/search', methods=["GET", "POST"])
 def search_recipes():
-    """Search for recipes from Spoonacular API"""
+    """Search our users' public recipes, topping up from Spoonacular when there are few matches.
+
+    POST comes from the search form; GET (?query=...&page=...) is used by the
+    pagination links.
+    """
     
     form = SearchForm()
 
-    if form.validate_on_submit():
-        query = form.query.data.strip()  # Get the search query from the form
+    if request.method == 'POST':
+        query = form.query.data.strip() if form.validate_on_submit() else ''
+    else:
+        query = request.args.get('query', '').strip()
+        form.query.data = query
+
+    if not query:
+        flash("Invalid search query!", "danger")
+        return redirect(url_for('main.homepage'))
 
-        # Fetch search results from Spoonacular
+    page = max(1, request.args.get('page', 1, type=int))
+    local_results, has_next = Recipe.search_local(query, page=page)
+
+    # Only spend a Spoonacular call when our own recipes don't give enough results
+    search_results = []
+    if page == 1 and len(local_results) < current_app.config['SEARCH_MIN_LOCAL_RESULTS']:
         search_results = Recipe.search_recipes(query)
 
-        return render_template('search_results.html', query=query, recipes=search_results, form=form)
-    
-    flash("Invalid search query!", "danger")
-    return redirect(url_for('homepage'))
+    return render_template('search_results.html', query=query, form=form, page=page, has_next=has_next,
+                           local_recipes=local_results, recipes=search_results)
 
 
-@app.route('/search-users', methods=["GET", "POST"])
+@bp.route('/search-users', methods=["GET", "POST"])
 def search_users():
     """Search for users by username."""
     
     query = request.args.get("query")
-    page = request.args.get("page", 1, type=int)
     
     # Query users with a filter based on the search term
-    users = User.query.filter(User.username.ilike(f"%{query}%")).paginate(page=page, per_page=12)
+    users = User.keyset_page(search=query, after=request.args.get('after'),
+                             before=request.args.get('before'), per_page=12)
 
-     # Debugging: Print the count of retrieved users
-    print(f"Query: {query}, Users Found: {users.total}")
-    
     return render_template('/users/all_users.html', users=users, search_query=query)
 
 
+@bp.route('/users/autocomplete')
+def autocomplete_users():
+    """Return usernames starting with ?q= as JSON, for the navbar search."""
+
+    prefix = request.args.get('q', '')[:50]
+    limit = min(request.args.get('limit', 10, type=int), 25)
+    return jsonify(get_username_index().search(prefix, limit))
 
 
-@app.route('/add_to_favorites', methods=['POST'])
+
+
+@bp.route('/add_to_favorites', methods=['POST'])
 def add_to_favorites():
     if not g.user:
         flash("You must be logged in to favorite a recipe.", "danger")
-        return redirect(url_for('login'))
+        return redirect(url_for('main.login'))
 
     # Get recipe_id and spoonacular_id from form data and convert empty strings to None
     recipe_id = request.form.get('recipe_id') or None
@@ -419,6 +747,12 @@ def add_to_favorites():
     if favorite:
         flash("Recipe is already in your favorites.", "info")
     else:
+        if spoonacular_id:
+            # Use our local copy if there is one; otherwise a worker fetches it after the commit
+            recipe = Recipe.query.filter_by(spoonacular_id=spoonacular_id).first()
+        else:
+            recipe = Recipe.query.get(recipe_id)
+
         # Create a new Favorite entry, passing None where fields are empty
         new_favorite = Favorite(
             user_id=g.user.id,
@@ -426,14 +760,23 @@ def add_to_favorites():
             spoonacular_id=spoonacular_id if spoonacular_id else None,
         )
         db.session.add(new_favorite)
+        FriendSuggestion.favorite_changed(g.user.id, new_favorite.recipe_id, new_favorite.spoonacular_id, 1)
+        if spoonacular_id:
+            Activity.record(g.user.id, 'favorite', spoonacular_id=spoonacular_id,
+                            title=recipe.title if recipe else None)
+        elif recipe and recipe.is_public:
+            Activity.record(g.user.id, 'favorite', recipe_id=recipe.id, title=recipe.title)
         db.session.commit()
+
+        if spoonacular_id and not recipe:
+            enqueue('prefetch_recipes', {'ids': [int(spoonacular_id)]}, priority=PRIORITY_HIGH)
         
         flash("Recipe added to your favorites!", "success")
 
-    return redirect(request.referrer or url_for('homepage'))
+    return redirect(request.referrer or url_for('main.homepage'))
 
 
-@app.route('/users/<int:user_id>')
+@bp.route('/users/<int:user_id>')
 def show_user(user_id):
     """Show the profile page for a specific user."""
     user = User.query.get_or_404(user_id)
@@ -450,12 +793,12 @@ def show_user(user_id):
 # Friend Request routes:
 
 
-@app.route('/users/<int:friend_id>/add', methods=['POST'])
+@bp.route('/users/<int:friend_id>/add', methods=['POST'])
 def add_friend(friend_id):
     """Send a friend request to another user."""
     if not g.user:
         flash("You need to be logged in to add friends.", "danger")
-        return redirect(url_for('login'))
+        return redirect(url_for('main.login'))
 
     existing_friendship = Friend.query.filter_by(user_id=g.user.id, friend_id=friend_id).first()
     if existing_friendship:
@@ -466,34 +809,35 @@ def add_friend(friend_id):
         db.session.commit()
         flash("Friend request sent!", "success")
 
-    return redirect(url_for('find_users'))
+    return redirect(url_for('main.find_users'))
 
 
 # Route to accept a friend request
-@app.route('/users/<int:friend_id>/accept', methods=['POST'])
+@bp.route('/users/<int:friend_id>/accept', methods=['POST'])
 def accept_friend(friend_id):
     """Accept a friend request."""
     if not g.user:
         flash("You need to be logged in to accept friend requests.", "danger")
-        return redirect(url_for('login'))
+        return redirect(url_for('main.login'))
     
     friend_request = Friend.query.filter_by(user_id=friend_id, friend_id=g.user.id, status='pending').first()
     if friend_request:
         friend_request.status = 'accepted'
+        Friendship.link(friend_id, g.user.id)
         db.session.commit()
         flash("Friend request accepted!", "success")
     else:
         flash("No pending friend request found.", "warning")
 
-    return redirect(url_for('user_homepage', user_id=g.user.id))
+    return redirect(url_for('main.user_homepage', user_id=g.user.id))
 
 # Route to reject a friend request
-@app.route('/users/<int:friend_id>/reject', methods=['POST'])
+@bp.route('/users/<int:friend_id>/reject', methods=['POST'])
 def reject_friend(friend_id):
     """Reject a friend request."""
     if not g.user:
         flash("You need to be logged in to reject friend requests.", "danger")
-        return redirect(url_for('login'))
+        return redirect(url_for('main.login'))
     
     friend_request = Friend.query.filter_by(user_id=friend_id, friend_id=g.user.id, status='pending').first()
     if friend_request:
@@ -503,4 +847,233 @@ def reject_friend(friend_id):
     else:
         flash("No pending friend request found.", "warning")
 
-    return redirect(url_for('user_homepage', user_id=g.user.id))
+    return redirect(url_for('main.user_homepage', user_id=g.user.id))
+
+# Route to remove an accepted friend
+@bp.route('/users/<int:friend_id>/unfriend', methods=['POST'])
+def remove_friend(friend_id):
+    """Remove a friend."""
+    if not g.user:
+        flash("You need to be logged in to remove friends.", "danger")
+        return redirect(url_for('main.login'))
+
+    if Friendship.unlink(g.user.id, friend_id):
+        Friend.query.filter(db.or_(
+            (Friend.user_id == g.user.id) & (Friend.friend_id == friend_id),
+            (Friend.user_id == friend_id) & (Friend.friend_id == g.user.id),
+        )).delete(synchronize_session=False)
+        # Bulk deletes skip the ORM events that invalidate cached profile cards
+        fragments.touch(db.session, 'user', g.user.id)
+        fragments.touch(db.session, 'user', friend_id)
+        db.session.commit()
+        flash("Friend removed.", "info")
+    else:
+        flash("You are not friends with this user.", "warning")
+
+    return redirect(url_for('main.user_homepage', user_id=friend_id))
+
+
+@bp.route('/images/<any(sm, md, lg):size>/<signature>')
+def image_proxy(size, signature):
+    """Serve a cached thumbnail of the remote image in ?url=, made on first request.
+
+    Thumbnails are named by their content hash, so they can be cached forever.
+    If the source can't be fetched, redirect to it and let the browser try.
+    """
+
+    url = request.args.get('url', '')
+    if not hmac.compare_digest(signature, images.sign(url)):
+        abort(404)
+
+    try:
+        digest, path = images.get_thumbnail(url, size)
+    except images.ImageProxyError:
+        response = redirect(url)
+        response.cache_control.max_age = images.FAILURE_TTL
+        return response
+
+    response = send_file(path, mimetype='image/webp', etag=digest, max_age=365 * 24 * 60 * 60, conditional=True)
+    response.cache_control.public = True
+    response.cache_control.immutable = True
+    return response
+
+
+@bp.route('/metrics')
+def metrics_endpoint():
+    """Expose the metrics of every web worker process in the Prometheus text format."""
+
+    token = current_app.config.get('METRICS_TOKEN')
+    if token and request.headers.get('Authorization') != f"Bearer {token}":
+        return Response("Unauthorized\n", status=401)
+
+    directory = current_app.config.get('METRICS_MULTIPROC_DIR')
+    if directory:
+        metrics.get_writer(current_app._get_current_object()).write()
+        return Response(metrics.REGISTRY.render_multiprocess(directory), content_type=metrics.CONTENT_TYPE)
+    if request.environ.get('wsgi.multiprocess'):
+        # Each scrape would land on a different worker and see only its numbers
+        return Response("Set METRICS_MULTIPROC_DIR to serve metrics from more than one worker process\n",
+                        status=503)
+
+    return Response(metrics.REGISTRY.render(), content_type=metrics.CONTENT_TYPE)
+
+
+##############################################################################
+# CLI commands:
+
+
+@bp.cli.command('refresh-recipes')
+@click.option('--max-age-hours', default=24, show_default=True,
+              help="Re-fetch local Spoonacular recipes older than this.")
+@click.option('--batch-size', default=50, show_default=True,
+              help="Recipes fetched per informationBulk request.")
+@click.option('--enqueue', 'in_background', is_flag=True,
+              help="Leave the refresh to `flask worker` instead of running it here.")
+def refresh_recipes(max_age_hours, batch_size, in_background):
+    """Refresh stale local copies of Spoonacular recipes in batches."""
+
+    # fetched_at is stored as naive UTC, so compare against naive UTC
+    cutoff = datetime.now(timezone.utc).replace(tzinfo=None) - timedelta(hours=max_age_hours)
+    if in_background:
+        enqueue('refresh_recipes', {'cutoff': cutoff.isoformat(), 'batch_size': batch_size},
+                priority=PRIORITY_LOW)
+        click.echo("Queued a refresh of stale Spoonacular recipes.")
+        return
+
+    total = 0
+    while True:
+        refreshed = Recipe.refresh_stale_spoonacular_recipes(cutoff, batch_size=batch_size)
+        if not refreshed:
+            break
+        total += refreshed
+
+    click.echo(f"Refreshed {total} Spoonacular recipes.")
+
+
+@bp.cli.command('backfill-friendships')
+def backfill_friendships():
+    """Rebuild the friendships edge table and friend counts from accepted requests."""
+
+    edges = Friendship.backfill()
+    db.session.commit()
+    click.echo(f"Wrote {edges} friendship edges.")
+
+
+@bp.cli.command('rebuild-suggestions')
+@click.option('--batch-size', default=100, show_default=True,
+              help="Users recomputed per transaction.")
+def rebuild_suggestions(batch_size):
+    """Recompute every user's friend suggestions from the friendships table."""
+
+    last_id = 0
+    total = 0
+    while True:
+        user_ids = [user_id for (user_id,) in
+                    db.session.query(User.id).filter(User.id > last_id).order_by(User.id).limit(batch_size)]
+        if not user_ids:
+            break
+
+        FriendSuggestion.rebuild(user_ids)
+        db.session.commit()
+        last_id = user_ids[-1]
+        total += len(user_ids)
+
+    click.echo(f"Rebuilt suggestions for {total} users.")
+
+
+@bp.cli.command('worker')
+@click.option('--processes', default=1, show_default=True, help="Worker processes to fork.")
+@click.option('--threads', default=4, show_default=True, help="Threads running jobs in each process.")
+@click.option('--poll-interval', default=1.0, show_default=True,
+              help="Seconds an idle thread waits before checking the queue again.")
+@click.option('--metrics-port', type=int, default=None,
+              help="Serve Prometheus metrics from this port (one port per process, counting up).")
+def worker(processes, threads, poll_interval, metrics_port):
+    """Run background jobs until interrupted."""
+
+    click.echo(f"Running jobs with {processes} process(es) x {threads} thread(s).")
+    run_workers(current_app._get_current_object(), processes=processes, threads=threads, poll_interval=poll_interval,
+                metrics_port=metrics_port)
+
+
+@bp.cli.command('import-recipes')
+@click.argument('path', type=click.Path(exists=True, dir_okay=False, allow_dash=True))
+@click.option('--user-id', type=int, required=True, help="Owner of the imported recipes.")
+@click.option('--format', 'format', type=click.Choice(FORMATS),
+              help="Input format; guessed from the file extension by default.")
+@click.option('--batch-size', default=IMPORT_BATCH_SIZE, show_default=True,
+              help="Recipes inserted per transaction.")
+def import_recipes_command(path, user_id, format, batch_size):
+    """Stream-import recipes from a JSON Lines or CSV file ('-' for stdin)."""
+
+    if not db.session.get(User, user_id):
+        raise click.BadParameter(f"no user with id {user_id}", param_hint='--user-id')
+
+    format = format or format_for(path)
+    with (open(path, encoding='utf-8', newline='') if path != '-' else sys.stdin) as stream:
+        result = import_recipe_stream(stream, user_id, format, batch_size=batch_size)
+
+    for line, errors in result.errors[:10]:
+        click.echo(f"line {line}: {errors}", err=True)
+    click.echo(f"Imported {result.imported} recipes, skipped {result.rejected} invalid rows.")
+
+
+@bp.cli.command('export-recipes')
+@click.option('--user-id', type=int, required=True)
+@click.option('--favorites', is_flag=True, help="Export the user's favorites instead of their recipes.")
+@click.option('--format', 'format', type=click.Choice(FORMATS), default='jsonl', show_default=True)
+@click.option('--output', type=click.File('w', encoding='utf-8', lazy=True), default='-',
+              help="File to write to; stdout by default.")
+def export_recipes_command(user_id, favorites, format, output):
+    """Stream a user's recipes or favorites out as JSON Lines or CSV."""
+
+    export = export_favorites if favorites else export_recipes
+    for chunk in export(user_id, format):
+        output.write(chunk)
+
+
+@bp.cli.command('index-ingredients')
+@click.option('--batch-size', default=1000, show_default=True, help="Recipes parsed per transaction.")
+def index_ingredients(batch_size):
+    """Parse every recipe's ingredients into the ingredient tables the pantry search reads."""
+
+    last_id = 0
+    total = 0
+    while True:
+        recipes = db.session.execute(
+            db.select(Recipe.id, Recipe.ingredients)
+            .where(Recipe.id > last_id)
+            .order_by(Recipe.id)
+            .limit(batch_size)
+        ).all()
+        if not recipes:
+            break
+
+        index_recipes(recipes)
+        db.session.commit()
+        last_id = recipes[-1].id
+        total += len(recipes)
+
+    click.echo(f"Indexed the ingredients of {total} recipes.")
+
+
+@bp.cli.command('calibrate-passwords')
+@click.option('--target-ms', type=int, default=None,
+              help="Milliseconds per hash to aim for; BCRYPT_TARGET_MS by default.")
+def calibrate_passwords(target_ms):
+    """Print the bcrypt cost that takes about the target time per hash on this machine."""
+
+    target_ms = target_ms or current_app.config['BCRYPT_TARGET_MS']
+    click.echo(f"BCRYPT_LOG_ROUNDS={calibrate(target_ms)}")
+
+
+@bp.cli.command('jobs-status')
+def jobs_status():
+    """Show how many jobs are queued, running and failed."""
+
+    for name, value in get_queue().depth().items():
+        click.echo(f"{name}: {value:g}")
+
+
+# The app that `gunicorn app:app`, `flask` and the tests use
+app = create_app()
@@ -0,0 +1,85 @@
+import bisect, threading, time
+
+from flask import current_app
+
+from models import db, User
+
+
+DEFAULT_LIMIT = 10
+DEFAULT_REFRESH_SECONDS = 30
+
+_index_lock = threading.Lock()
+
+
+class UsernameIndex:
+    """Case-insensitive username prefix index kept in a sorted array.
+
+    A prefix lookup is one bisect plus a scan of the matches, so it doesn't
+    touch the database. Each process builds its own copy with a single
+    (id, username) query. Users who sign up in this process are added
+    straight away. Users who sign up in other processes are picked up by
+    `catch_up`, which loads only rows with ids above the highest one seen.
+    """
+
+    def __init__(self):
+        self._keys = []
+        self._entries = []
+        self.max_id = 0
+        self.refreshed_at = 0.0
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._keys)
+
+    def add(self, username, user_id):
+        key = (username.casefold(), user_id)
+        with self._lock:
+            index = bisect.bisect_left(self._keys, key)
+            if index < len(self._keys) and self._keys[index] == key:
+                return
+            self._keys.insert(index, key)
+            self._entries.insert(index, {'id': user_id, 'username': username})
+            self.max_id = max(self.max_id, user_id)
+
+    def search(self, prefix, limit=DEFAULT_LIMIT):
+        """Return up to `limit` {'id', 'username'} dicts whose username starts with `prefix`."""
+        prefix = prefix.casefold()
+        if not prefix:
+            return []
+        with self._lock:
+            start = bisect.bisect_left(self._keys, (prefix,))
+            end = bisect.bisect_left(self._keys, (prefix + '\U0010ffff',), start, min(start + limit, len(self._keys)))
+            return self._entries[start:end]
+
+    def catch_up(self):
+        """Add users created since the last load (by this or any other process)."""
+        rows = (db.session.query(User.id, User.username)
+                .filter(User.id > self.max_id)
+                .order_by(User.id)
+                .all())
+        for user_id, username in rows:
+            self.add(username, user_id)
+        self.refreshed_at = time.monotonic()
+        return len(rows)
+
+
+def get_username_index():
+    """Return this process's username index, loading it on first use and catching up when stale."""
+
+    index = current_app.extensions.get('username_index')
+    if index is None:
+        with _index_lock:
+            index = current_app.extensions.get('username_index')
+            if index is None:
+                index = UsernameIndex()
+                index.catch_up()
+                current_app.extensions['username_index'] = index
+
+    refresh = current_app.config.get('AUTOCOMPLETE_REFRESH_SECONDS', DEFAULT_REFRESH_SECONDS)
+    if time.monotonic() - index.refreshed_at > refresh and _index_lock.acquire(blocking=False):
+        # One thread catches up while the others keep answering from what's loaded
+        try:
+            index.catch_up()
+        finally:
+            _index_lock.release()
+    return index
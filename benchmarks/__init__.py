@@ -0,0 +1 @@
+"""Benchmarks for FoodFriends' hot paths. Run each module with `python -m benchmarks.<name>`."""
@@ -0,0 +1,139 @@
+"""A local stand-in for the Spoonacular API.
+
+Answers the endpoints models.py calls (/recipes/random,
+/recipes/{id}/information, /recipes/informationBulk and
+/recipes/complexSearch) with made-up recipes after a configurable delay,
+failing a configurable fraction of requests with 429/500s, so load tests
+measure our own behaviour rather than Spoonacular's.
+
+    python -m benchmarks.fake_spoonacular --port 8089 --latency 0.2 --jitter 0.05 --error-rate 0.01
+
+then run the app with SPOONACULAR_BASE_URL=http://127.0.0.1:8089.
+"""
+import argparse
+import json
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+
+def fake_recipe(recipe_id):
+    """Full recipe information payload for `recipe_id`."""
+
+    return {
+        "id": recipe_id,
+        "title": f"Fake Recipe {recipe_id}",
+        "image": f"https://img.spoonacular.com/recipes/{recipe_id}-556x370.jpg",
+        "sourceUrl": f"https://example.com/recipes/{recipe_id}",
+        "instructions": "<ol><li>Chop everything.</li><li>Cook it.</li><li>Serve.</li></ol>",
+        "extendedIngredients": [{"name": name} for name in ("salt", "olive oil", "garlic", "onion")],
+    }
+
+
+class FakeSpoonacularHandler(BaseHTTPRequestHandler):
+    latency = 0.0
+    jitter = 0.0
+    error_rate = 0.0
+    seed = 0
+    seen = {}
+    seen_lock = threading.Lock()
+
+    def request_rng(self):
+        """A generator for this request alone, seeded from its path and how often that path was asked for.
+
+        Handler threads don't share one, and the nth request for a path
+        gets the same jitter and failure however requests interleave.
+        """
+        with self.seen_lock:
+            count = self.seen[self.path] = self.seen.get(self.path, 0) + 1
+        return random.Random(f"{self.seed}-{self.path}-{count}")
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        query = parse_qs(url.query)
+        rng = self.request_rng()
+        time.sleep(max(0.0, self.latency + rng.uniform(-self.jitter, self.jitter)))
+
+        if rng.random() < self.error_rate:
+            status = rng.choice((429, 500, 503))
+            return self.send_json({"status": "failure", "code": status}, status=status)
+
+        # Recipe IDs ending in 404 don't exist, to exercise not-found handling
+        match = re.fullmatch(r"/recipes/(\d+)/information", url.path)
+        if match and match.group(1).endswith("404"):
+            return self.send_json({"status": "failure", "message": "Not found"}, status=404)
+
+        if url.path == "/recipes/random":
+            number = int(query.get("number", ["1"])[0])
+            start = rng.randrange(1, 100000)
+            return self.send_json({"recipes": [fake_recipe(start + i) for i in range(number)]})
+
+        if url.path == "/recipes/informationBulk":
+            ids = [int(i) for i in query.get("ids", [""])[0].split(",") if i]
+            return self.send_json([fake_recipe(i) for i in ids if not str(i).endswith("404")])
+
+        if match:
+            return self.send_json(fake_recipe(int(match.group(1))))
+
+        if url.path == "/recipes/complexSearch":
+            term = query.get("query", [""])[0]
+            number = int(query.get("number", ["10"])[0])
+            results = [{"id": i, "title": f"{term.title()} {i}", "image": fake_recipe(i)["image"]}
+                       for i in range(1, number + 1)]
+            return self.send_json({"results": results, "totalResults": number})
+
+        self.send_json({"status": "failure", "message": "Not found"}, status=404)
+
+    def send_json(self, payload, status=200):
+        body = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_server(host="127.0.0.1", port=0, latency=0.0, jitter=0.0, error_rate=0.0, seed=0):
+    """Start the fake API on a background thread and return the server (see server_address).
+
+    Each response waits `latency` +/- `jitter` seconds, and `error_rate` of
+    requests fail. Failures are drawn from generators seeded with `seed`
+    so runs are repeatable.
+    """
+
+    handler = type("Handler", (FakeSpoonacularHandler,), {
+        "latency": latency, "jitter": jitter, "error_rate": error_rate, "seed": seed,
+        "seen": {}, "seen_lock": threading.Lock(),
+    })
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8089)
+    parser.add_argument("--latency", type=float, default=0.2, help="Seconds to wait before each response.")
+    parser.add_argument("--jitter", type=float, default=0.0, help="Random +/- seconds added to the latency.")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fraction of requests that fail.")
+    parser.add_argument("--seed", type=int, default=0, help="Seed for jitter and failures.")
+    args = parser.parse_args()
+
+    server = start_server(args.host, args.port, args.latency, args.jitter, args.error_rate, args.seed)
+    print(f"Fake Spoonacular listening on http://{args.host}:{server.server_address[1]}")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
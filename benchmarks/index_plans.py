@@ -0,0 +1,164 @@
+"""Show how the hot-path indexes change query plans on a large dataset.
+
+Seeds a scratch Postgres database with `--rows` users, recipes, favorites
+and friend rows (1,000,000 by default) using generate_series, then prints
+EXPLAIN ANALYZE for the queries behind the profile, favorites, friends and
+user search routes: first without the indexes from models.py, then with
+them.
+
+    createdb food_friends_bench
+    python -m benchmarks.index_plans --database-url postgresql:///food_friends_bench
+
+Everything in the target database is dropped first, so never point this at
+a real one.
+"""
+import argparse
+import time
+
+from sqlalchemy import create_engine, text
+
+from models import db
+
+
+# Indexes and unique constraints from models.py that the hot queries rely on
+HOT_INDEXES = [
+    ('users', 'ix_users_username_trgm'),
+    ('recipes', 'ix_recipes_user_id'),
+    ('favorites', 'uq_favorites_user_recipe'),
+    ('favorites', 'uq_favorites_user_spoonacular'),
+    ('favorites', 'ix_favorites_recipe_id'),
+    ('friends', 'uq_friends_user_friend'),
+    ('friends', 'ix_friends_friend_id_status'),
+    ('friends', 'ix_friends_user_id_accepted'),
+    ('ratings', 'ix_ratings_recipe_id'),
+]
+
+# The queries app.py runs on every profile, favorites, friends and search view
+QUERIES = {
+    'user recipes': "SELECT count(*) FROM recipes WHERE user_id = :user_id",
+    'user favorites': "SELECT * FROM favorites WHERE user_id = :user_id",
+    'already favorited': "SELECT * FROM favorites WHERE user_id = :user_id AND spoonacular_id = :spoonacular_id",
+    'pending requests': "SELECT * FROM friends WHERE friend_id = :user_id AND status = 'pending'",
+    'friend count': (
+        "SELECT count(*) FROM friends WHERE (user_id = :user_id AND status = 'accepted')"
+        " OR (friend_id = :user_id AND status = 'accepted')"
+    ),
+    'recipe ratings': "SELECT * FROM ratings WHERE recipe_id = :recipe_id",
+    'search users': "SELECT * FROM users WHERE username ILIKE :pattern LIMIT 12",
+}
+
+
+def seed(conn, rows):
+    """Fill every hot table with `rows` rows of plausible data."""
+
+    print(f"Seeding {rows:,} rows per table...")
+    started = time.perf_counter()
+
+    conn.execute(text(
+        "INSERT INTO users (username, email, password, created_at)"
+        " SELECT 'user' || md5(i::text), 'user' || i || '@example.com', 'x', now()"
+        " FROM generate_series(1, :rows) AS i"
+    ), {'rows': rows})
+    conn.execute(text(
+        "INSERT INTO recipes (user_id, title, ingredients, instructions, is_public, created_at)"
+        " SELECT 1 + (i % :rows), 'Recipe ' || i, 'salt, pepper', 'Cook it.', true, now()"
+        " FROM generate_series(1, :rows) AS i"
+    ), {'rows': rows})
+    conn.execute(text(
+        "INSERT INTO favorites (user_id, spoonacular_id, favorited_at)"
+        " SELECT 1 + (i % :rows), i, now() FROM generate_series(1, :rows) AS i"
+    ), {'rows': rows})
+    conn.execute(text(
+        "INSERT INTO friends (user_id, friend_id, status, created_at)"
+        " SELECT 1 + (i % :rows), 1 + ((i * 7919) % :rows),"
+        "  CASE WHEN i % 5 = 0 THEN 'pending' ELSE 'accepted' END, now()"
+        " FROM generate_series(1, :rows) AS i"
+    ), {'rows': rows})
+    conn.execute(text(
+        "INSERT INTO ratings (user_id, recipe_id, rating, rated_at)"
+        " SELECT 1 + (i % :rows), 1 + ((i * 31) % :rows), 1 + (i % 5), now()"
+        " FROM generate_series(1, :rows) AS i"
+    ), {'rows': rows})
+
+    print(f"Seeded in {time.perf_counter() - started:.1f}s")
+
+
+def drop_hot_indexes(conn):
+    for table, name in HOT_INDEXES:
+        conn.execute(text(f"ALTER TABLE {table} DROP CONSTRAINT IF EXISTS {name}"))
+        conn.execute(text(f"DROP INDEX IF EXISTS {name}"))
+
+
+def create_hot_indexes(conn):
+    names = {name for _, name in HOT_INDEXES}
+    for table in db.metadata.sorted_tables:
+        for index in table.indexes:
+            if index.name in names:
+                index.create(conn)
+        for constraint in table.constraints:
+            if constraint.name in names:
+                columns = ", ".join(column.name for column in constraint.columns)
+                conn.execute(text(
+                    f"ALTER TABLE {table.name} ADD CONSTRAINT {constraint.name} UNIQUE ({columns})"))
+
+
+def scan_nodes(plan):
+    """Pull the scan steps (e.g. 'Seq Scan on users') out of an EXPLAIN plan."""
+
+    return [line.strip().lstrip('->').strip().split('  (')[0] for line in plan if 'Scan' in line]
+
+
+def explain_all(conn, params):
+    """EXPLAIN ANALYZE every hot query and return {name: (plan, execution ms)}."""
+
+    results = {}
+    for name, sql in QUERIES.items():
+        plan = [row[0] for row in conn.execute(text(f"EXPLAIN (ANALYZE, BUFFERS) {sql}"), params)]
+        execution_ms = next(
+            (float(line.split(':')[1].split()[0]) for line in plan if line.startswith('Execution Time')),
+            float('nan'))
+        results[name] = (plan, execution_ms)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--database-url', required=True, help="Scratch Postgres database to use.")
+    parser.add_argument('--rows', type=int, default=1_000_000, help="Rows per table.")
+    parser.add_argument('--verbose', action='store_true', help="Print full plans, not just the top node.")
+    args = parser.parse_args()
+
+    engine = create_engine(args.database_url)
+    params = {'user_id': args.rows // 2, 'recipe_id': args.rows // 2,
+              'spoonacular_id': args.rows // 2, 'pattern': '%abc1%'}
+
+    with engine.begin() as conn:
+        db.metadata.drop_all(conn)
+        db.metadata.create_all(conn)
+        drop_hot_indexes(conn)
+        seed(conn, args.rows)
+
+    with engine.begin() as conn:
+        conn.execute(text("ANALYZE"))
+        before = explain_all(conn, params)
+
+    with engine.begin() as conn:
+        started = time.perf_counter()
+        create_hot_indexes(conn)
+        print(f"Built indexes in {time.perf_counter() - started:.1f}s")
+        conn.execute(text("ANALYZE"))
+        after = explain_all(conn, params)
+
+    print(f"\n{'query':<20} {'before ms':>10} {'after ms':>10}  plan change")
+    for name in QUERIES:
+        before_plan, before_ms = before[name]
+        after_plan, after_ms = after[name]
+        print(f"{name:<20} {before_ms:>10.2f} {after_ms:>10.2f}  "
+              f"{', '.join(scan_nodes(before_plan))} -> {', '.join(scan_nodes(after_plan))}")
+        if args.verbose:
+            print("  before:\n    " + "\n    ".join(before_plan))
+            print("  after:\n    " + "\n    ".join(after_plan))
+
+
+if __name__ == '__main__':
+    main()
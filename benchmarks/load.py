@@ -0,0 +1,239 @@
+"""Scripted load scenarios for every route in app.py.
+
+Resets and seeds the target database, starts the fake Spoonacular API,
+then drives each scenario through Flask test clients on several threads.
+Reports p50/p95/p99 latency, throughput and SQL queries per request.
+
+    python -m benchmarks.load --database-url postgresql:///food_friends_bench \\
+        --output bench_output.txt
+    python -m benchmarks.load --database-url postgresql:///food_friends_bench \\
+        --compare bench_output.txt
+
+With --compare, any scenario whose p95 got more than --threshold slower, or
+which runs more queries per request than before, is reported as a
+regression and the command exits with status 1. The data, the request mix
+and the fake API's behaviour are all seeded, so runs on the same machine
+are comparable.
+"""
+import argparse
+import json
+import os
+import random
+import statistics
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+
+class Scenario:
+    """One route to exercise: `make_request(ctx, rng)` returns (method, url, form data)."""
+
+    def __init__(self, name, make_request, logged_in=True):
+        self.name = name
+        self.make_request = make_request
+        self.logged_in = logged_in
+
+
+def _user(ctx, rng):
+    return rng.choice(ctx['user_ids'])
+
+
+def _user_cursor(ctx, rng):
+    """A keyset cursor at a random seeded user, i.e. a random page of /users."""
+    user_id = _user(ctx, rng)
+    return f"bench{user_id}:{user_id}"
+
+
+# Pantry items: some in every seeded recipe, some in none
+PANTRY_ITEMS = ['chicken', 'garlic', 'olive oil', 'salt', 'eggs', 'flour', 'rice', 'tomatoes']
+
+
+SCENARIOS = [
+    Scenario('homepage', lambda ctx, rng: ('GET', '/', None)),
+    Scenario('homepage_anon', lambda ctx, rng: ('GET', '/', None), logged_in=False),
+    Scenario('login_page', lambda ctx, rng: ('GET', '/login', None), logged_in=False),
+    Scenario('login', lambda ctx, rng: (
+        'POST', '/login', {'username': f"bench{_user(ctx, rng)}", 'password': 'password'}), logged_in=False),
+    Scenario('find_users', lambda ctx, rng: (
+        'GET', f"/users?after={_user_cursor(ctx, rng)}", None)),
+    Scenario('search_users', lambda ctx, rng: ('GET', f"/search-users?query=bench{rng.randint(1, 99)}", None)),
+    Scenario('autocomplete_users', lambda ctx, rng: ('GET', f"/users/autocomplete?q=bench{rng.randint(1, 99)}", None)),
+    Scenario('user_homepage', lambda ctx, rng: ('GET', f"/users/{_user(ctx, rng)}", None)),
+    Scenario('user_recipes', lambda ctx, rng: ('GET', f"/users/{_user(ctx, rng)}/recipes", None)),
+    Scenario('user_favorites', lambda ctx, rng: ('GET', f"/users/{_user(ctx, rng)}/favorites", None)),
+    Scenario('user_friends', lambda ctx, rng: ('GET', f"/users/{_user(ctx, rng)}/friends", None)),
+    Scenario('feed', lambda ctx, rng: ('GET', '/feed', None)),
+    Scenario('friend_suggestions', lambda ctx, rng: ('GET', '/users/suggestions', None)),
+    Scenario('recipe_detail', lambda ctx, rng: ('GET', f"/recipes/{rng.choice(ctx['recipe_ids'])}", None)),
+    Scenario('top_rated', lambda ctx, rng: ('GET', "/recipes/top", None)),
+    Scenario('pantry', lambda ctx, rng: (
+        'GET', f"/recipes/pantry?items={','.join(rng.sample(PANTRY_ITEMS, rng.randint(2, 5)))}", None)),
+    Scenario('spoonacular_detail', lambda ctx, rng: (
+        'GET', f"/recipes/spoonacular/{rng.randint(1, ctx['spoonacular_ids'])}", None)),
+    Scenario('search_recipes', lambda ctx, rng: (
+        'POST', '/search', {'query': rng.choice(['chicken', 'pasta', 'soup', 'salad'])})),
+    Scenario('recipes_add', lambda ctx, rng: ('POST', '/recipes/new', {
+        'title': "Load test stew", 'ingredients': "beef, carrots, stock",
+        'instructions': "Brown the beef. Simmer everything.", 'is_public': 'y'})),
+    Scenario('add_to_favorites', lambda ctx, rng: (
+        'POST', '/add_to_favorites', {'spoonacular_id': rng.randint(1, ctx['spoonacular_ids'])})),
+    Scenario('add_friend', lambda ctx, rng: ('POST', f"/users/{_user(ctx, rng)}/add", None)),
+]
+
+
+class QueryCounter:
+    """Counts SQL statements per thread so each request's queries can be attributed to it."""
+
+    def __init__(self):
+        self._local = threading.local()
+
+    def __call__(self, *args):
+        self._local.count = self.count + 1
+
+    @property
+    def count(self):
+        return getattr(self._local, 'count', 0)
+
+
+def percentile(cuts, p):
+    return cuts[p - 1] * 1000
+
+
+def run_scenario(app, scenario, ctx, requests_per_scenario, concurrency, seed, counter):
+    """Run one scenario and return its stats dict."""
+
+    from app import CURR_USER_KEY
+
+    def worker(worker_id):
+        rng = random.Random(f"{seed}-{scenario.name}-{worker_id}")
+        client = app.test_client()
+        user_id = _user(ctx, rng)
+        if scenario.logged_in:
+            with client.session_transaction() as sess:
+                sess[CURR_USER_KEY] = user_id
+
+        samples = []
+        for _ in range(requests_per_scenario // concurrency):
+            method, url, data = scenario.make_request(ctx, rng)
+            before = counter.count
+            started = time.perf_counter()
+            response = client.open(url, method=method, data=data)
+            elapsed = time.perf_counter() - started
+            samples.append((elapsed, counter.count - before, response.status_code))
+        return samples
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        samples = [sample for result in executor.map(worker, range(concurrency)) for sample in result]
+    elapsed = time.perf_counter() - started
+
+    latencies = [sample[0] for sample in samples]
+    if len(latencies) > 1:
+        cuts = statistics.quantiles(latencies, n=100, method='inclusive')
+    else:
+        # quantiles() needs two samples; a single one is every percentile
+        cuts = latencies * 99
+    return {
+        'requests': len(samples),
+        'rps': len(samples) / elapsed,
+        'p50_ms': percentile(cuts, 50),
+        'p95_ms': percentile(cuts, 95),
+        'p99_ms': percentile(cuts, 99),
+        'queries_per_request': statistics.mean(sample[1] for sample in samples),
+        'errors': sum(1 for sample in samples if sample[2] >= 400),
+    }
+
+
+def compare(results, baseline, threshold):
+    """Return a list of human readable regressions against a previous run."""
+
+    regressions = []
+    for name, current in results.items():
+        previous = baseline.get(name)
+        if not previous:
+            continue
+        if current['p95_ms'] > previous['p95_ms'] * (1 + threshold):
+            regressions.append(f"{name}: p95 {previous['p95_ms']:.1f}ms -> {current['p95_ms']:.1f}ms")
+        if current['queries_per_request'] > previous['queries_per_request'] + 0.5:
+            regressions.append(f"{name}: queries/request {previous['queries_per_request']:.1f}"
+                               f" -> {current['queries_per_request']:.1f}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--database-url', required=True, help="Scratch database; it is reset.")
+    parser.add_argument('--users', type=int, default=1000, help="Users to seed.")
+    parser.add_argument('--requests', type=int, default=200, help="Requests per scenario.")
+    parser.add_argument('--concurrency', type=int, default=8, help="Client threads per scenario.")
+    parser.add_argument('--latency', type=float, default=0.05, help="Fake Spoonacular latency (s).")
+    parser.add_argument('--error-rate', type=float, default=0.0, help="Fake Spoonacular error rate.")
+    parser.add_argument('--scenario', action='append', help="Only run these scenarios.")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help="Write results as JSON to this file.")
+    parser.add_argument('--compare', help="Previous --output file to check for regressions.")
+    parser.add_argument('--threshold', type=float, default=0.2,
+                        help="Allowed p95 slowdown before flagging a regression (0.2 = 20%%).")
+    args = parser.parse_args()
+    if args.requests < args.concurrency:
+        # Each client thread makes requests // concurrency requests
+        parser.error("--requests must be at least --concurrency")
+
+    from benchmarks.fake_spoonacular import start_server
+    from benchmarks.seed import seed
+
+    fake = start_server(latency=args.latency, error_rate=args.error_rate, seed=args.seed)
+    os.environ.update(
+        DATABASE_URL=args.database_url,
+        SECRET_KEY=os.environ.get('SECRET_KEY', 'bench'),
+        SPOONACULAR_API_KEY='bench',
+        SPOONACULAR_BASE_URL=f"http://127.0.0.1:{fake.server_address[1]}",
+    )
+
+    from app import app
+    from models import db
+    from sqlalchemy import event
+
+    app.config['WTF_CSRF_ENABLED'] = False
+    counter = QueryCounter()
+
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+        seed(users=args.users, seed=args.seed)
+
+        from models import Recipe, User
+        ctx = {
+            'user_ids': [user_id for (user_id,) in db.session.query(User.id)],
+            'recipe_ids': [recipe_id for (recipe_id,) in db.session.query(Recipe.id)],
+            'spoonacular_ids': 5000,
+        }
+        event.listen(db.engine, 'before_cursor_execute', counter)
+
+    scenarios = [s for s in SCENARIOS if not args.scenario or s.name in args.scenario]
+    results = {}
+    print(f"{'scenario':<20} {'req/s':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'queries':>8} {'errors':>6}")
+    for scenario in scenarios:
+        stats = run_scenario(app, scenario, ctx, args.requests, args.concurrency, args.seed, counter)
+        results[scenario.name] = stats
+        print(f"{scenario.name:<20} {stats['rps']:>8.1f} {stats['p50_ms']:>8.1f} {stats['p95_ms']:>8.1f}"
+              f" {stats['p99_ms']:>8.1f} {stats['queries_per_request']:>8.1f} {stats['errors']:>6}")
+
+    fake.shutdown()
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(results, json.load(f), args.threshold)
+        if regressions:
+            print("\nRegressions:\n  " + "\n  ".join(regressions))
+            sys.exit(1)
+        print("\nNo regressions.")
+
+
+if __name__ == '__main__':
+    main()
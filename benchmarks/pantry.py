@@ -0,0 +1,58 @@
+"""Time pantry searches against a synthetic index, with no database.
+
+Recipes get a few to a couple of dozen ingredients drawn from a Zipf-like
+vocabulary, so common ones (salt, eggs) have long postings lists as they
+would in real data. Each query is a pantry of --items ingredients drawn
+the same way.
+
+    python -m benchmarks.pantry --recipes 1000000 --vocabulary 5000 --items 10
+"""
+import argparse
+import time
+
+import numpy as np
+
+from ingredients import PantryIndex
+
+
+def synthetic_index(recipes, vocabulary, rng):
+    weights = 1 / np.arange(1, vocabulary + 1)
+    weights /= weights.sum()
+    counts = rng.integers(3, 25, size=recipes)
+    recipe_ids = np.repeat(np.arange(1, recipes + 1), counts)
+    ingredient_ids = rng.choice(vocabulary, size=len(recipe_ids), p=weights) + 1
+    # Drawing with replacement repeats some pairs; the real table can't
+    pairs = np.unique(np.stack([ingredient_ids, recipe_ids], axis=1), axis=0)
+    names = {f"ingredient {i}": i for i in range(1, vocabulary + 1)}
+    return PantryIndex(names, pairs[:, 0], pairs[:, 1]), weights
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--recipes', type=int, default=1000000)
+    parser.add_argument('--vocabulary', type=int, default=5000)
+    parser.add_argument('--items', type=int, default=10, help="Ingredients per pantry.")
+    parser.add_argument('--queries', type=int, default=200)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(args.seed)
+    started = time.perf_counter()
+    index, weights = synthetic_index(args.recipes, args.vocabulary, rng)
+    print(f"Built an index of {len(index)} recipes and {len(index.postings)} postings "
+          f"in {time.perf_counter() - started:.1f}s ({index.postings.nbytes / 2**20:.0f} MB of postings)")
+
+    timings = []
+    for _ in range(args.queries):
+        pantry = rng.choice(args.vocabulary, size=args.items, replace=False, p=weights) + 1
+        started = time.perf_counter()
+        index.search(pantry.tolist())
+        timings.append((time.perf_counter() - started) * 1000)
+
+    p50, p95, p99 = np.percentile(timings, [50, 95, 99])
+    print(f"{args.queries} searches of {args.items} ingredients: "
+          f"p50 {p50:.1f} ms, p95 {p95:.1f} ms, p99 {p99:.1f} ms")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,59 @@
+"""Report logins/sec per core at each bcrypt cost, and through the hashing pool.
+
+A login costs one bcrypt check, so a core handles 1 / (seconds per check)
+logins a second. The pool column runs the same checks through
+PasswordHasher with --workers threads, which should scale with cores
+because bcrypt releases the GIL.
+
+    python -m benchmarks.password_hashing --min-rounds 10 --max-rounds 13 --workers 4
+"""
+import argparse
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import bcrypt
+
+from passwords import PasswordHasher, calibrate
+
+
+def per_core(hashed, checks):
+    started = time.perf_counter()
+    for _ in range(checks):
+        bcrypt.checkpw(b"password", hashed)
+    return checks / (time.perf_counter() - started)
+
+
+def through_pool(hashed, checks, workers):
+    hasher = PasswordHasher(rounds=4, max_workers=workers, max_queue=checks)
+    with ThreadPoolExecutor(max_workers=workers) as clients:
+        started = time.perf_counter()
+        list(clients.map(lambda _: hasher.check(hashed.decode(), "password"), range(checks)))
+    return checks / (time.perf_counter() - started)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--min-rounds', type=int, default=10)
+    parser.add_argument('--max-rounds', type=int, default=13)
+    parser.add_argument('--seconds', type=float, default=2.0, help="Rough time to spend on each cost.")
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1)
+    parser.add_argument('--target-ms', type=int, default=250)
+    args = parser.parse_args()
+
+    print(f"{'cost':>4} {'ms/check':>9} {'logins/s/core':>14} {f'pool x{args.workers}':>10}")
+    for rounds in range(args.min_rounds, args.max_rounds + 1):
+        hashed = bcrypt.hashpw(b"password", bcrypt.gensalt(rounds))
+        started = time.perf_counter()
+        bcrypt.checkpw(b"password", hashed)
+        checks = max(1, int(args.seconds / 2 / (time.perf_counter() - started)))
+
+        rate = per_core(hashed, checks)
+        pooled = through_pool(hashed, max(checks, args.workers), args.workers)
+        print(f"{rounds:>4} {1000 / rate:>9.1f} {rate:>14.1f} {pooled:>10.1f}")
+
+    print(f"Calibrated cost for {args.target_ms} ms per hash: {calibrate(args.target_ms)}")
+
+
+if __name__ == '__main__':
+    main()
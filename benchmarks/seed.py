@@ -0,0 +1,155 @@
+"""Fill a database with users, recipes, favorites and friendships at a given scale.
+
+    python -m benchmarks.seed --database-url postgresql:///food_friends_bench --users 10000
+
+Every seeded user's password is "password". With --reset all tables are
+dropped and recreated first, so only use that on a scratch database.
+Runs are deterministic for a given --seed.
+"""
+import argparse
+import os
+import random
+import time
+
+
+BATCH_SIZE = 5000
+
+
+def insert_batches(model, rows):
+    """Insert dict rows into `model`'s table with executemany, BATCH_SIZE at a time."""
+
+    from models import db
+
+    for start in range(0, len(rows), BATCH_SIZE):
+        db.session.execute(db.insert(model), rows[start:start + BATCH_SIZE])
+    db.session.commit()
+
+
+def seed(users=1000, recipes_per_user=5, favorites_per_user=10, friends_per_user=20,
+         ratings_per_user=5, spoonacular_ids=5000, seed=0):
+    """Seed the database the current app is connected to. Returns row counts."""
+
+    from models import (db, User, Recipe, Favorite, Friend, Friendship, FriendSuggestion, Activity,
+                        TimelineEntry, Rating, RecipeRating)
+    from ingredients import index_recipes
+    from passwords import get_password_hasher
+
+    rng = random.Random(seed)
+    password = get_password_hasher().hash("password")
+
+    first_user_id = (db.session.query(db.func.max(User.id)).scalar() or 0) + 1
+    insert_batches(User, [
+        {'username': f"bench{first_user_id + i}", 'email': f"bench{first_user_id + i}@example.com",
+         'password': password, 'bio': "Seeded for benchmarks."}
+        for i in range(users)
+    ])
+    user_ids = [user_id for (user_id,) in
+                db.session.query(User.id).filter(User.id >= first_user_id).order_by(User.id)]
+
+    first_recipe_id = (db.session.query(db.func.max(Recipe.id)).scalar() or 0) + 1
+    insert_batches(Recipe, [
+        {'user_id': user_id, 'title': f"Bench recipe {n} by {user_id}",
+         'ingredients': "chicken, garlic, olive oil, salt", 'instructions': "Chop. Cook. Serve.",
+         'is_public': rng.random() < 0.9}
+        for user_id in user_ids for n in range(recipes_per_user)
+    ])
+    recipe_ids = [recipe_id for (recipe_id,) in
+                  db.session.query(Recipe.id).filter(Recipe.id >= first_recipe_id).order_by(Recipe.id)]
+    # Core inserts skip the ORM hook that indexes ingredients for the pantry search
+    index_recipes(db.session.query(Recipe.id, Recipe.ingredients).filter(Recipe.id >= first_recipe_id).all())
+    db.session.commit()
+
+    favorites = []
+    for user_id in user_ids:
+        # Roughly half user-created recipes, half Spoonacular ones
+        local = rng.sample(recipe_ids, min(len(recipe_ids), favorites_per_user // 2))
+        remote = rng.sample(range(1, spoonacular_ids + 1), favorites_per_user - len(local))
+        favorites += [{'user_id': user_id, 'recipe_id': recipe_id} for recipe_id in local]
+        favorites += [{'user_id': user_id, 'spoonacular_id': spoonacular_id} for spoonacular_id in remote]
+    insert_batches(Favorite, favorites)
+
+    # Each user rates a few distinct recipes; the rollups are built in one pass
+    ratings = [{'user_id': user_id, 'recipe_id': recipe_id, 'rating': rng.choice((1, 2, 3, 4, 4, 5, 5, 5))}
+               for user_id in user_ids
+               for recipe_id in rng.sample(recipe_ids, min(len(recipe_ids), ratings_per_user))]
+    insert_batches(Rating, ratings)
+    RecipeRating.backfill()
+    db.session.commit()
+
+    # Each pair is stored once; roughly one in ten is still a pending request
+    pairs = set()
+    for user_id in user_ids:
+        for friend_id in rng.sample(user_ids, min(len(user_ids), friends_per_user // 2 + 1)):
+            if friend_id != user_id:
+                pairs.add((min(user_id, friend_id), max(user_id, friend_id)))
+    insert_batches(Friend, [
+        {'user_id': user_id, 'friend_id': friend_id,
+         'status': 'pending' if rng.random() < 0.1 else 'accepted'}
+        for user_id, friend_id in sorted(pairs)
+    ])
+    Friendship.backfill()
+    db.session.commit()
+
+    for start in range(0, len(user_ids), 100):
+        FriendSuggestion.rebuild(user_ids[start:start + 100])
+        db.session.commit()
+
+    # One activity per public recipe and Spoonacular favorite, fanned out in bulk
+    public = db.session.query(Recipe.id, Recipe.user_id, Recipe.title).filter(
+        Recipe.id >= first_recipe_id, Recipe.is_public)
+    activities = [{'actor_id': user_id, 'verb': 'recipe', 'recipe_id': recipe_id,
+                   'spoonacular_id': None, 'title': title}
+                  for recipe_id, user_id, title in public]
+    activities += [{'actor_id': favorite['user_id'], 'verb': 'favorite', 'recipe_id': None,
+                    'spoonacular_id': favorite['spoonacular_id'],
+                    'title': f"Spoonacular recipe {favorite['spoonacular_id']}"}
+                   for favorite in favorites if favorite.get('spoonacular_id')]
+    rng.shuffle(activities)
+
+    first_activity_id = (db.session.query(db.func.max(Activity.id)).scalar() or 0) + 1
+    insert_batches(Activity, activities)
+    db.session.execute(db.insert(TimelineEntry).from_select(
+        ['user_id', 'activity_id'],
+        db.select(Friendship.friend_id, Activity.id)
+        .join(Friendship, Friendship.user_id == Activity.actor_id)
+        .where(Activity.id >= first_activity_id),
+    ))
+    TimelineEntry.trim(user_ids)
+    db.session.commit()
+
+    return {'users': len(user_ids), 'recipes': len(recipe_ids),
+            'favorites': len(favorites), 'ratings': len(ratings), 'friends': len(pairs),
+            'activities': len(activities)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--database-url', required=True)
+    parser.add_argument('--users', type=int, default=1000)
+    parser.add_argument('--recipes-per-user', type=int, default=5)
+    parser.add_argument('--favorites-per-user', type=int, default=10)
+    parser.add_argument('--friends-per-user', type=int, default=20)
+    parser.add_argument('--ratings-per-user', type=int, default=5)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--reset', action='store_true', help="Drop and recreate all tables first.")
+    args = parser.parse_args()
+
+    os.environ['DATABASE_URL'] = args.database_url
+    from app import app
+    from models import db
+
+    with app.app_context():
+        if args.reset:
+            db.drop_all()
+            db.create_all()
+
+        started = time.perf_counter()
+        counts = seed(args.users, args.recipes_per_user, args.favorites_per_user,
+                      args.friends_per_user, args.ratings_per_user, seed=args.seed)
+
+    print(", ".join(f"{count:,} {name}" for name, count in counts.items())
+          + f" seeded in {time.perf_counter() - started:.1f}s")
+
+
+if __name__ == '__main__':
+    main()
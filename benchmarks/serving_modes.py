@@ -0,0 +1,119 @@
+"""Compare requests/sec of the sync and async (gevent) serving modes.
+
+Starts the fake Spoonacular API with a fixed latency, then for each mode
+runs gunicorn with the same number of workers and hits the Spoonacular
+recipe detail page with many concurrent clients. Every request asks for a
+recipe that isn't stored locally yet, so each one waits on upstream.
+
+Each concurrency level is run in turn. The default levels include one with
+more clients per worker than SQLAlchemy's default pool (5 + 10
+connections), to check async workers don't queue on the database pool.
+
+    createdb food_friends_bench
+    DATABASE_URL=postgresql:///food_friends_bench flask db upgrade
+    python -m benchmarks.serving_modes --database-url postgresql:///food_friends_bench
+"""
+import argparse
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+from benchmarks.fake_spoonacular import start_server
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def wait_until_up(url, timeout=30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            requests.get(url, timeout=5)
+            return
+        except requests.RequestException:
+            time.sleep(0.2)
+    raise RuntimeError(f"Server at {url} did not start")
+
+
+def run_load(base_url, first_id, total, concurrency):
+    """Fetch `total` distinct recipe pages with `concurrency` clients; return (rps, latencies)."""
+
+    session = requests.Session()
+    session.mount("http://", requests.adapters.HTTPAdapter(pool_maxsize=concurrency))
+
+    def fetch(recipe_id):
+        started = time.perf_counter()
+        response = session.get(f"{base_url}/recipes/spoonacular/{recipe_id}", allow_redirects=False)
+        response.raise_for_status()
+        return time.perf_counter() - started
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        latencies = list(executor.map(fetch, range(first_id, first_id + total)))
+    elapsed = time.perf_counter() - started
+
+    return total / elapsed, latencies
+
+
+def run_mode(mode, args, fake_url, first_id, concurrency):
+    port = free_port()
+    env = dict(
+        os.environ,
+        SERVING_MODE=mode,
+        DATABASE_URL=args.database_url,
+        SECRET_KEY="bench",
+        SPOONACULAR_API_KEY="bench",
+        SPOONACULAR_BASE_URL=fake_url,
+        SPOONACULAR_CACHE_BACKEND="none",
+    )
+    server = subprocess.Popen(
+        [sys.executable, "-m", "gunicorn", "-w", str(args.workers), "-b", f"127.0.0.1:{port}", "app:app"],
+        env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    try:
+        base_url = f"http://127.0.0.1:{port}"
+        wait_until_up(base_url)
+        return run_load(base_url, first_id, args.requests, concurrency)
+    finally:
+        server.terminate()
+        server.wait()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--database-url", required=True, help="Migrated scratch database.")
+    parser.add_argument("--workers", type=int, default=2, help="gunicorn workers in both modes.")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[10, 50, 200],
+                        help="Concurrent clients, one run per value.")
+    parser.add_argument("--requests", type=int, default=500, help="Requests per mode and concurrency level.")
+    parser.add_argument("--latency", type=float, default=0.2, help="Fake Spoonacular latency (s).")
+    args = parser.parse_args()
+
+    fake = start_server(latency=args.latency)
+    fake_url = f"http://127.0.0.1:{fake.server_address[1]}"
+
+    # Start IDs from the clock so repeated runs never hit recipes stored by an earlier run
+    first_id = int(time.time())
+    print(f"{args.workers} workers, {args.latency * 1000:.0f}ms upstream latency")
+    print(f"{'mode':<6} {'clients':>8} {'/worker':>8} {'req/s':>8} {'p50 ms':>8} {'p95 ms':>8}")
+    runs = [(concurrency, mode) for concurrency in args.concurrency for mode in ("sync", "async")]
+    for offset, (concurrency, mode) in enumerate(runs):
+        rps, latencies = run_mode(mode, args, fake_url, first_id + offset * args.requests, concurrency)
+        cuts = statistics.quantiles(latencies, n=100)
+        print(f"{mode:<6} {concurrency:>8} {concurrency / args.workers:>8.0f} {rps:>8.1f} "
+              f"{cuts[49] * 1000:>8.0f} {cuts[94] * 1000:>8.0f}")
+
+    fake.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,60 @@
+"""Measure cold start: importing the app, then its first and second requests.
+
+Each run is a fresh Python process, as on a scale-to-zero host, so nothing
+is cached in memory between runs. Importing `app` includes create_app().
+
+    python -m benchmarks.startup --database-url postgresql:///food_friends_bench
+    python -m benchmarks.startup --database-url sqlite:// --path /login --runs 20
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+CHILD = """
+import json, sys, time
+started = time.perf_counter()
+from app import app
+imported = time.perf_counter()
+client = app.test_client()
+timings = {'import': imported - started}
+for name in ('first_request', 'second_request'):
+    started = time.perf_counter()
+    status = client.get(sys.argv[1]).status_code
+    timings[name] = time.perf_counter() - started
+timings['status'] = status
+print(json.dumps(timings))
+"""
+
+
+def run_once(path, env):
+    output = subprocess.run([sys.executable, "-c", CHILD, path], env=env, check=True,
+                            capture_output=True, text=True).stdout
+    return json.loads(output.splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--database-url', required=True)
+    parser.add_argument('--path', default='/login', help="Page to request (anonymously).")
+    parser.add_argument('--runs', type=int, default=10)
+    args = parser.parse_args()
+
+    env = dict(os.environ, DATABASE_URL=args.database_url)
+    env.setdefault('SECRET_KEY', 'startup-benchmark')
+    env.setdefault('SPOONACULAR_API_KEY', 'unused')
+
+    runs = [run_once(args.path, env) for _ in range(args.runs)]
+    if any(run['status'] >= 500 for run in runs):
+        sys.exit(f"{args.path} returned {runs[0]['status']}")
+
+    print(f"{args.runs} cold starts, GET {args.path} (status {runs[0]['status']})")
+    for name in ('import', 'first_request', 'second_request'):
+        values = sorted(run[name] * 1000 for run in runs)
+        print(f"  {name:15} median {statistics.median(values):7.1f} ms   max {values[-1]:7.1f} ms")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,233 @@
+import json, os, sqlite3, threading, time
+from collections import OrderedDict
+
+from flask import current_app
+
+
+# Default time-to-live (seconds) for each kind of Spoonacular response.
+# `not_found` is used for negative caching of recipes that 404 upstream.
+DEFAULT_TTLS = {
+    'random': 60,
+    'recipe': 24 * 60 * 60,
+    'search': 60 * 60,
+    'not_found': 10 * 60,
+}
+
+
+class CacheStats:
+    """Thread safe hit/miss/eviction counters shared by the cache backends."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def record(self, hits=0, misses=0, evictions=0):
+        with self._lock:
+            self.hits += hits
+            self.misses += misses
+            self.evictions += evictions
+
+    def as_dict(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_rate': (self.hits / total) if total else 0.0,
+            }
+
+
+class LRUCache:
+    """In-process cache bounded by number of entries, evicting the least recently used.
+
+    `get` returns a `(found, value)` pair so that None can itself be cached.
+    """
+
+    def __init__(self, max_size=1024):
+        self.max_size = max_size
+        self.stats = CacheStats()
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None:
+                expires_at, value = entry
+                if expires_at > time.time():
+                    self._data.move_to_end(key)
+                    self.stats.record(hits=1)
+                    return True, value
+                del self._data[key]
+
+        self.stats.record(misses=1)
+        return False, None
+
+    def set(self, key, value, ttl):
+        evicted = 0
+        with self._lock:
+            self._data[key] = (time.time() + ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+                evicted += 1
+
+        if evicted:
+            self.stats.record(evictions=evicted)
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+
+class SQLiteCache:
+    """Cache stored in a local SQLite file so all gunicorn workers on a host share it.
+
+    Values are stored as JSON. When the table grows past `max_size` the least
+    recently read entries are evicted.
+    """
+
+    def __init__(self, path, max_size=10000):
+        self.path = path
+        self.max_size = max_size
+        self.stats = CacheStats()
+        self._local = threading.local()
+
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+
+        conn = self._connection()
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS cache ("
+            " key TEXT PRIMARY KEY,"
+            " value TEXT NOT NULL,"
+            " expires_at REAL NOT NULL,"
+            " accessed_at REAL NOT NULL)"
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS cache_accessed_at ON cache (accessed_at)")
+
+    def _connection(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def get(self, key):
+        now = time.time()
+        conn = self._connection()
+        row = conn.execute(
+            "SELECT value FROM cache WHERE key = ? AND expires_at > ?", (key, now)
+        ).fetchone()
+
+        if row is None:
+            self.stats.record(misses=1)
+            return False, None
+
+        conn.execute("UPDATE cache SET accessed_at = ? WHERE key = ?", (now, key))
+        self.stats.record(hits=1)
+        return True, json.loads(row[0])
+
+    def set(self, key, value, ttl):
+        now = time.time()
+        conn = self._connection()
+        conn.execute(
+            "INSERT OR REPLACE INTO cache (key, value, expires_at, accessed_at) VALUES (?, ?, ?, ?)",
+            (key, json.dumps(value), now + ttl, now),
+        )
+
+        # Drop expired rows first, then trim the least recently used past max_size
+        conn.execute("DELETE FROM cache WHERE expires_at <= ?", (now,))
+        evicted = conn.execute(
+            "DELETE FROM cache WHERE key IN ("
+            " SELECT key FROM cache ORDER BY accessed_at"
+            " LIMIT max((SELECT count(*) FROM cache) - ?, 0))",
+            (self.max_size,),
+        ).rowcount
+
+        if evicted > 0:
+            self.stats.record(evictions=evicted)
+
+    def delete(self, key):
+        self._connection().execute("DELETE FROM cache WHERE key = ?", (key,))
+
+    def clear(self):
+        self._connection().execute("DELETE FROM cache")
+
+    def __len__(self):
+        return self._connection().execute("SELECT count(*) FROM cache").fetchone()[0]
+
+
+class NullCache:
+    """Cache that never stores anything, for turning caching off."""
+
+    def __init__(self):
+        self.stats = CacheStats()
+
+    def get(self, key):
+        self.stats.record(misses=1)
+        return False, None
+
+    def set(self, key, value, ttl):
+        pass
+
+    def delete(self, key):
+        pass
+
+    def clear(self):
+        pass
+
+    def __len__(self):
+        return 0
+
+
+_cache_lock = threading.Lock()
+
+
+def make_cache(config):
+    """Build the cache backend described by the app config."""
+
+    backend = config.get('SPOONACULAR_CACHE_BACKEND', 'memory')
+    max_size = config.get('SPOONACULAR_CACHE_SIZE', 2048)
+
+    if backend == 'memory':
+        return LRUCache(max_size=max_size)
+    if backend == 'sqlite':
+        path = config.get('SPOONACULAR_CACHE_PATH', os.path.join('instance', 'spoonacular_cache.sqlite3'))
+        return SQLiteCache(path, max_size=max_size)
+    if backend == 'none':
+        return NullCache()
+
+    raise ValueError(f"Unknown Spoonacular cache backend: {backend}")
+
+
+def get_cache():
+    """Return the Spoonacular response cache for the current app, creating it on first use."""
+
+    cache = current_app.extensions.get('spoonacular_cache')
+    if cache is None:
+        with _cache_lock:
+            cache = current_app.extensions.get('spoonacular_cache')
+            if cache is None:
+                cache = make_cache(current_app.config)
+                current_app.extensions['spoonacular_cache'] = cache
+    return cache
+
+
+def get_ttl(kind):
+    """Look up the configured TTL (seconds) for a kind of cached response."""
+
+    ttls = current_app.config.get('SPOONACULAR_CACHE_TTLS') or {}
+    return ttls.get(kind, DEFAULT_TTLS[kind])
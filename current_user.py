@@ -0,0 +1,94 @@
+import threading
+
+from flask import current_app
+
+from cache import LRUCache
+from models import db, User
+
+
+# The User columns every page needs (navbar avatar, profile links)
+SUMMARY_FIELDS = ('id', 'username', 'image_url')
+
+DEFAULT_TTL = 30
+
+_cache_lock = threading.Lock()
+
+
+class CurrentUser:
+    """Stand-in for the logged-in User that only loads the full row when needed.
+
+    id, username and image_url come from a short-lived per-process cache.
+    Reading any other attribute loads the User row once and delegates to it.
+    """
+
+    def __init__(self, summary):
+        self.id = summary['id']
+        self.username = summary['username']
+        self.image_url = summary['image_url']
+        self._user = None
+
+    @property
+    def user(self):
+        """The full User row, loaded on first use."""
+        if self._user is None:
+            self._user = db.session.get(User, self.id)
+        return self._user
+
+    def __getattr__(self, name):
+        # Only called for attributes not set in __init__
+        if name.startswith('__'):
+            raise AttributeError(name)
+        return getattr(self.user, name)
+
+    def __repr__(self):
+        return f"<CurrentUser {self.username}>"
+
+
+def get_user_cache():
+    """Return this process's cache of logged-in user summaries."""
+
+    cache = current_app.extensions.get('current_user_cache')
+    if cache is None:
+        with _cache_lock:
+            cache = current_app.extensions.get('current_user_cache')
+            if cache is None:
+                cache = LRUCache(max_size=current_app.config.get('CURRENT_USER_CACHE_SIZE', 10000))
+                current_app.extensions['current_user_cache'] = cache
+    return cache
+
+
+def load_current_user(user_id):
+    """Return a CurrentUser for `user_id`, or None if there is no such user.
+
+    Only reads the summary columns, and only when they aren't cached.
+    """
+    cache = get_user_cache()
+    found, summary = cache.get(f"user:{user_id}")
+
+    if not found:
+        row = (db.session.query(*(getattr(User, field) for field in SUMMARY_FIELDS))
+               .filter(User.id == user_id)
+               .first())
+        summary = dict(zip(SUMMARY_FIELDS, row)) if row else None
+        cache.set(f"user:{user_id}", summary, current_app.config.get('CURRENT_USER_CACHE_TTL', DEFAULT_TTL))
+
+    return CurrentUser(summary) if summary else None
+
+
+def invalidate_current_user(user_id):
+    """Forget the cached summary for `user_id` after its row changes.
+
+    The listeners below call this when an update or delete is flushed, not
+    when it's committed, so an update that is then rolled back still evicts
+    the entry (which only costs a reload). Only this process's cache is
+    cleared; other processes can serve the old summary for up to
+    CURRENT_USER_CACHE_TTL seconds.
+    """
+
+    get_user_cache().delete(f"user:{user_id}")
+
+
+@db.event.listens_for(User, 'after_update')
+@db.event.listens_for(User, 'after_delete')
+def _invalidate_on_write(mapper, connection, target):
+    invalidate_current_user(target.id)
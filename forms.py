@@ -1,9 +1,7 @@
 from flask_wtf import FlaskForm
-from wtforms import StringField, PasswordField, TextAreaField, BooleanField, SubmitField
+from flask_wtf.file import FileAllowed, FileField, FileRequired
+from wtforms import StringField, PasswordField, TextAreaField, BooleanField, SelectField, SubmitField
 from wtforms.validators import DataRequired, Email, Length, Optional, URL
-from flask_bcrypt import Bcrypt
-
-bcrypt = Bcrypt()
 
 class LoginForm(FlaskForm):
     """Login form."""
@@ -35,3 +33,16 @@ class SearchForm(FlaskForm):
     """Form for searching recipes"""
     query = StringField('Search', validators=[DataRequired()])
     submit = SubmitField('Search')
+
+
+class RatingForm(FlaskForm):
+    """Form for rating and reviewing a recipe"""
+    rating = SelectField('Rating', choices=[(stars, f"{stars} star{'s' if stars > 1 else ''}") for stars in range(5, 0, -1)],
+                         coerce=int, validators=[DataRequired()])
+    review = TextAreaField('(Optional) Review', validators=[Optional(), Length(max=2000)])
+
+
+class RecipeImportForm(FlaskForm):
+    """Form for uploading a JSON Lines or CSV file of recipes"""
+    file = FileField('Recipes file', validators=[FileRequired(),
+                                                 FileAllowed(['jsonl', 'ndjson', 'json', 'csv'], "JSON Lines or CSV only")])
@@ -0,0 +1,183 @@
+import os, threading, uuid
+
+from flask import current_app, has_app_context
+from markupsafe import Markup
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+from cache import CacheStats, LRUCache, SQLiteCache, NullCache
+from models import User, Recipe, Favorite, Friend
+
+DEFAULT_TTL = 60 * 60
+
+# Versions outlive the fragments keyed on them, so a fragment is never
+# matched against a version that was forgotten and started over
+VERSION_TTL = 7 * 24 * 60 * 60
+
+_cache_lock = threading.Lock()
+
+
+class FragmentCache:
+    """Rendered template fragments, keyed on versions of the rows they show.
+
+    Every (kind, id) entity has a version token in `versions` (the backend
+    itself unless given). Writing a row replaces the tokens of the entities
+    it affects (see `_affected`), so fragments rendered from the old rows
+    are never looked up again and age out of the backend. A version that
+    isn't stored (never written, or evicted) gets a fresh token, which only
+    costs a miss. Keeping versions in a store every process shares means a
+    write invalidates fragments cached by all of them.
+    """
+
+    def __init__(self, backend, ttl=DEFAULT_TTL, versions=None):
+        self.backend = backend
+        self.versions = versions if versions is not None else backend
+        self.ttl = ttl
+        self.stats = CacheStats()
+
+    def version(self, kind, entity_id):
+        key = f"v:{kind}:{entity_id}"
+        found, version = self.versions.get(key)
+        if not found:
+            version = uuid.uuid4().hex[:12]
+            self.versions.set(key, version, VERSION_TTL)
+        return version
+
+    def bump(self, kind, entity_id):
+        self.versions.set(f"v:{kind}:{entity_id}", uuid.uuid4().hex[:12], VERSION_TTL)
+
+    def key(self, name, vary, deps):
+        parts = [name, *map(str, vary)]
+        parts += [f"{kind}{entity_id}@{self.version(kind, entity_id)}" for kind, entity_id in sorted(deps.items())]
+        return "f:" + ":".join(parts)
+
+    def render(self, name, render, *vary, **deps):
+        """Return the cached HTML for this fragment, calling `render()` to make it on a miss."""
+        key = self.key(name, vary, deps)
+        found, html = self.backend.get(key)
+        if found:
+            self.stats.record(hits=1)
+        else:
+            self.stats.record(misses=1)
+            html = str(render())
+            self.backend.set(key, html, self.ttl)
+        return Markup(html)
+
+
+def make_backend(config):
+    """Build the fragment storage backend described by the app config."""
+
+    backend = config.get('FRAGMENT_CACHE_BACKEND', 'memory')
+    max_size = config.get('FRAGMENT_CACHE_SIZE', 10000)
+
+    if backend == 'memory':
+        return LRUCache(max_size=max_size)
+    if backend == 'sqlite':
+        path = config.get('FRAGMENT_CACHE_PATH', os.path.join('instance', 'fragment_cache.sqlite3'))
+        return SQLiteCache(path, max_size=max_size)
+    if backend == 'none':
+        return NullCache()
+
+    raise ValueError(f"Unknown fragment cache backend: {backend}")
+
+
+def make_version_store(config, backend):
+    """Build the store for version tokens, shared by every process on the host.
+
+    Only the per-process memory backend needs a separate one.
+    """
+    if not isinstance(backend, LRUCache):
+        return backend
+
+    store = config.get('FRAGMENT_VERSION_BACKEND', 'sqlite')
+    if store == 'memory':
+        # Only safe when a single process serves and writes
+        return backend
+    if store == 'sqlite':
+        path = config.get('FRAGMENT_VERSION_PATH', os.path.join('instance', 'fragment_versions.sqlite3'))
+        return SQLiteCache(path, max_size=config.get('FRAGMENT_CACHE_SIZE', 10000))
+
+    raise ValueError(f"Unknown fragment version backend: {store}")
+
+
+def get_fragment_cache():
+    """Return the fragment cache for the current app, creating it on first use."""
+
+    cache = current_app.extensions.get('fragment_cache')
+    if cache is None:
+        with _cache_lock:
+            cache = current_app.extensions.get('fragment_cache')
+            if cache is None:
+                backend = make_backend(current_app.config)
+                cache = FragmentCache(backend, current_app.config.get('FRAGMENT_CACHE_TTL', DEFAULT_TTL),
+                                      versions=make_version_store(current_app.config, backend))
+                current_app.extensions['fragment_cache'] = cache
+    return cache
+
+
+def cached(name, *vary, caller, **deps):
+    """Template global: cache the body of a `{% call %}` block.
+
+        {% call cached('friend_card', user=friend.id) %} ... {% endcall %}
+
+    Keyword arguments name the entities the block shows; extra positional
+    arguments are added to the key as is. The body must look the same to
+    every viewer.
+    """
+    return get_fragment_cache().render(name, caller, *vary, **deps)
+
+
+##############################################################################
+# Invalidation:
+
+
+def _affected(obj):
+    """The (kind, id) entities whose fragments show `obj`."""
+    if isinstance(obj, User):
+        return [('user', obj.id)]
+    if isinstance(obj, Recipe):
+        # The owner's profile shows how many recipes they have
+        affected = [('recipe', obj.id), ('user', obj.user_id)]
+        if obj.spoonacular_id:
+            affected.append(('spoonacular', obj.spoonacular_id))
+        return affected
+    if isinstance(obj, Favorite):
+        return [('user', obj.user_id)]
+    if isinstance(obj, Friend):
+        return [('user', obj.user_id), ('user', obj.friend_id)]
+    return []
+
+
+def touch(session, kind, entity_id):
+    """Invalidate (kind, id) when `session` commits, for writes that bypass the ORM (bulk updates, Core inserts)."""
+    session.info.setdefault('fragment_versions', set()).add((kind, entity_id))
+
+
+# Listening on the Session class also covers sessions outside Flask-SQLAlchemy's scope
+@event.listens_for(Session, 'after_flush')
+def _after_flush(session, flush_context):
+    # new/dirty/deleted still hold what was just flushed, with ids assigned
+    for obj in (*session.new, *session.dirty, *session.deleted):
+        for kind, entity_id in _affected(obj):
+            if entity_id is not None:
+                touch(session, kind, entity_id)
+
+
+@event.listens_for(Session, 'after_commit')
+def _after_commit(session):
+    touched = session.info.pop('fragment_versions', None)
+    if touched and has_app_context():
+        cache = get_fragment_cache()
+        for kind, entity_id in touched:
+            cache.bump(kind, entity_id)
+
+
+@event.listens_for(Session, 'after_rollback')
+def _after_rollback(session):
+    session.info.pop('fragment_versions', None)
+
+
+def init_app(app):
+    """Make `cached` available to templates."""
+
+    app.jinja_env.globals['cached'] = cached
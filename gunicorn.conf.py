@@ -0,0 +1,36 @@
+import os, tempfile
+
+# SERVING_MODE=async runs gevent workers. Blocking calls (Spoonacular over
+# requests, Postgres over psycopg2) then yield to other requests in the same
+# worker, so one slow upstream response no longer pins a whole worker.
+# The default sync mode is unchanged. The worker count still comes from
+# WEB_CONCURRENCY / -w as before.
+serving_mode = os.environ.get('SERVING_MODE', 'sync')
+
+# Workers save their metrics here and /metrics merges them (see metrics.py)
+metrics_dir = os.environ.setdefault('METRICS_MULTIPROC_DIR',
+                                    os.path.join(tempfile.gettempdir(), 'foodfriends-metrics'))
+
+
+def on_starting(server):
+    # Counters saved by a previous run would otherwise be added to this one's
+    os.makedirs(metrics_dir, exist_ok=True)
+    for name in os.listdir(metrics_dir):
+        os.remove(os.path.join(metrics_dir, name))
+
+
+if serving_mode == 'async':
+    worker_class = 'gevent'
+    worker_connections = int(os.environ.get('WORKER_CONNECTIONS', 100))
+    # Let every in-flight request in a worker keep its own upstream keep-alive connection
+    os.environ.setdefault('SPOONACULAR_POOL_SIZE', str(worker_connections))
+    # ...and its own database connection, rather than queueing on SQLAlchemy's default 5 + 10
+    os.environ.setdefault('DATABASE_POOL_SIZE', str(worker_connections))
+
+    def post_fork(server, worker):
+        # psycopg2 is a C extension, so gevent can't patch it; psycogreen makes it cooperative
+        from psycogreen.gevent import patch_psycopg
+        patch_psycopg()
+
+elif serving_mode != 'sync':
+    raise ValueError(f"Unknown SERVING_MODE: {serving_mode}")
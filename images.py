@@ -0,0 +1,319 @@
+import hashlib, hmac, io, ipaddress, json, logging, os, socket, tempfile, threading, time
+from urllib.parse import urljoin, urlsplit
+
+import requests
+from flask import current_app, url_for
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPConnection, HTTPSConnection
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+
+from cache import CacheStats, LRUCache
+from metrics import ERRORS
+
+logger = logging.getLogger(__name__)
+
+
+# Longest side (px) of each thumbnail size templates can ask for; every
+# size is made in one go the first time any of them is requested
+THUMBNAIL_SIZES = {'sm': 160, 'md': 480, 'lg': 960}
+THUMBNAIL_QUALITY = 80
+
+DEFAULT_MAX_BYTES = 512 * 1024 * 1024
+MAX_SOURCE_BYTES = 10 * 1024 * 1024
+MAX_SOURCE_PIXELS = 40 * 1000 * 1000
+MAX_REDIRECTS = 3
+FETCH_TIMEOUT = (3.05, 10)
+
+# Sources that couldn't be fetched aren't retried for this long
+FAILURE_TTL = 10 * 60
+
+# Eviction deletes least recently served thumbnails down to this share of max_bytes
+EVICT_TO = 0.9
+
+_store_lock = threading.Lock()
+# Striped so that concurrent requests for one new image fetch it once
+_fetch_locks = [threading.Lock() for _ in range(64)]
+
+
+class ImageProxyError(Exception):
+    """A source image that can't be fetched or isn't an image we'll resize."""
+
+
+class ThumbnailStore:
+    """Content-addressed, size-bounded disk cache of thumbnails.
+
+    Thumbnails live in blobs/ named by the SHA-256 of their bytes, which is
+    also their ETag. refs/ maps each source URL to its blobs, one small
+    JSON file per URL. Serving a thumbnail bumps its mtime. When the total
+    size goes over max_bytes, the least recently served blobs are deleted.
+    A ref whose blob is gone is a miss, and the source is fetched again.
+
+    Several processes can share one directory. Each keeps its own running
+    total, so the limit is enforced approximately.
+    """
+
+    def __init__(self, directory, max_bytes=DEFAULT_MAX_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.stats = CacheStats()
+        self._lock = threading.Lock()
+        for sub in ('blobs', 'refs', 'tmp'):
+            os.makedirs(os.path.join(directory, sub), exist_ok=True)
+        self.total_bytes = sum(size for _, size, _ in self._blobs())
+
+    @staticmethod
+    def key(url):
+        return hashlib.sha256(url.encode()).hexdigest()
+
+    def _ref_path(self, url):
+        key = self.key(url)
+        return os.path.join(self.directory, 'refs', key[:2], key)
+
+    def blob_path(self, digest):
+        return os.path.join(self.directory, 'blobs', digest[:2], f"{digest}.webp")
+
+    def _blobs(self):
+        """(path, size, mtime) of every stored blob."""
+        for root, _, files in os.walk(os.path.join(self.directory, 'blobs')):
+            for name in files:
+                path = os.path.join(root, name)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                yield path, stat.st_size, stat.st_mtime
+
+    def _write(self, path, data):
+        # Write then rename, so readers never see a partial file
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=os.path.join(self.directory, 'tmp'))
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.replace(tmp, path)
+
+    def get(self, url, size):
+        """Return (digest, path) of a stored thumbnail, or None."""
+        try:
+            with open(self._ref_path(url)) as f:
+                digest = json.load(f)[size]
+            path = self.blob_path(digest)
+            os.utime(path)
+        except (FileNotFoundError, KeyError, ValueError):
+            self.stats.record(misses=1)
+            return None
+
+        self.stats.record(hits=1)
+        return digest, path
+
+    def put(self, url, thumbnails):
+        """Store {size: image bytes} for `url`. Returns {size: digest}."""
+        digests = {}
+        added = 0
+        for size, data in thumbnails.items():
+            digest = hashlib.sha256(data).hexdigest()
+            path = self.blob_path(digest)
+            if not os.path.exists(path):
+                self._write(path, data)
+                added += len(data)
+            digests[size] = digest
+
+        self._write(self._ref_path(url), json.dumps(digests).encode())
+
+        with self._lock:
+            self.total_bytes += added
+            over = self.total_bytes > self.max_bytes
+        if over:
+            self.evict()
+        return digests
+
+    def evict(self):
+        """Delete least recently served blobs until under EVICT_TO of max_bytes."""
+        blobs = sorted(self._blobs(), key=lambda blob: blob[2])
+        total = sum(size for _, size, _ in blobs)
+        evicted = 0
+        for path, size, _ in blobs:
+            if total <= self.max_bytes * EVICT_TO:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+            evicted += 1
+
+        with self._lock:
+            self.total_bytes = total
+        self.stats.record(evictions=evicted)
+
+
+def get_store():
+    """Return the thumbnail store for the current app, creating it on first use."""
+
+    store = current_app.extensions.get('image_cache')
+    if store is None:
+        with _store_lock:
+            store = current_app.extensions.get('image_cache')
+            if store is None:
+                config = current_app.config
+                store = ThumbnailStore(
+                    config.get('IMAGE_CACHE_DIR', os.path.join(current_app.instance_path, 'images')),
+                    config.get('IMAGE_CACHE_MAX_BYTES', DEFAULT_MAX_BYTES))
+                current_app.extensions['image_cache'] = store
+                current_app.extensions['image_failures'] = LRUCache(max_size=4096)
+    return store
+
+
+def sign(url):
+    """Signature that lets `url` through the proxy; only URLs we rendered are fetched."""
+    key = current_app.config['SECRET_KEY'].encode()
+    return hmac.new(key, url.encode(), hashlib.sha256).hexdigest()[:32]
+
+
+def thumbnail_url(url, size='md'):
+    """URL of a `size` thumbnail of a remote image. Local paths (e.g. /static/...) are returned as is."""
+    if not url:
+        return ''
+    if not url.startswith(('http://', 'https://')):
+        return url
+    return url_for('main.image_proxy', size=size, signature=sign(url), url=url)
+
+
+def _check_host(url):
+    """Resolve the host of `url` and return the address to connect to, if every address is public."""
+    parts = urlsplit(url)
+    if parts.scheme not in ('http', 'https') or not parts.hostname:
+        raise ImageProxyError(f"not an http(s) URL: {url}")
+
+    try:
+        addresses = [info[4][0] for info in socket.getaddrinfo(parts.hostname, parts.port or 443,
+                                                               type=socket.SOCK_STREAM)]
+    except socket.gaierror as e:
+        raise ImageProxyError(f"can't resolve {parts.hostname}: {e}")
+    if not current_app.config.get('IMAGE_PROXY_ALLOW_PRIVATE'):
+        for address in addresses:
+            if not ipaddress.ip_address(address.split('%')[0]).is_global:
+                raise ImageProxyError(f"{parts.hostname} resolves to a non-public address")
+    return addresses[0]
+
+
+def _pinned_session(address):
+    """A requests session that connects to `address`, whatever host the URL names.
+
+    The URL's host is still sent as Host and used for TLS SNI and certificate
+    checks. Connecting to the address _check_host vetted, rather than
+    resolving the name again, stops a DNS rebinding host from passing the
+    check and then pointing the request at a private address.
+    """
+    class Pinned:
+        def _new_conn(self):
+            self._dns_host = address
+            return super()._new_conn()
+
+    adapter = HTTPAdapter(max_retries=0)
+    adapter.poolmanager.pool_classes_by_scheme = {
+        'http': type('PinnedHTTPConnectionPool', (HTTPConnectionPool,),
+                     {'ConnectionCls': type('PinnedHTTPConnection', (Pinned, HTTPConnection), {})}),
+        'https': type('PinnedHTTPSConnectionPool', (HTTPSConnectionPool,),
+                      {'ConnectionCls': type('PinnedHTTPSConnection', (Pinned, HTTPSConnection), {})}),
+    }
+    session = requests.Session()
+    # An environment proxy would resolve the name itself
+    session.trust_env = False
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+
+def _download(url):
+    """GET `url`, following a few redirects and checking every hop's host, up to MAX_SOURCE_BYTES."""
+    for _ in range(MAX_REDIRECTS + 1):
+        session = _pinned_session(_check_host(url))
+        response = session.get(url, stream=True, timeout=FETCH_TIMEOUT, allow_redirects=False,
+                               headers={'User-Agent': 'FoodFriends image proxy'})
+        if not response.is_redirect:
+            break
+        url = urljoin(url, response.headers['Location'])
+        response.close()
+        session.close()
+    else:
+        raise ImageProxyError("too many redirects")
+
+    with session, response:
+        response.raise_for_status()
+        if not response.headers.get('Content-Type', '').startswith('image/'):
+            raise ImageProxyError(f"not an image: {response.headers.get('Content-Type')}")
+
+        body = io.BytesIO()
+        for chunk in response.iter_content(64 * 1024):
+            body.write(chunk)
+            if body.tell() > MAX_SOURCE_BYTES:
+                raise ImageProxyError("image too large")
+    body.seek(0)
+    return body
+
+
+def make_thumbnails(source):
+    """Resize an image file object to every THUMBNAIL_SIZES size. Returns {size: WebP bytes}."""
+    # Imported here so that starting the app doesn't load Pillow
+    from PIL import Image, ImageOps, UnidentifiedImageError
+
+    try:
+        image = Image.open(source)
+        if image.width * image.height > MAX_SOURCE_PIXELS:
+            raise ImageProxyError("image has too many pixels")
+        # Lets JPEG decode straight at a reduced scale
+        image.draft('RGB', (max(THUMBNAIL_SIZES.values()),) * 2)
+        image = ImageOps.exif_transpose(image)
+        image = image.convert('RGBA' if image.mode in ('RGBA', 'LA', 'P') else 'RGB')
+    except (UnidentifiedImageError, OSError, Image.DecompressionBombError) as e:
+        raise ImageProxyError(f"unreadable image: {e}")
+
+    thumbnails = {}
+    # Largest first, so each smaller size is resized from the previous one
+    for size, longest_side in sorted(THUMBNAIL_SIZES.items(), key=lambda item: -item[1]):
+        image.thumbnail((longest_side, longest_side), Image.LANCZOS)
+        out = io.BytesIO()
+        image.save(out, 'WEBP', quality=THUMBNAIL_QUALITY, method=4)
+        thumbnails[size] = out.getvalue()
+    return thumbnails
+
+
+def get_thumbnail(url, size):
+    """Return (digest, path) of a `size` thumbnail of `url`, fetching and resizing it on a miss.
+
+    Raises ImageProxyError if the source can't be used; failures are
+    remembered for FAILURE_TTL so broken images aren't fetched on every view.
+    """
+    store = get_store()
+    found = store.get(url, size)
+    if found:
+        return found
+
+    failures = current_app.extensions['image_failures']
+    with _fetch_locks[int(store.key(url)[:8], 16) % len(_fetch_locks)]:
+        # Another thread may have made it while we waited
+        found = store.get(url, size)
+        if found:
+            return found
+
+        failed, reason = failures.get(url)
+        if failed:
+            raise ImageProxyError(reason)
+
+        started = time.perf_counter()
+        try:
+            digests = store.put(url, make_thumbnails(_download(url)))
+        except (ImageProxyError, requests.RequestException) as e:
+            logger.warning("Error proxying image %s: %s", url, e)
+            ERRORS.inc(source='image_proxy')
+            failures.set(url, str(e), FAILURE_TTL)
+            raise ImageProxyError(str(e)) from e
+        logger.info("Made thumbnails of %s in %.2fs", url, time.perf_counter() - started)
+
+    return digests[size], store.blob_path(digests[size])
+
+
+def init_app(app):
+    """Make `thumbnail(url, size)` available to templates."""
+
+    app.jinja_env.globals['thumbnail'] = thumbnail_url
@@ -0,0 +1,234 @@
+import logging, re, threading, time
+
+from flask import current_app
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+from models import db, Recipe, Ingredient, RecipeIngredient
+
+logger = logging.getLogger(__name__)
+
+
+DEFAULT_REFRESH_SECONDS = 5 * 60
+DEFAULT_LIMIT = 24
+MAX_NAME_LENGTH = 100
+
+# Rows fetched per round trip when loading the index
+LOAD_BATCH_SIZE = 100000
+
+# Measures and packaging, dropped unless they're the last word ("ground cloves")
+UNITS = {
+    'c', 'cup', 'cups', 'tablespoon', 'tablespoons', 'tbsp', 'tbs', 'teaspoon', 'teaspoons', 'tsp',
+    'oz', 'ounce', 'ounces', 'lb', 'lbs', 'pound', 'pounds', 'g', 'gram', 'grams', 'kg', 'ml', 'l',
+    'liter', 'liters', 'litre', 'litres', 'quart', 'quarts', 'pint', 'pints', 'inch', 'inches',
+    'pinch', 'pinches', 'dash', 'dashes', 'clove', 'cloves', 'can', 'cans', 'jar', 'jars', 'bottle',
+    'package', 'packages', 'pkg', 'stick', 'sticks', 'slice', 'slices', 'piece', 'pieces',
+    'bunch', 'bunches', 'handful', 'sprig', 'sprigs', 'head', 'heads',
+}
+
+# Preparation and filler words, which don't change what you need to have
+DESCRIPTORS = {
+    'a', 'an', 'and', 'or', 'of', 'to', 'for', 'about', 'plus', 'more', 'taste', 'optional', 'divided',
+    'fresh', 'freshly', 'large', 'small', 'medium', 'whole', 'extra', 'virgin', 'ripe', 'cold', 'warm',
+    'room', 'temperature', 'chopped', 'minced', 'diced', 'sliced', 'grated', 'shredded', 'peeled',
+    'crushed', 'beaten', 'melted', 'softened', 'packed', 'finely', 'roughly', 'thinly',
+}
+
+# Words that end in "s" but aren't plurals
+NOT_PLURAL = {'asparagus', 'brussels', 'couscous', 'hummus', 'lemongrass', 'molasses', 'swiss'}
+
+_WORD = re.compile(r"[a-z]+(?:['-][a-z]+)*")
+_PARENTHETICAL = re.compile(r"\([^)]*\)")
+
+_index_lock = threading.Lock()
+
+
+def _singular(word):
+    if word in NOT_PLURAL or len(word) <= 3:
+        return word
+    if word.endswith('ies'):
+        return word[:-3] + 'y'
+    if word.endswith(('oes', 'ches', 'shes', 'xes', 'sses')):
+        return word[:-2]
+    if word.endswith('s') and not word.endswith(('ss', 'us', 'is')):
+        return word[:-1]
+    return word
+
+
+def normalize(text):
+    """Reduce an ingredient line to its vocabulary name, or None if nothing is left.
+
+        >>> normalize("2 cups Fresh Tomatoes, diced (about 3)")
+        'tomato'
+    """
+    text = _PARENTHETICAL.sub(' ', (text or '').lower()).split(',')[0]
+    words = [word for word in _WORD.findall(text) if word not in DESCRIPTORS]
+    words = [word for word in words[:-1] if word not in UNITS] + words[-1:]
+    if not words:
+        return None
+    words[-1] = _singular(words[-1])
+    return ' '.join(words)[:MAX_NAME_LENGTH]
+
+
+def parse(text):
+    """The distinct normalized ingredients in a recipe's ingredients text (one per line, or one comma separated line)."""
+    lines = [line for line in (text or '').splitlines() if line.strip()]
+    if len(lines) == 1:
+        lines = lines[0].split(',')
+    return sorted({name for name in map(normalize, lines) if name})
+
+
+def index_recipes(recipes, session=None):
+    """Store the parsed ingredients of (recipe id, ingredients text) pairs; the caller commits."""
+    RecipeIngredient.replace({recipe_id: parse(text) for recipe_id, text in recipes}, session=session)
+
+
+# Keeping recipe_ingredients in step with ORM writes to recipes. Core inserts
+# (e.g. recipe_io's bulk import) call index_recipes themselves.
+@event.listens_for(Session, 'after_flush')
+def _after_flush(session, flush_context):
+    changed = [(recipe.id, recipe.ingredients) for recipe in (*session.new, *session.dirty)
+               if isinstance(recipe, Recipe) and recipe.id is not None
+               and (recipe in session.new or db.inspect(recipe).attrs.ingredients.history.has_changes())]
+    deleted = [recipe.id for recipe in session.deleted if isinstance(recipe, Recipe)]
+
+    if changed:
+        index_recipes(changed, session=session)
+    if deleted:
+        # Postgres cascades this; SQLite doesn't enforce foreign keys
+        session.execute(db.delete(RecipeIngredient).where(RecipeIngredient.recipe_id.in_(deleted)))
+
+
+class PantryIndex:
+    """Inverted index from ingredient to the public recipes that use it, in numpy arrays.
+
+    Recipes are numbered 0..n-1 (`recipe_ids` maps back to ids). The
+    recipes using the ingredient in row r are positions
+    postings[offsets[r]:offsets[r + 1]], sorted. A query concatenates the
+    postings of its ingredients and counts them per recipe with one
+    bincount, so its cost grows with the number of matches rather than the
+    number of ingredients, and no Python loop runs per recipe.
+    """
+
+    def __init__(self, names, ingredient_ids, recipe_ids):
+        """Build from the vocabulary {name: ingredient id} and parallel (ingredient id, recipe id) arrays."""
+        # Imported here so that starting the app doesn't load numpy
+        import numpy as np
+
+        self.names = names
+        self.built_at = time.monotonic()
+
+        ingredient_ids = np.asarray(ingredient_ids, dtype=np.int64)
+        self.recipe_ids, positions = np.unique(np.asarray(recipe_ids, dtype=np.int64), return_inverse=True)
+        positions = positions.astype(np.int32)
+
+        order = np.lexsort((positions, ingredient_ids))
+        ingredient_ids = ingredient_ids[order]
+        self.postings = positions[order]
+        indexed, starts = np.unique(ingredient_ids, return_index=True)
+        self.offsets = np.append(starts, len(ingredient_ids))
+        self.rows = {int(ingredient_id): row for row, ingredient_id in enumerate(indexed)}
+        # Indexed ingredients per recipe, to count what's missing
+        self.totals = np.bincount(self.postings, minlength=len(self.recipe_ids))
+
+    def __len__(self):
+        return len(self.recipe_ids)
+
+    def lookup(self, items):
+        """Split pantry items into (ingredient ids, items we know no recipe by)."""
+        ingredient_ids, unknown = set(), []
+        for item in items:
+            ingredient_id = self.names.get(normalize(item))
+            if ingredient_id in self.rows:
+                ingredient_ids.add(ingredient_id)
+            else:
+                unknown.append(item)
+        return sorted(ingredient_ids), unknown
+
+    def search(self, ingredient_ids, limit=DEFAULT_LIMIT, max_missing=None):
+        """Rank recipes that use any of `ingredient_ids`: fewest missing ingredients first, then most matched.
+
+        Returns (recipe id, matched, missing) tuples.
+        """
+        import numpy as np
+
+        rows = [self.rows[ingredient_id] for ingredient_id in set(ingredient_ids) if ingredient_id in self.rows]
+        if not rows or limit <= 0:
+            return []
+
+        postings = np.concatenate([self.postings[self.offsets[row]:self.offsets[row + 1]] for row in rows])
+        matched = np.bincount(postings, minlength=len(self.recipe_ids))
+        candidates = np.flatnonzero(matched)
+        matched = matched[candidates]
+        missing = self.totals[candidates] - matched
+
+        if max_missing is not None:
+            keep = missing <= max_missing
+            candidates, matched, missing = candidates[keep], matched[keep], missing[keep]
+
+        # One sortable key: missing ascending, then matched descending (a query has < 1024 ingredients)
+        key = missing * 1024 - matched
+        if len(key) > limit:
+            top = np.argpartition(key, limit - 1)[:limit]
+            candidates, matched, missing, key = candidates[top], matched[top], missing[top], key[top]
+        order = np.lexsort((self.recipe_ids[candidates], key))
+
+        return [(int(self.recipe_ids[candidates[i]]), int(matched[i]), int(missing[i])) for i in order]
+
+
+def build_index():
+    """Load the pantry index for public recipes from the database."""
+    import numpy as np
+
+    names = dict(db.session.execute(db.select(Ingredient.name, Ingredient.id)).all())
+    rows = db.session.execute(
+        db.select(RecipeIngredient.ingredient_id, RecipeIngredient.recipe_id)
+        .join(Recipe, Recipe.id == RecipeIngredient.recipe_id)
+        .where(Recipe.is_public.is_(True))
+        .execution_options(yield_per=LOAD_BATCH_SIZE)
+    )
+    pairs = [np.array(batch, dtype=np.int64).reshape(-1, 2) for batch in rows.partitions()]
+    pairs = np.concatenate(pairs) if pairs else np.empty((0, 2), dtype=np.int64)
+    return PantryIndex(names, pairs[:, 0], pairs[:, 1])
+
+
+def _refresh(app):
+    try:
+        with app.app_context():
+            started = time.perf_counter()
+            index = build_index()
+            app.extensions['pantry_index'] = index
+            logger.info("Rebuilt the pantry index (%d recipes) in %.2fs", len(index), time.perf_counter() - started)
+    except Exception:
+        logger.exception("Error rebuilding the pantry index")
+        # Keep serving the old index and try again after another interval, not on every request
+        index = app.extensions.get('pantry_index')
+        if index is not None:
+            index.built_at = time.monotonic()
+    finally:
+        _index_lock.release()
+
+
+def get_pantry_index():
+    """Return this process's pantry index, building it on first use.
+
+    Once it's older than PANTRY_INDEX_REFRESH_SECONDS, one background thread
+    rebuilds it while requests keep using the old one. A failed rebuild is
+    retried after the same interval.
+    """
+
+    index = current_app.extensions.get('pantry_index')
+    if index is None:
+        with _index_lock:
+            index = current_app.extensions.get('pantry_index')
+            if index is None:
+                index = build_index()
+                current_app.extensions['pantry_index'] = index
+        return index
+
+    refresh = current_app.config.get('PANTRY_INDEX_REFRESH_SECONDS', DEFAULT_REFRESH_SECONDS)
+    if time.monotonic() - index.built_at > refresh and _index_lock.acquire(blocking=False):
+        # _refresh releases the lock when it's done
+        threading.Thread(target=_refresh, args=(current_app._get_current_object(),),
+                         name='pantry-index', daemon=True).start()
+    return index
@@ -0,0 +1,409 @@
+import json, logging, multiprocessing, os, random, signal, socket, threading, time, traceback
+from datetime import datetime, timedelta, timezone
+
+import sqlalchemy as sa
+from flask import current_app
+
+import metrics
+from metrics import JOB_DURATION, JOB_WAIT
+from models import db, Job, Recipe, Activity
+from recipe_io import import_recipes as import_recipe_stream
+
+logger = logging.getLogger(__name__)
+
+
+# Higher runs first. User-visible work goes ahead of maintenance.
+PRIORITY_HIGH = 10
+PRIORITY_NORMAL = 0
+PRIORITY_LOW = -10
+
+DEFAULT_LEASE_SECONDS = 5 * 60
+DEFAULT_MAX_ATTEMPTS = 5
+
+# Failed attempts are retried after full jitter exponential backoff
+RETRY_BACKOFF_BASE = 10
+RETRY_BACKOFF_MAX = 60 * 60
+
+
+def utcnow():
+    """Naive UTC now, matching how job timestamps are stored."""
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
+class JobStats:
+    """Thread safe counters for the jobs a process has enqueued and run."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.enqueued = 0
+        self.completed = 0
+        self.retried = 0
+        self.failed = 0
+        self.wait_seconds = 0.0
+        self.run_seconds = 0.0
+
+    def record(self, enqueued=0, completed=0, retried=0, failed=0, wait_seconds=0.0, run_seconds=0.0):
+        with self._lock:
+            self.enqueued += enqueued
+            self.completed += completed
+            self.retried += retried
+            self.failed += failed
+            self.wait_seconds += wait_seconds
+            self.run_seconds += run_seconds
+
+    def as_dict(self):
+        with self._lock:
+            ran = self.completed + self.retried + self.failed
+            return {
+                'enqueued': self.enqueued,
+                'completed': self.completed,
+                'retried': self.retried,
+                'failed': self.failed,
+                'avg_wait_seconds': (self.wait_seconds / ran) if ran else 0.0,
+                'avg_run_seconds': (self.run_seconds / ran) if ran else 0.0,
+            }
+
+
+class JobQueue:
+    """Job queue stored in the `jobs` table of a SQL database.
+
+    A worker takes a job by leasing it for `lease_seconds`. A job whose
+    lease runs out (its worker died or hung) goes back on the queue and
+    counts as a failed attempt. Failed jobs are retried with backoff until
+    `max_attempts`, then kept with status 'failed' for inspection.
+    Finished jobs are deleted.
+
+    On Postgres, dequeuing uses FOR UPDATE SKIP LOCKED so workers don't
+    wait on each other. SQLite serializes writers, which is enough for a
+    single host.
+    """
+
+    def __init__(self, engine, lease_seconds=DEFAULT_LEASE_SECONDS, max_attempts=DEFAULT_MAX_ATTEMPTS):
+        self.engine = engine
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self.stats = JobStats()
+        self.table = Job.__table__
+        self._last_reclaim = 0.0
+
+    def enqueue(self, name, payload=None, priority=PRIORITY_NORMAL, delay=0, max_attempts=None):
+        """Add a job and return its id. It is committed straight away, in its own transaction."""
+        now = utcnow()
+        with self.engine.begin() as conn:
+            job_id = conn.execute(self.table.insert().values(
+                name=name,
+                payload=json.dumps(payload or {}),
+                priority=priority,
+                status='queued',
+                attempts=0,
+                max_attempts=max_attempts or self.max_attempts,
+                run_at=now + timedelta(seconds=delay),
+                created_at=now,
+            )).inserted_primary_key[0]
+
+        self.stats.record(enqueued=1)
+        return job_id
+
+    def dequeue(self, worker_id):
+        """Lease the next due job to `worker_id` and return it as a dict, or None if none are due."""
+        t = self.table
+        now = utcnow()
+
+        if time.monotonic() - self._last_reclaim > self.lease_seconds / 4:
+            self.reclaim_expired()
+
+        next_job = (sa.select(t.c.id)
+                    .where(t.c.status == 'queued', t.c.run_at <= now)
+                    .order_by(t.c.priority.desc(), t.c.run_at, t.c.id)
+                    .limit(1)
+                    .with_for_update(skip_locked=True)
+                    .scalar_subquery())
+
+        with self.engine.begin() as conn:
+            row = conn.execute(
+                t.update()
+                .where(t.c.id == next_job)
+                .values(status='running', attempts=t.c.attempts + 1, locked_by=worker_id,
+                        lease_expires_at=now + timedelta(seconds=self.lease_seconds))
+                .returning(*t.c)
+            ).mappings().first()
+
+        if row is None:
+            return None
+
+        job = dict(row)
+        job['payload'] = json.loads(job['payload'])
+        return job
+
+    def complete(self, job, worker_id):
+        """Delete a finished job. Returns False if `worker_id` had already lost its lease."""
+        t = self.table
+        with self.engine.begin() as conn:
+            done = conn.execute(t.delete().where(
+                t.c.id == job['id'], t.c.status == 'running', t.c.locked_by == worker_id)).rowcount
+        return bool(done)
+
+    def fail(self, job, worker_id, error):
+        """Schedule a retry of a failed job, or mark it failed once it is out of attempts.
+
+        Returns 'retried', 'failed', or None if `worker_id` had already lost its lease.
+        """
+        t = self.table
+        if job['attempts'] < job['max_attempts']:
+            delay = random.uniform(0, min(RETRY_BACKOFF_MAX, RETRY_BACKOFF_BASE * 2 ** job['attempts']))
+            values = {'status': 'queued', 'run_at': utcnow() + timedelta(seconds=delay)}
+            outcome = 'retried'
+        else:
+            values = {'status': 'failed'}
+            outcome = 'failed'
+
+        with self.engine.begin() as conn:
+            updated = conn.execute(
+                t.update()
+                .where(t.c.id == job['id'], t.c.status == 'running', t.c.locked_by == worker_id)
+                .values(locked_by=None, lease_expires_at=None, last_error=error, **values)
+            ).rowcount
+        return outcome if updated else None
+
+    def reclaim_expired(self):
+        """Put running jobs whose lease has run out back on the queue. Returns how many."""
+        t = self.table
+        self._last_reclaim = time.monotonic()
+        with self.engine.begin() as conn:
+            return conn.execute(
+                t.update()
+                .where(t.c.status == 'running', t.c.lease_expires_at < utcnow())
+                .values(status=sa.case((t.c.attempts >= t.c.max_attempts, 'failed'), else_='queued'),
+                        locked_by=None, lease_expires_at=None, last_error="Lease expired")
+            ).rowcount
+
+    def depth(self):
+        """Return the number of jobs in each status and the age in seconds of the oldest due job."""
+        t = self.table
+        now = utcnow()
+        with self.engine.connect() as conn:
+            counts = dict(conn.execute(sa.select(t.c.status, sa.func.count()).group_by(t.c.status)).all())
+            oldest = conn.execute(
+                sa.select(sa.func.min(t.c.run_at)).where(t.c.status == 'queued', t.c.run_at <= now)
+            ).scalar()
+
+        return {
+            'queued': counts.get('queued', 0),
+            'running': counts.get('running', 0),
+            'failed': counts.get('failed', 0),
+            'oldest_queued_seconds': (now - oldest).total_seconds() if oldest else 0.0,
+        }
+
+
+_queue_lock = threading.Lock()
+
+
+def make_queue(config):
+    """Build the job queue described by the app config."""
+
+    backend = config.get('JOB_QUEUE_BACKEND', 'database')
+    options = {
+        'lease_seconds': config.get('JOB_LEASE_SECONDS', DEFAULT_LEASE_SECONDS),
+        'max_attempts': config.get('JOB_MAX_ATTEMPTS', DEFAULT_MAX_ATTEMPTS),
+    }
+
+    if backend == 'database':
+        return JobQueue(db.engine, **options)
+    if backend == 'sqlite':
+        path = config.get('JOB_QUEUE_PATH', os.path.join('instance', 'jobs.sqlite3'))
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        engine = sa.create_engine(f"sqlite:///{path}", connect_args={'timeout': 30})
+        sa.event.listen(engine, 'connect', lambda conn, record: conn.execute("PRAGMA journal_mode=WAL"))
+        Job.__table__.create(engine, checkfirst=True)
+        return JobQueue(engine, **options)
+
+    raise ValueError(f"Unknown job queue backend: {backend}")
+
+
+def get_queue():
+    """Return the job queue for the current app, creating it on first use."""
+
+    queue = current_app.extensions.get('job_queue')
+    if queue is None:
+        with _queue_lock:
+            queue = current_app.extensions.get('job_queue')
+            if queue is None:
+                queue = make_queue(current_app.config)
+                current_app.extensions['job_queue'] = queue
+    return queue
+
+
+def enqueue(name, payload=None, priority=PRIORITY_NORMAL, delay=0):
+    """Enqueue a job on the current app's queue. Call it after committing anything the job reads."""
+
+    return get_queue().enqueue(name, payload, priority=priority, delay=delay)
+
+
+##############################################################################
+# Job handlers:
+
+HANDLERS = {}
+
+
+def handler(name):
+    """Register the decorated function to run jobs called `name` with the job's payload as kwargs."""
+
+    def register(func):
+        HANDLERS[name] = func
+        return func
+    return register
+
+
+@handler('prefetch_recipes')
+def prefetch_recipes(ids):
+    """Store local copies of Spoonacular recipes and fill in the feed titles waiting on them."""
+
+    recipes = [recipe for recipe in Recipe.get_spoonacular_recipes(ids) if recipe]
+    for recipe in recipes:
+        (Activity.query
+         .filter(Activity.spoonacular_id == recipe['spoonacular_id'], Activity.title.is_(None))
+         .update({Activity.title: recipe['title']}, synchronize_session=False))
+    db.session.commit()
+
+
+@handler('refresh_recipes')
+def refresh_recipes(cutoff, batch_size):
+    """Refresh one batch of stale Spoonacular recipes, re-enqueueing itself while more are left."""
+
+    refreshed = Recipe.refresh_stale_spoonacular_recipes(datetime.fromisoformat(cutoff), batch_size=batch_size)
+    # A partly failed batch refreshes fewer than batch_size but may leave more to do
+    if refreshed:
+        enqueue('refresh_recipes', {'cutoff': cutoff, 'batch_size': batch_size}, priority=PRIORITY_LOW)
+
+
+@handler('import_recipes')
+def import_recipes(path, user_id, format):
+    """Import an uploaded recipes file, then delete it."""
+
+    try:
+        with open(path, encoding='utf-8', newline='') as stream:
+            result = import_recipe_stream(stream, user_id, format)
+    finally:
+        # Import jobs aren't retried, so a failed one mustn't leave its upload behind
+        os.remove(path)
+    logger.info("Imported %d recipes for user %d from %s (%d rejected)",
+                result.imported, user_id, os.path.basename(path), result.rejected)
+
+
+##############################################################################
+# Workers:
+
+
+class Worker:
+    """Runs queued jobs on a pool of threads until stopped."""
+
+    def __init__(self, app, threads=4, poll_interval=1.0, name=None):
+        self.app = app
+        self.threads = threads
+        self.poll_interval = poll_interval
+        self.name = name or f"{socket.gethostname()}:{os.getpid()}"
+        self._stop = threading.Event()
+
+    def run(self):
+        """Run until SIGINT/SIGTERM, letting jobs in progress finish."""
+        if threading.current_thread() is threading.main_thread():
+            signal.signal(signal.SIGTERM, lambda signum, frame: self.stop())
+            signal.signal(signal.SIGINT, lambda signum, frame: self.stop())
+
+        pool = [threading.Thread(target=self._loop, args=(f"{self.name}:{n}",), daemon=True)
+                for n in range(self.threads)]
+        for thread in pool:
+            thread.start()
+        while any(thread.is_alive() for thread in pool):
+            for thread in pool:
+                thread.join(timeout=0.5)
+
+    def stop(self):
+        self._stop.set()
+
+    def _loop(self, worker_id):
+        while not self._stop.is_set():
+            try:
+                ran = self.run_once(worker_id)
+            except Exception:
+                # The queue itself failed (e.g. the database is down); back off and retry
+                logger.exception("Job queue error")
+                ran = False
+            if not ran:
+                self._stop.wait(self.poll_interval)
+
+    def run_once(self, worker_id=None):
+        """Run one due job, if there is one. Returns whether a job was run."""
+        worker_id = worker_id or self.name
+
+        with self.app.app_context():
+            queue = get_queue()
+            job = queue.dequeue(worker_id)
+            if job is None:
+                return False
+
+            started = time.monotonic()
+            wait_seconds = (utcnow() - job['run_at']).total_seconds()
+            JOB_WAIT.observe(wait_seconds, job=job['name'])
+            try:
+                func = HANDLERS.get(job['name'])
+                if func is None:
+                    raise LookupError(f"No handler for job {job['name']!r}")
+                func(**job['payload'])
+            except Exception:
+                db.session.rollback()
+                logger.exception("Job %s (%s) attempt %s failed", job['id'], job['name'], job['attempts'])
+                outcome = queue.fail(job, worker_id, traceback.format_exc()) or 'lease_lost'
+                run_seconds = time.monotonic() - started
+                queue.stats.record(retried=outcome == 'retried', failed=outcome == 'failed',
+                                   wait_seconds=wait_seconds, run_seconds=run_seconds)
+            else:
+                outcome = 'completed' if queue.complete(job, worker_id) else 'lease_lost'
+                run_seconds = time.monotonic() - started
+                queue.stats.record(completed=1, wait_seconds=wait_seconds, run_seconds=run_seconds)
+            finally:
+                db.session.remove()
+
+            JOB_DURATION.observe(run_seconds, job=job['name'], outcome=outcome)
+
+        return True
+
+
+def _run_child(app, threads, poll_interval, metrics_port):
+    # Connections inherited from the parent must not be shared with it
+    with app.app_context():
+        db.engine.dispose(close=False)
+    app.extensions.pop('job_queue', None)
+    if metrics_port:
+        metrics.serve(app, metrics_port)
+    Worker(app, threads=threads, poll_interval=poll_interval).run()
+
+
+def run_workers(app, processes=1, threads=4, poll_interval=1.0, metrics_port=None):
+    """Run `processes` worker processes of `threads` threads each, until SIGINT/SIGTERM.
+
+    With `metrics_port`, process n serves its metrics on metrics_port + n.
+    """
+
+    if processes <= 1:
+        if metrics_port:
+            metrics.serve(app, metrics_port)
+        Worker(app, threads=threads, poll_interval=poll_interval).run()
+        return
+
+    context = multiprocessing.get_context('fork')
+    children = [context.Process(target=_run_child,
+                                args=(app, threads, poll_interval, metrics_port and metrics_port + n))
+                for n in range(processes)]
+    for child in children:
+        child.start()
+
+    def stop(signum, frame):
+        for child in children:
+            if child.is_alive():
+                child.terminate()
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    for child in children:
+        child.join()
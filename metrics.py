@@ -0,0 +1,447 @@
+import atexit, bisect, json, logging, os, re, threading, time
+from wsgiref.simple_server import make_server, WSGIRequestHandler
+
+from flask import current_app, g, has_request_context, request
+from flask.signals import before_render_template, template_rendered
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+
+# Latency buckets (seconds), from a cache hit to a slow Spoonacular call
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+COUNT_BUCKETS = (0, 1, 2, 3, 5, 8, 13, 21, 34, 55, 89)
+
+# How often each process saves its metrics in multiprocess mode
+WRITE_INTERVAL = 1.0
+
+logger = logging.getLogger(__name__)
+
+
+def _escape(value):
+    return str(value).replace('\\', r'\\').replace('\n', r'\n').replace('"', r'\"')
+
+
+def _format_labels(names, values, extra=()):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    pairs += [f'{name}="{_escape(value)}"' for name, value in extra]
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def _add(total, value):
+    # Histogram samples are lists of bucket counts and a sum, added element by element
+    if isinstance(value, list):
+        return [a + b for a, b in zip(total, value)] if total is not None else list(value)
+    return value if total is None else total + value
+
+
+def _alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+class Metric:
+    """Base class for metrics with a fixed set of label names.
+
+    `collect`, if given, is called at scrape time and returns (labels, value)
+    pairs to report, for values that are kept elsewhere (e.g. cache stats).
+    In multiprocess mode, counters and histograms are summed over every
+    process that has written to the directory, including ones that exited.
+    """
+
+    kind = None
+    multiprocess_mode = 'sum'
+
+    def __init__(self, name, help, labelnames=(), collect=None):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.collect = collect
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def _key(self, labels):
+        return tuple(labels.get(name, '') for name in self.labelnames)
+
+    def samples(self):
+        """Return sorted (label values, value) pairs, calling the collector first if there is one."""
+        if self.collect:
+            try:
+                collected = {self._key(labels): value for labels, value in self.collect()}
+            except Exception:
+                # A broken collector must not take the whole endpoint down
+                collected = {}
+            with self._lock:
+                self._values = collected
+
+        with self._lock:
+            return sorted((key, list(value) if isinstance(value, list) else value)
+                          for key, value in self._values.items())
+
+    def merge(self, processes):
+        """Combine the samples of (pid, alive, samples) processes; returns the samples and their label names."""
+        totals = {}
+        for _, _, samples in processes:
+            for key, value in samples:
+                totals[key] = _add(totals.get(key), value)
+        return sorted(totals.items()), self.labelnames
+
+    def render(self, samples=None, labelnames=None):
+        if samples is None:
+            samples = self.samples()
+        labelnames = self.labelnames if labelnames is None else labelnames
+
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        for key, value in samples:
+            lines += self._render_sample(labelnames, key, value)
+        return lines
+
+    def _render_sample(self, labelnames, key, value):
+        return [f"{self.name}{_format_labels(labelnames, key)} {_format_value(value)}"]
+
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(Metric):
+    """A value that goes up and down.
+
+    `multiprocess_mode` says how values from several processes are reported:
+    'all' gives each live process its own series with a pid label, 'sum'
+    adds up the live processes, and 'local' reports only the process that
+    answers the scrape, for values read from a shared store (e.g. the job
+    queue) that every process would report the same.
+    """
+
+    kind = 'gauge'
+
+    def __init__(self, name, help, labelnames=(), collect=None, multiprocess_mode='all'):
+        super().__init__(name, help, labelnames, collect)
+        self.multiprocess_mode = multiprocess_mode
+
+    def merge(self, processes):
+        live = [(pid, alive, samples) for pid, alive, samples in processes if alive]
+        if self.multiprocess_mode == 'all':
+            samples = [(key + (str(pid),), value) for pid, _, samples in live for key, value in samples]
+            return sorted(samples), self.labelnames + ('pid',)
+        return super().merge(live)
+
+    def set(self, value, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+
+class Histogram(Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, help, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            counts = self._values.get(key)
+            if counts is None:
+                # One count per bucket plus +Inf, then the running sum
+                counts = self._values[key] = [0] * (len(self.buckets) + 1) + [0.0]
+            counts[index] += 1
+            counts[-1] += value
+
+    def _render_sample(self, labelnames, key, counts):
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets + (float('inf'),), counts):
+            cumulative += count
+            labels = _format_labels(labelnames, key, [('le', _format_value(bound))])
+            lines.append(f"{self.name}_bucket{labels} {cumulative}")
+        labels = _format_labels(labelnames, key)
+        lines.append(f"{self.name}_sum{labels} {_format_value(counts[-1])}")
+        lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+
+class Registry:
+    """All of this process's metrics, rendered in the Prometheus text format."""
+
+    def __init__(self):
+        self.metrics = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def render(self):
+        lines = []
+        for metric in self.metrics:
+            lines += metric.render()
+        return '\n'.join(lines) + '\n'
+
+    def write(self, path):
+        """Save this process's samples to `path` for `render_multiprocess`."""
+        data = {metric.name: metric.samples() for metric in self.metrics if metric.multiprocess_mode != 'local'}
+        with open(f"{path}.tmp", 'w') as f:
+            json.dump(data, f)
+        os.replace(f"{path}.tmp", path)
+
+    def render_multiprocess(self, directory):
+        """Render the metrics saved in `directory` by every process, merged, plus this process's local gauges."""
+        processes = []
+        for name in os.listdir(directory):
+            if not name.endswith('.json'):
+                continue
+            try:
+                with open(os.path.join(directory, name)) as f:
+                    data = json.load(f)
+            except (OSError, ValueError):
+                continue
+            pid = int(name.split('_')[0])
+            processes.append((pid, _alive(pid), data))
+
+        lines = []
+        for metric in self.metrics:
+            if metric.multiprocess_mode == 'local':
+                lines += metric.render()
+                continue
+            samples = [(pid, alive, [(tuple(key), value) for key, value in data.get(metric.name, [])])
+                       for pid, alive, data in processes]
+            lines += metric.render(*metric.merge(samples))
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+REQUEST_DURATION = REGISTRY.register(Histogram(
+    'foodfriends_request_duration_seconds', "Time spent handling requests.",
+    ['endpoint', 'method', 'status']))
+REQUEST_QUERIES = REGISTRY.register(Histogram(
+    'foodfriends_request_db_queries', "SQL statements run per request.",
+    ['endpoint'], buckets=COUNT_BUCKETS))
+REQUEST_DB_DURATION = REGISTRY.register(Histogram(
+    'foodfriends_request_db_duration_seconds', "Total time per request spent waiting on SQL.",
+    ['endpoint']))
+TEMPLATE_DURATION = REGISTRY.register(Histogram(
+    'foodfriends_template_render_seconds', "Time spent rendering each Jinja template.",
+    ['template']))
+SPOONACULAR_REQUESTS = REGISTRY.register(Counter(
+    'foodfriends_spoonacular_requests_total', "Spoonacular HTTP calls, by outcome.",
+    ['path', 'status']))
+SPOONACULAR_DURATION = REGISTRY.register(Histogram(
+    'foodfriends_spoonacular_request_duration_seconds', "Latency of Spoonacular HTTP calls, including retries.",
+    ['path']))
+ERRORS = REGISTRY.register(Counter(
+    'foodfriends_errors_total', "Errors that were handled and logged rather than raised.",
+    ['source']))
+JOB_WAIT = REGISTRY.register(Histogram(
+    'foodfriends_job_wait_seconds', "Time jobs spent due but waiting for a worker.",
+    ['job'], buckets=DEFAULT_BUCKETS + (30, 60, 300, 900)))
+JOB_DURATION = REGISTRY.register(Histogram(
+    'foodfriends_job_duration_seconds', "Time spent running jobs, by outcome.",
+    ['job', 'outcome'], buckets=DEFAULT_BUCKETS + (30, 60, 300)))
+PASSWORD_HASHES_REJECTED = REGISTRY.register(Counter(
+    'foodfriends_password_hashes_rejected_total', "Logins and signups turned away because hashing was saturated."))
+
+
+# Per-app caches, found by their key in app.extensions
+CACHES = {'spoonacular': 'spoonacular_cache', 'current_user': 'current_user_cache', 'images': 'image_cache',
+          'fragments': 'fragment_cache', 'random_pool': 'random_pool'}
+
+
+def _cache_stats():
+    for cache, key in CACHES.items():
+        backend = current_app.extensions.get(key)
+        if backend is not None:
+            yield cache, backend.stats.as_dict()
+
+
+def _collect_cache(field):
+    return lambda: [({'cache': cache}, stats[field]) for cache, stats in _cache_stats()]
+
+
+def _collect_queue_depth():
+    # Imported here because jobs imports this module
+    from jobs import get_queue
+    depth = get_queue().depth()
+    return [({'status': status}, depth[status]) for status in ('queued', 'running', 'failed')]
+
+
+def _collect_queue_age():
+    from jobs import get_queue
+    return [({}, get_queue().depth()['oldest_queued_seconds'])]
+
+
+def _collect_password_hashes():
+    hasher = current_app.extensions.get('password_hasher')
+    return [({}, hasher.in_flight)] if hasher is not None else []
+
+
+REGISTRY.register(Counter('foodfriends_cache_hits_total', "Cache lookups that found a value.",
+                          ['cache'], collect=_collect_cache('hits')))
+REGISTRY.register(Counter('foodfriends_cache_misses_total', "Cache lookups that found nothing.",
+                          ['cache'], collect=_collect_cache('misses')))
+REGISTRY.register(Counter('foodfriends_cache_evictions_total', "Entries evicted to stay within the size limit.",
+                          ['cache'], collect=_collect_cache('evictions')))
+REGISTRY.register(Gauge('foodfriends_cache_hit_ratio', "Share of cache lookups that were hits.",
+                        ['cache'], collect=_collect_cache('hit_rate')))
+REGISTRY.register(Gauge('foodfriends_job_queue_depth', "Jobs in the queue, by status.",
+                        ['status'], collect=_collect_queue_depth, multiprocess_mode='local'))
+REGISTRY.register(Gauge('foodfriends_job_queue_oldest_seconds', "Age of the oldest job that is due but not started.",
+                        collect=_collect_queue_age, multiprocess_mode='local'))
+REGISTRY.register(Gauge('foodfriends_password_hashes_in_flight', "Password hashes running or waiting for a thread.",
+                        collect=_collect_password_hashes, multiprocess_mode='sum'))
+
+
+# Recipe ids in Spoonacular paths would make a label value per recipe
+_ID_PATTERN = re.compile(r'/\d+(?=/|$)')
+
+
+def spoonacular_path_label(path):
+    """Collapse the ids in a Spoonacular API path, e.g. /recipes/{id}/information."""
+    return _ID_PATTERN.sub('/{id}', path)
+
+
+def _endpoint():
+    return request.endpoint or 'unmatched'
+
+
+##############################################################################
+# Flask and SQLAlchemy hooks:
+
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info['query_started'] = time.perf_counter()
+
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    started = conn.info.pop('query_started', None)
+    if started is not None and has_request_context() and 'request_started' in g:
+        g.db_queries += 1
+        g.db_seconds += time.perf_counter() - started
+
+
+def _before_render(app, template, context, **extra):
+    if has_request_context():
+        g.setdefault('template_started', []).append(time.perf_counter())
+
+
+def _rendered(app, template, context, **extra):
+    if has_request_context() and g.get('template_started'):
+        TEMPLATE_DURATION.observe(time.perf_counter() - g.template_started.pop(),
+                                  template=template.name or 'string')
+
+
+def init_app(app):
+    """Time every request, count its SQL, and time template rendering."""
+
+    @app.before_request
+    def start_timer():
+        if app.config.get('METRICS_MULTIPROC_DIR'):
+            get_writer(app)
+        g.request_started = time.perf_counter()
+        g.db_queries = 0
+        g.db_seconds = 0.0
+
+    @app.after_request
+    def record_request(response):
+        if 'request_started' in g:
+            endpoint = _endpoint()
+            REQUEST_DURATION.observe(time.perf_counter() - g.request_started, endpoint=endpoint,
+                                     method=request.method, status=response.status_code)
+            REQUEST_QUERIES.observe(g.db_queries, endpoint=endpoint)
+            REQUEST_DB_DURATION.observe(g.db_seconds, endpoint=endpoint)
+        return response
+
+    before_render_template.connect(_before_render, app)
+    template_rendered.connect(_rendered, app)
+
+
+class MultiprocessWriter:
+    """Saves this process's metrics to its own file in `directory` every WRITE_INTERVAL seconds.
+
+    Files are named after the pid, so the scraping process can tell which
+    processes are still alive, and a start time, so a reused pid doesn't
+    overwrite the counters of the process that had it before.
+    """
+
+    def __init__(self, app, directory, interval=WRITE_INTERVAL):
+        os.makedirs(directory, exist_ok=True)
+        self.app = app
+        self.pid = os.getpid()
+        self.path = os.path.join(directory, f"{self.pid}_{time.time_ns()}.json")
+        self.interval = interval
+        self._stopped = threading.Event()
+
+    def start(self):
+        threading.Thread(target=self._run, daemon=True).start()
+        atexit.register(self.write)
+        return self
+
+    def stop(self):
+        self._stopped.set()
+        atexit.unregister(self.write)
+
+    def write(self):
+        with self.app.app_context():
+            REGISTRY.write(self.path)
+
+    def _run(self):
+        while not self._stopped.wait(self.interval):
+            try:
+                self.write()
+            except Exception:
+                logger.exception("Error saving metrics to %s", self.path)
+
+
+_writer_lock = threading.Lock()
+
+
+def get_writer(app):
+    """Return this process's MultiprocessWriter, starting it on first use (e.g. after a fork)."""
+    writer = app.extensions.get('metrics_writer')
+    if writer is None or writer.pid != os.getpid():
+        with _writer_lock:
+            writer = app.extensions.get('metrics_writer')
+            if writer is None or writer.pid != os.getpid():
+                writer = app.extensions['metrics_writer'] = MultiprocessWriter(
+                    app, app.config['METRICS_MULTIPROC_DIR']).start()
+    return writer
+
+
+class _QuietHandler(WSGIRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+
+def serve(app, port, host='0.0.0.0'):
+    """Serve REGISTRY on http://host:port/ from a daemon thread, for processes that aren't web servers."""
+
+    def metrics_app(environ, start_response):
+        with app.app_context():
+            body = REGISTRY.render().encode()
+        start_response('200 OK', [('Content-Type', CONTENT_TYPE), ('Content-Length', str(len(body)))])
+        return [body]
+
+    server = make_server(host, port, metrics_app, handler_class=_QuietHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
@@ -0,0 +1,28 @@
+"""store spoonacular recipes locally
+
+Revision ID: 8f3a2c1d9b47
+Revises: 354dee2b511e
+Create Date: 2026-10-18 10:31:02.118204
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '8f3a2c1d9b47'
+down_revision = '354dee2b511e'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('recipes', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('fetched_at', sa.DateTime(), nullable=True))
+        batch_op.create_unique_constraint('recipes_spoonacular_id_key', ['spoonacular_id'])
+
+
+def downgrade():
+    with op.batch_alter_table('recipes', schema=None) as batch_op:
+        batch_op.drop_constraint('recipes_spoonacular_id_key', type_='unique')
+        batch_op.drop_column('fetched_at')
@@ -0,0 +1,58 @@
+"""add activities and timeline_entries for the activity feed
+
+Revision ID: a9d4e2b7c615
+Revises: f2c8d3a6e417
+Create Date: 2026-10-18 14:02:17.583920
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a9d4e2b7c615'
+down_revision = 'f2c8d3a6e417'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('activities',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('actor_id', sa.Integer(), nullable=False),
+    sa.Column('verb', sa.String(length=20), nullable=False),
+    sa.Column('recipe_id', sa.Integer(), nullable=True),
+    sa.Column('spoonacular_id', sa.Integer(), nullable=True),
+    sa.Column('title', sa.String(length=255), nullable=True),
+    sa.Column('rating', sa.Integer(), nullable=True),
+    sa.Column('fanned_out', sa.Boolean(), server_default=sa.true(), nullable=False),
+    sa.Column('created_at', sa.DateTime(), nullable=True),
+    sa.ForeignKeyConstraint(['actor_id'], ['users.id'], ondelete='CASCADE'),
+    sa.ForeignKeyConstraint(['recipe_id'], ['recipes.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('id')
+    )
+    with op.batch_alter_table('activities', schema=None) as batch_op:
+        batch_op.create_index('ix_activities_actor_id', ['actor_id'], unique=False)
+        batch_op.create_index('ix_activities_actor_id_id_pull', ['actor_id', 'id'], unique=False,
+                              postgresql_where=sa.text('NOT fanned_out'),
+                              sqlite_where=sa.text('NOT fanned_out'))
+        batch_op.create_index('ix_activities_recipe_id', ['recipe_id'], unique=False)
+
+    op.create_table('timeline_entries',
+    sa.Column('user_id', sa.Integer(), nullable=False),
+    sa.Column('activity_id', sa.Integer(), nullable=False),
+    sa.ForeignKeyConstraint(['activity_id'], ['activities.id'], ondelete='CASCADE'),
+    sa.ForeignKeyConstraint(['user_id'], ['users.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('user_id', 'activity_id')
+    )
+
+
+def downgrade():
+    op.drop_table('timeline_entries')
+
+    with op.batch_alter_table('activities', schema=None) as batch_op:
+        batch_op.drop_index('ix_activities_recipe_id')
+        batch_op.drop_index('ix_activities_actor_id_id_pull')
+        batch_op.drop_index('ix_activities_actor_id')
+
+    op.drop_table('activities')
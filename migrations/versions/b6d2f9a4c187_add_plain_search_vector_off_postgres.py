@@ -0,0 +1,36 @@
+"""add a plain recipes.search_vector column on databases other than Postgres
+
+Revision ID: b6d2f9a4c187
+Revises: e9b2d5a7c310
+Create Date: 2026-10-18 15:42:10.518362
+
+Recipe.search_vector is now mapped (deferred), so the column has to exist
+for the model to load. d4b9e6f1a2c8 only created it on Postgres; other
+databases get a plain, always-NULL Text column here. Postgres already has
+the generated column, so nothing changes there.
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b6d2f9a4c187'
+down_revision = 'e9b2d5a7c310'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    if op.get_bind().dialect.name == 'postgresql':
+        return
+
+    op.add_column('recipes', sa.Column('search_vector', sa.Text(), nullable=True))
+
+
+def downgrade():
+    if op.get_bind().dialect.name == 'postgresql':
+        return
+
+    with op.batch_alter_table('recipes', schema=None) as batch_op:
+        batch_op.drop_column('search_vector')
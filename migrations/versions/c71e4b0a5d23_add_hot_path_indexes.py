@@ -0,0 +1,73 @@
+"""add indexes for hot lookup columns
+
+Revision ID: c71e4b0a5d23
+Revises: 8f3a2c1d9b47
+Create Date: 2026-10-18 10:48:37.902511
+
+Duplicate favorites and friend requests are removed (keeping the oldest
+row) before the unique constraints are added.
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c71e4b0a5d23'
+down_revision = '8f3a2c1d9b47'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    is_postgres = op.get_bind().dialect.name == 'postgresql'
+
+    op.execute(
+        "DELETE FROM favorites WHERE recipe_id IS NOT NULL AND id NOT IN ("
+        " SELECT min(id) FROM favorites WHERE recipe_id IS NOT NULL GROUP BY user_id, recipe_id)"
+    )
+    op.execute(
+        "DELETE FROM favorites WHERE spoonacular_id IS NOT NULL AND id NOT IN ("
+        " SELECT min(id) FROM favorites WHERE spoonacular_id IS NOT NULL GROUP BY user_id, spoonacular_id)"
+    )
+    op.execute(
+        "DELETE FROM friends WHERE id NOT IN ("
+        " SELECT min(id) FROM friends GROUP BY user_id, friend_id)"
+    )
+
+    with op.batch_alter_table('favorites', schema=None) as batch_op:
+        batch_op.create_unique_constraint('uq_favorites_user_recipe', ['user_id', 'recipe_id'])
+        batch_op.create_unique_constraint('uq_favorites_user_spoonacular', ['user_id', 'spoonacular_id'])
+        batch_op.create_index('ix_favorites_recipe_id', ['recipe_id'], unique=False)
+
+    with op.batch_alter_table('friends', schema=None) as batch_op:
+        batch_op.create_unique_constraint('uq_friends_user_friend', ['user_id', 'friend_id'])
+        batch_op.create_index('ix_friends_friend_id_status', ['friend_id', 'status'], unique=False)
+        batch_op.create_index('ix_friends_user_id_accepted', ['user_id'], unique=False,
+                              postgresql_where=sa.text("status = 'accepted'"))
+
+    op.create_index('ix_recipes_user_id', 'recipes', ['user_id'], unique=False)
+    op.create_index('ix_ratings_recipe_id', 'ratings', ['recipe_id'], unique=False)
+
+    if is_postgres:
+        op.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+        op.create_index('ix_users_username_trgm', 'users', ['username'], unique=False,
+                        postgresql_using='gin', postgresql_ops={'username': 'gin_trgm_ops'})
+    else:
+        op.create_index('ix_users_username_trgm', 'users', ['username'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_users_username_trgm', table_name='users')
+    op.drop_index('ix_ratings_recipe_id', table_name='ratings')
+    op.drop_index('ix_recipes_user_id', table_name='recipes')
+
+    with op.batch_alter_table('friends', schema=None) as batch_op:
+        batch_op.drop_index('ix_friends_user_id_accepted')
+        batch_op.drop_index('ix_friends_friend_id_status')
+        batch_op.drop_constraint('uq_friends_user_friend', type_='unique')
+
+    with op.batch_alter_table('favorites', schema=None) as batch_op:
+        batch_op.drop_index('ix_favorites_recipe_id')
+        batch_op.drop_constraint('uq_favorites_user_spoonacular', type_='unique')
+        batch_op.drop_constraint('uq_favorites_user_recipe', type_='unique')
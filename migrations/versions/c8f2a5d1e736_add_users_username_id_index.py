@@ -0,0 +1,26 @@
+"""add (username, id) index for keyset pagination of users
+
+Revision ID: c8f2a5d1e736
+Revises: b3e7c1f9d284
+Create Date: 2026-10-18 16:02:11.417390
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c8f2a5d1e736'
+down_revision = 'b3e7c1f9d284'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('users', schema=None) as batch_op:
+        batch_op.create_index('ix_users_username_id', ['username', 'id'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('users', schema=None) as batch_op:
+        batch_op.drop_index('ix_users_username_id')
@@ -0,0 +1,45 @@
+"""add full-text search vector to recipes
+
+Revision ID: d4b9e6f1a2c8
+Revises: c71e4b0a5d23
+Create Date: 2026-10-18 11:20:44.381027
+
+search_vector is a stored generated column, so Postgres keeps it current on
+every insert and update. Only public user-created recipes are searched, so
+the GIN index is partial on the same condition. Both are Postgres-only and
+aren't mapped on the Recipe model (see models.UNMAPPED_SCHEMA_OBJECTS).
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd4b9e6f1a2c8'
+down_revision = 'c71e4b0a5d23'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    if op.get_bind().dialect.name != 'postgresql':
+        return
+
+    op.execute("""
+        ALTER TABLE recipes ADD COLUMN search_vector tsvector GENERATED ALWAYS AS (
+            setweight(to_tsvector('english', coalesce(title, '')), 'A') ||
+            setweight(to_tsvector('english', coalesce(ingredients, '')), 'B') ||
+            setweight(to_tsvector('english', coalesce(instructions, '')), 'C')
+        ) STORED
+    """)
+    op.create_index('ix_recipes_search_vector', 'recipes', ['search_vector'], unique=False,
+                    postgresql_using='gin',
+                    postgresql_where=sa.text("is_public AND spoonacular_id IS NULL"))
+
+
+def downgrade():
+    if op.get_bind().dialect.name != 'postgresql':
+        return
+
+    op.drop_index('ix_recipes_search_vector', table_name='recipes')
+    op.drop_column('recipes', 'search_vector')
@@ -0,0 +1,66 @@
+"""add recipe_ratings rollups and one rating per user per recipe
+
+Revision ID: d7a3e9c2f481
+Revises: c8f2a5d1e736
+Create Date: 2026-10-18 16:41:52.608213
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd7a3e9c2f481'
+down_revision = 'c8f2a5d1e736'
+branch_labels = None
+depends_on = None
+
+# Must match models.RATING_PRIOR_MEAN / RATING_PRIOR_COUNT
+PRIOR_MEAN = 3.0
+PRIOR_COUNT = 5
+
+
+def upgrade():
+    # Keep each user's latest rating of a recipe before making them unique
+    op.execute(
+        "DELETE FROM ratings WHERE id NOT IN "
+        "(SELECT MAX(id) FROM ratings GROUP BY user_id, recipe_id)"
+    )
+    with op.batch_alter_table('ratings', schema=None) as batch_op:
+        batch_op.create_unique_constraint('uq_ratings_user_id_recipe_id', ['user_id', 'recipe_id'])
+
+    op.create_table('recipe_ratings',
+    sa.Column('recipe_id', sa.Integer(), nullable=False),
+    sa.Column('rating_count', sa.Integer(), nullable=False),
+    sa.Column('rating_sum', sa.Integer(), nullable=False),
+    sa.Column('stars_1', sa.Integer(), nullable=False),
+    sa.Column('stars_2', sa.Integer(), nullable=False),
+    sa.Column('stars_3', sa.Integer(), nullable=False),
+    sa.Column('stars_4', sa.Integer(), nullable=False),
+    sa.Column('stars_5', sa.Integer(), nullable=False),
+    sa.Column('average', sa.Float(), nullable=True),
+    sa.Column('score', sa.Float(), nullable=False),
+    sa.ForeignKeyConstraint(['recipe_id'], ['recipes.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('recipe_id')
+    )
+    with op.batch_alter_table('recipe_ratings', schema=None) as batch_op:
+        batch_op.create_index('ix_recipe_ratings_score', ['score', 'recipe_id'], unique=False)
+
+    op.execute(
+        "INSERT INTO recipe_ratings (recipe_id, rating_count, rating_sum, "
+        "stars_1, stars_2, stars_3, stars_4, stars_5, average, score) "
+        "SELECT recipe_id, COUNT(*), SUM(rating), "
+        + ", ".join(f"SUM(CASE WHEN rating = {stars} THEN 1 ELSE 0 END)" for stars in range(1, 6))
+        + ", AVG(rating * 1.0), "
+        f"(SUM(rating) + {PRIOR_MEAN * PRIOR_COUNT}) / (COUNT(*) + {PRIOR_COUNT}.0) "
+        "FROM ratings GROUP BY recipe_id"
+    )
+
+
+def downgrade():
+    with op.batch_alter_table('recipe_ratings', schema=None) as batch_op:
+        batch_op.drop_index('ix_recipe_ratings_score')
+
+    op.drop_table('recipe_ratings')
+    with op.batch_alter_table('ratings', schema=None) as batch_op:
+        batch_op.drop_constraint('uq_ratings_user_id_recipe_id', type_='unique')
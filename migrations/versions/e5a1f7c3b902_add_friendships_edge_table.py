@@ -0,0 +1,39 @@
+"""add symmetric friendships table and users.friend_count
+
+Revision ID: e5a1f7c3b902
+Revises: d4b9e6f1a2c8
+Create Date: 2026-10-18 11:52:09.664180
+
+Run `flask backfill-friendships` once after upgrading to fill the table
+and the counts from existing accepted friend requests.
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e5a1f7c3b902'
+down_revision = 'd4b9e6f1a2c8'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('friendships',
+    sa.Column('user_id', sa.Integer(), nullable=False),
+    sa.Column('friend_id', sa.Integer(), nullable=False),
+    sa.Column('created_at', sa.DateTime(), nullable=True),
+    sa.ForeignKeyConstraint(['friend_id'], ['users.id'], ondelete='CASCADE'),
+    sa.ForeignKeyConstraint(['user_id'], ['users.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('user_id', 'friend_id')
+    )
+    with op.batch_alter_table('users', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('friend_count', sa.Integer(), server_default='0', nullable=False))
+
+
+def downgrade():
+    with op.batch_alter_table('users', schema=None) as batch_op:
+        batch_op.drop_column('friend_count')
+
+    op.drop_table('friendships')
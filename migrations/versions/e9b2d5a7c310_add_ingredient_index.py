@@ -0,0 +1,44 @@
+"""add ingredients and the recipe_ingredients inverted index
+
+Revision ID: e9b2d5a7c310
+Revises: d7a3e9c2f481
+Create Date: 2026-10-18 11:07:33.140288
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e9b2d5a7c310'
+down_revision = 'd7a3e9c2f481'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Existing recipes are indexed by `flask index-ingredients`, not here,
+    # since parsing every recipe's ingredients would hold the migration open
+    op.create_table('ingredients',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('name', sa.String(length=100), nullable=False),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('name')
+    )
+    op.create_table('recipe_ingredients',
+    sa.Column('recipe_id', sa.Integer(), nullable=False),
+    sa.Column('ingredient_id', sa.Integer(), nullable=False),
+    sa.ForeignKeyConstraint(['ingredient_id'], ['ingredients.id'], ondelete='CASCADE'),
+    sa.ForeignKeyConstraint(['recipe_id'], ['recipes.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('recipe_id', 'ingredient_id')
+    )
+    with op.batch_alter_table('recipe_ingredients', schema=None) as batch_op:
+        batch_op.create_index('ix_recipe_ingredients_ingredient_id_recipe_id', ['ingredient_id', 'recipe_id'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('recipe_ingredients', schema=None) as batch_op:
+        batch_op.drop_index('ix_recipe_ingredients_ingredient_id_recipe_id')
+
+    op.drop_table('recipe_ingredients')
+    op.drop_table('ingredients')
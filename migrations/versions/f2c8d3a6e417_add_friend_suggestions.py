@@ -0,0 +1,43 @@
+"""add friend_suggestions table
+
+Revision ID: f2c8d3a6e417
+Revises: e5a1f7c3b902
+Create Date: 2026-10-18 13:24:41.207513
+
+Run `flask rebuild-suggestions` once after upgrading (and after
+`flask backfill-friendships`) to fill it for existing users.
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'f2c8d3a6e417'
+down_revision = 'e5a1f7c3b902'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('friend_suggestions',
+    sa.Column('user_id', sa.Integer(), nullable=False),
+    sa.Column('suggested_id', sa.Integer(), nullable=False),
+    sa.Column('mutual_count', sa.Integer(), nullable=False),
+    sa.Column('shared_favorites', sa.Integer(), nullable=False),
+    sa.Column('score', sa.Integer(), nullable=False),
+    sa.ForeignKeyConstraint(['suggested_id'], ['users.id'], ondelete='CASCADE'),
+    sa.ForeignKeyConstraint(['user_id'], ['users.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('user_id', 'suggested_id')
+    )
+    with op.batch_alter_table('friend_suggestions', schema=None) as batch_op:
+        batch_op.create_index('ix_friend_suggestions_suggested_id', ['suggested_id'], unique=False)
+        batch_op.create_index('ix_friend_suggestions_user_id_score', ['user_id', 'score'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('friend_suggestions', schema=None) as batch_op:
+        batch_op.drop_index('ix_friend_suggestions_user_id_score')
+        batch_op.drop_index('ix_friend_suggestions_suggested_id')
+
+    op.drop_table('friend_suggestions')
@@ -1,13 +1,103 @@
-import requests, re
-from flask import current_app
+import logging, requests, re
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timezone
 
-from flask_bcrypt import Bcrypt
+from cache import get_cache, get_ttl
+from metrics import ERRORS
+from passwords import get_password_hasher
+from spoonacular import get_client
+
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy.dialects.postgresql import TSVECTOR
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.orm import Session, deferred
+from sqlalchemy.schema import CreateColumn
 
-bcrypt = Bcrypt()
 db = SQLAlchemy()
 
+logger = logging.getLogger(__name__)
+
+# Spoonacular's informationBulk endpoint accepts a comma separated list of IDs;
+# keep each request reasonably small and cap how many run at once.
+BULK_CHUNK_SIZE = 50
+BULK_MAX_WORKERS = 4
+
+# "People you may know": how many suggestions are kept per user, and how much
+# one mutual friend is worth relative to one shared favorite when ranking them.
+SUGGESTIONS_PER_USER = 100
+MUTUAL_FRIEND_WEIGHT = 3
+
+# Activity feed: users with more friends than this are read at view time
+# instead of copied into every friend's timeline, and timelines are trimmed
+# back to about TIMELINE_SIZE entries once every TIMELINE_TRIM_INTERVAL writes.
+FANOUT_MAX_FRIENDS = 1000
+TIMELINE_SIZE = 500
+TIMELINE_TRIM_INTERVAL = 50
+TIMELINE_BACKFILL = 20
+
+# Ratings are 1-5 stars. "Top rated" ranks recipes by their mean pulled
+# towards RATING_PRIOR_MEAN as if each had RATING_PRIOR_COUNT extra ratings,
+# so one 5-star rating doesn't outrank fifty 4.8s.
+RATING_VALUES = range(1, 6)
+RATING_PRIOR_MEAN = 3.0
+RATING_PRIOR_COUNT = 5
+
+
+# Weighted full-text document for Recipe.search_vector; must match migration d4b9e6f1a2c8
+RECIPE_SEARCH_DOCUMENT = (
+    "setweight(to_tsvector('english', coalesce(title, '')), 'A') || "
+    "setweight(to_tsvector('english', coalesce(ingredients, '')), 'B') || "
+    "setweight(to_tsvector('english', coalesce(instructions, '')), 'C')"
+)
+
+
+@compiles(CreateColumn)
+def _create_column(element, compiler, **kw):
+    """Create generated columns marked info={'postgresql_only': True} as plain columns on other databases."""
+
+    column = element.element
+    if column.info.get('postgresql_only') and compiler.dialect.name != 'postgresql':
+        return f"{compiler.preparer.format_column(column)} {compiler.type_compiler.process(column.type)}"
+    return compiler.visit_create_column(element, **kw)
+
+
+def include_object(object, name, type_, reflected, compare_to):
+    """Alembic include_object hook that skips Postgres-only indexes on other databases."""
+
+    if type_ == 'index' and not reflected and object.info.get('postgresql_only'):
+        from alembic import context
+        return context.get_bind().dialect.name == 'postgresql'
+    return True
+
+
+class KeysetPage:
+    """One page of keyset (cursor) paginated results.
+
+    `next_cursor` and `prev_cursor` are opaque strings to pass back as
+    `after` / `before`; each is None when there is no page that way.
+    """
+
+    def __init__(self, items, next_cursor=None, prev_cursor=None, total=None):
+        self.items = items
+        self.next_cursor = next_cursor
+        self.prev_cursor = prev_cursor
+        self.total = total
+
+    @property
+    def has_next(self):
+        return self.next_cursor is not None
+
+    @property
+    def has_prev(self):
+        return self.prev_cursor is not None
+
+    def __iter__(self):
+        return iter(self.items)
+
+    def __len__(self):
+        return len(self.items)
+
 
 def connect_db(app):
     """Connect this database to provided Flask app.
@@ -15,18 +105,19 @@ def connect_db(app):
     You should call this in your Flask app.
     """
 
-    db.app = app
     db.init_app(app)
 
 
-from flask_sqlalchemy import SQLAlchemy
-from datetime import datetime, timezone
-
-db = SQLAlchemy()
-
 # User Model
 class User(db.Model):
     __tablename__ = 'users'
+    __table_args__ = (
+        # Trigram index so search_users' ilike '%query%' doesn't scan the whole table
+        db.Index('ix_users_username_trgm', 'username',
+                 postgresql_using='gin', postgresql_ops={'username': 'gin_trgm_ops'}),
+        # Keyset pagination of the user list and search results
+        db.Index('ix_users_username_id', 'username', 'id'),
+    )
 
     id = db.Column(db.Integer, primary_key=True)
     username = db.Column(db.String(50), unique=True, nullable=False)
@@ -35,6 +126,8 @@ class User(db.Model):
     bio = db.Column(db.Text)
     image_url = db.Column(db.Text, default="/static/images/default-pic.png")
     created_at = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc))
+    # Number of accepted friends, kept in step with the friendships table
+    friend_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
 
     # Relationships
     recipes = db.relationship('Recipe', backref='user', lazy=True)
@@ -56,7 +149,7 @@ class User(db.Model):
         Hashes password and adds user to system.
         """
 
-        hashed_pwd = bcrypt.generate_password_hash(password).decode('UTF-8')
+        hashed_pwd = get_password_hasher().hash(password)
 
         user = User(
             username=username,
@@ -78,26 +171,99 @@ class User(db.Model):
         and, if it finds such a user, returns that user object.
 
         If can't find matching user (or if password is wrong), returns False.
+
+        Hashes made at a lower cost than the current one are replaced; the
+        caller commits. Raises PasswordHashingBusy if hashing is saturated.
         """
 
         user = cls.query.filter_by(username=username).first()
 
         if user:
-            is_auth = bcrypt.check_password_hash(user.password, password)
-            if is_auth:
+            hasher = get_password_hasher()
+            if hasher.check(user.password, password):
+                if hasher.needs_rehash(user.password):
+                    user.password = hasher.hash(password)
                 return user
 
         return False
+    
+
+    @staticmethod
+    def _cursor(user):
+        return f"{user.username}:{user.id}"
+    
+
+    @staticmethod
+    def _parse_cursor(cursor):
+        """Return the (username, id) in a cursor, or None if it isn't one."""
+        username, _, user_id = (cursor or '').rpartition(':')
+        return (username, int(user_id)) if username and user_id.isdigit() else None
+    
+
+    @classmethod
+    def keyset_page(cls, search=None, after=None, before=None, per_page=12):
+        """Return a KeysetPage of users ordered by (username, id), optionally matching `search`.
+
+        Each page seeks straight to its cursor on the (username, id) index
+        instead of counting and skipping the rows before it, so page N costs
+        the same as page 1.
+        """
+        query = cls.query
+        if search:
+            query = query.filter(cls.username.ilike(f"%{search}%"))
+
+        key = db.tuple_(cls.username, cls.id)
+        after, before = cls._parse_cursor(after), cls._parse_cursor(before)
+
+        if before:
+            rows = (query.filter(key < db.tuple_(*before))
+                    .order_by(cls.username.desc(), cls.id.desc())
+                    .limit(per_page + 1)
+                    .all())
+            more = len(rows) > per_page
+            users = rows[:per_page][::-1]
+            return KeysetPage(users,
+                              next_cursor=cls._cursor(users[-1]) if users else None,
+                              prev_cursor=cls._cursor(users[0]) if more else None)
+
+        if after:
+            query = query.filter(key > db.tuple_(*after))
+        rows = query.order_by(cls.username, cls.id).limit(per_page + 1).all()
+        users = rows[:per_page]
+        return KeysetPage(users,
+                          next_cursor=cls._cursor(users[-1]) if len(rows) > per_page else None,
+                          prev_cursor=cls._cursor(users[0]) if after and users else None)
+    
+
+    @classmethod
+    def approximate_count(cls):
+        """Estimated number of users: the planner's row estimate on Postgres, an exact count elsewhere."""
+        if db.engine.dialect.name == 'postgresql':
+            estimate = db.session.execute(
+                db.text("SELECT reltuples::bigint FROM pg_class WHERE oid = 'users'::regclass")).scalar()
+            # -1 means the table hasn't been analyzed yet
+            if estimate is not None and estimate >= 0:
+                return estimate
+        return db.session.query(db.func.count(cls.id)).scalar()
 
 
 
 # Recipe Model
 class Recipe(db.Model):
     __tablename__ = 'recipes'
+    __table_args__ = (
+        db.Index('ix_recipes_user_id', 'user_id'),
+        # Only public user-created recipes are searched
+        db.Index('ix_recipes_search_vector', 'search_vector', postgresql_using='gin',
+                 postgresql_where=db.text("is_public AND spoonacular_id IS NULL"),
+                 info={'postgresql_only': True}).ddl_if(dialect='postgresql'),
+    )
+    # Don't read search_vector back after every insert
+    __mapper_args__ = {'eager_defaults': False}
 
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('users.id', ondelete='CASCADE'), nullable=True)
-    spoonacular_id = db.Column(db.Integer, nullable=True)
+    spoonacular_id = db.Column(db.Integer, unique=True, nullable=True)
     title = db.Column(db.String(255), nullable=False)
     ingredients = db.Column(db.Text, nullable=False)
     instructions = db.Column(db.Text, nullable=False)
@@ -105,6 +271,13 @@ class Recipe(db.Model):
     source_url = db.Column(db.Text)
     is_public = db.Column(db.Boolean, default=True)
     created_at = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc))
+    # When a Spoonacular recipe was last copied from the API (None for user-created recipes)
+    fetched_at = db.Column(db.DateTime, nullable=True)
+    # Kept current by Postgres on every write, and never loaded unless asked for.
+    # Other databases get an always-NULL text column and search with LIKE.
+    search_vector = deferred(db.Column(TSVECTOR().with_variant(db.Text(), 'sqlite'),
+                                       db.Computed(RECIPE_SEARCH_DOCUMENT, persisted=True),
+                                       info={'postgresql_only': True}))
 
     # Relationships
     favorites = db.relationship('Favorite', backref='recipe', lazy=True)
@@ -119,14 +292,16 @@ class Recipe(db.Model):
     @classmethod
     def get_random_recipes(cls, num=3, include_tags='', exclude_tags=''):
         """Get random recipes from the Spoonacular API"""
-        api_key = current_app.config.get('SPOONACULAR_API_KEY')
-        if not api_key:
-            raise ValueError("API key for Spoonacular not found!")
+        client = get_client()
 
-        url = f"https://api.spoonacular.com/recipes/random?number={num}&apiKey={api_key}"
+        cache = get_cache()
+        cache_key = f"random:{num}:{include_tags}:{exclude_tags}"
+        found, cached = cache.get(cache_key)
+        if found:
+            return cached
 
         try:
-            response = requests.get(url)
+            response = client.get("/recipes/random", params={"number": num})
             response.raise_for_status()
             data = response.json().get('recipes', [])  
 
@@ -139,67 +314,170 @@ class Recipe(db.Model):
                 "source_url": recipe.get("sourceUrl")
             })
 
+            cache.set(cache_key, random_recipes, get_ttl('random'))
             return random_recipes
         
         except requests.RequestException as e:
-            print(f"Error fetching random recipes: {e}")
+            logger.warning("Error fetching random recipes: %s", e)
+            ERRORS.inc(source='spoonacular')
             return []
-        
-    
+
+
+    @classmethod
+    def fetch_random_recipes(cls, num=100):
+        """Fetch `num` random recipes in full, uncached, for the homepage pool to hand out.
+
+        Raises requests.RequestException if the API call fails.
+        """
+        response = get_client().get("/recipes/random", params={"number": num})
+        response.raise_for_status()
+        return [cls._format_recipe_details(recipe) for recipe in response.json().get('recipes', [])]
+
+
     @classmethod
     def get_recipe_by_id(cls, recipe_id):
         """Fetch full recipe details from Spoonacular by recipe ID"""
-        api_key = current_app.config.get('SPOONACULAR_API_KEY')
-        if not api_key:
-            raise ValueError("API key for Spoonacular not found!")
-        
-        url = f"https://api.spoonacular.com/recipes/{recipe_id}/information?apiKey={api_key}"
+        client = get_client()
+
+        cache = get_cache()
+        cache_key = f"recipe:{recipe_id}"
+        found, cached = cache.get(cache_key)
+        if found:
+            return cached
 
         try:
-            response = requests.get(url)
-            response.raise_for_status()
-            data = response.json()
+            response = client.get(f"/recipes/{recipe_id}/information")
 
-            instructions = data.get("instructions", "")
+            # Remember recipes that don't exist so we don't keep asking for them
+            if response.status_code == 404:
+                cache.set(cache_key, None, get_ttl('not_found'))
+                return None
 
-            # Check if instructions contain HTML tags
-            if "<ol>" in instructions or "<li>" in instructions:
-                # Remove HTML tags and split by sentences or list items
-                instructions = re.sub(r'<[^>]+>', '', instructions)
-                instructions_list = [step.strip() for step in instructions.split('.') if step.strip()]
-            else:
-                # Split plain text instructions by sentences
-                instructions_list = [sentence.strip() for sentence in instructions.split('.') if sentence.strip()]
-
-            # Format the recipe data
-            recipe = {
-                "spoonacular_id": data.get("id"),
-                "title": data.get("title"),
-                "image": data.get("image"),
-                "source_url": data.get("sourceUrl"),
-                "instructions": instructions_list,
-                "ingredients": [ingredient["name"] for ingredient in data.get("extendedIngredients", [])]
-            }
+            response.raise_for_status()
+            recipe = cls._format_recipe_details(response.json())
 
+            cache.set(cache_key, recipe, get_ttl('recipe'))
             return recipe
         
         except requests.RequestException as e:
-            print(f"Error fetching recipe details: {e}")
+            logger.warning("Error fetching recipe details: %s", e)
+            ERRORS.inc(source='spoonacular')
             return None
+
+
+    @classmethod
+    def get_recipes_by_ids(cls, recipe_ids, chunk_size=BULK_CHUNK_SIZE, max_workers=BULK_MAX_WORKERS,
+                           refresh=False):
+        """Fetch full recipe details for many Spoonacular IDs at once.
+
+        Cached recipes are served from the cache. The rest are split into
+        chunks that each go out as a single informationBulk request, and the
+        chunks are fetched concurrently on a bounded pool.
+        Returns a list in the same order as `recipe_ids`, with None for any
+        recipe that couldn't be fetched. Pass refresh=True to skip cached
+        copies and always ask upstream.
+        """
+        recipe_ids = [int(recipe_id) for recipe_id in recipe_ids]
+        recipes_by_id = cls._fetch_recipes_by_ids(recipe_ids, chunk_size, max_workers, refresh)
+        return [recipes_by_id.get(recipe_id) for recipe_id in recipe_ids]
+
+
+    @classmethod
+    def _fetch_recipes_by_ids(cls, recipe_ids, chunk_size=BULK_CHUNK_SIZE, max_workers=BULK_MAX_WORKERS,
+                              refresh=False):
+        """get_recipes_by_ids as {id: recipe}, with only the IDs that got an answer.
+
+        An ID mapped to None doesn't exist upstream; an ID that's missing
+        was in a chunk whose request failed.
+        """
+        client = get_client()
+
+        unique_ids = list(dict.fromkeys(recipe_ids))
+        if not unique_ids:
+            return {}
+
+        cache = get_cache()
+        recipes_by_id = {}
+        missing_ids = []
+        for recipe_id in unique_ids:
+            found, cached = (False, None) if refresh else cache.get(f"recipe:{recipe_id}")
+            if found:
+                recipes_by_id[recipe_id] = cached
+            else:
+                missing_ids.append(recipe_id)
+
+        if not missing_ids:
+            return recipes_by_id
+
+        chunks = [missing_ids[i:i + chunk_size] for i in range(0, len(missing_ids), chunk_size)]
+
+        def fetch_chunk(chunk):
+            ids = ",".join(str(recipe_id) for recipe_id in chunk)
+            try:
+                response = client.get("/recipes/informationBulk", params={"ids": ids})
+                response.raise_for_status()
+                return chunk, [cls._format_recipe_details(data) for data in response.json()]
+            except requests.RequestException as e:
+                logger.warning("Error fetching bulk recipe details: %s", e)
+                ERRORS.inc(source='spoonacular')
+                return chunk, None
+
+        recipe_ttl = get_ttl('recipe')
+        not_found_ttl = get_ttl('not_found')
+        with ThreadPoolExecutor(max_workers=min(max_workers, len(chunks))) as executor:
+            for chunk, recipes in executor.map(fetch_chunk, chunks):
+                if recipes is None:
+                    continue
+
+                fetched = {recipe["spoonacular_id"]: recipe for recipe in recipes}
+                for recipe_id in chunk:
+                    recipe = fetched.get(recipe_id)
+                    # IDs missing from a successful bulk response don't exist upstream
+                    cache.set(f"recipe:{recipe_id}", recipe, recipe_ttl if recipe else not_found_ttl)
+                    recipes_by_id[recipe_id] = recipe
+
+        return recipes_by_id
+
+
+    @staticmethod
+    def _format_recipe_details(data):
+        """Turn a Spoonacular recipe information payload into our recipe dict"""
+        instructions = data.get("instructions") or ""
+
+        # Check if instructions contain HTML tags
+        if "<ol>" in instructions or "<li>" in instructions:
+            # Remove HTML tags and split by sentences or list items
+            instructions = re.sub(r'<[^>]+>', '', instructions)
+            instructions_list = [step.strip() for step in instructions.split('.') if step.strip()]
+        else:
+            # Split plain text instructions by sentences
+            instructions_list = [sentence.strip() for sentence in instructions.split('.') if sentence.strip()]
+
+        # Format the recipe data
+        return {
+            "spoonacular_id": data.get("id"),
+            "title": data.get("title"),
+            "image": data.get("image"),
+            "source_url": data.get("sourceUrl"),
+            "instructions": instructions_list,
+            "ingredients": [ingredient["name"] for ingredient in data.get("extendedIngredients", [])]
+        }
         
 
     @classmethod
     def search_recipes(cls, query):
         """Search for recipes using the Spoonacular API based on a query"""
         
-        api_key = current_app.config.get('SPOONACULAR_API_KEY')
-        if not api_key:
-            raise ValueError("API key for Spoonacular not found!")
+        client = get_client()
 
-        url = f"https://api.spoonacular.com/recipes/complexSearch?query={query}&number=12&apiKey={api_key}"
+        cache = get_cache()
+        cache_key = f"search:{query.strip().lower()}"
+        found, cached = cache.get(cache_key)
+        if found:
+            return cached
 
         try:
-            response = requests.get(url)
+            response = client.get("/recipes/complexSearch", params={"query": query, "number": 12})
             response.raise_for_status()
             data = response.json().get('results', [])
 
@@ -212,16 +490,182 @@ class Recipe(db.Model):
                     "image": recipe.get("image"),
                 })
 
+            cache.set(cache_key, recipes, get_ttl('search'))
             return recipes
         
         except requests.RequestException as e:
-            print(f"Error searching for recipes: {e}")
+            logger.warning("Error searching for recipes: %s", e)
+            ERRORS.inc(source='spoonacular')
             return []
+
+
+    @classmethod
+    def search_local(cls, query, page=1, per_page=12):
+        """Ranked full-text search over public user-created recipes.
+
+        On Postgres this probes the GIN-indexed `search_vector` column
+        (title weighted above ingredients, above instructions). Other
+        databases fall back to a plain substring match. Returns
+        `(recipes, has_next)`; no COUNT query is run.
+        """
+        base = cls.query.filter_by(is_public=True, spoonacular_id=None)
+
+        if db.engine.dialect.name == 'postgresql':
+            tsquery = db.func.websearch_to_tsquery('english', query)
+            results = (base
+                       .filter(cls.search_vector.op('@@')(tsquery))
+                       .order_by(db.func.ts_rank_cd(cls.search_vector, tsquery).desc(), cls.id.desc()))
+        else:
+            pattern = f"%{query}%"
+            results = (base
+                       .filter(db.or_(cls.title.ilike(pattern),
+                                      cls.ingredients.ilike(pattern),
+                                      cls.instructions.ilike(pattern)))
+                       .order_by(cls.id.desc()))
+
+        # Fetch one extra row to find out whether there is a next page
+        recipes = results.offset((page - 1) * per_page).limit(per_page + 1).all()
+        return recipes[:per_page], len(recipes) > per_page
+
+
+    ##########################################################################
+    # Local copies of Spoonacular recipes
+
+    def to_spoonacular_dict(self):
+        """Return a locally stored Spoonacular recipe in the same shape as get_recipe_by_id"""
+        return {
+            "spoonacular_id": self.spoonacular_id,
+            "title": self.title,
+            "image": self.image_url,
+            "source_url": self.source_url,
+            "instructions": [step for step in self.instructions.split("\n") if step],
+            "ingredients": [ingredient for ingredient in self.ingredients.split("\n") if ingredient],
+        }
+
+
+    @classmethod
+    def save_spoonacular_recipes(cls, recipes, session=None):
+        """Write Spoonacular recipe dicts into the recipes table.
+
+        Existing rows (matched on spoonacular_id) are updated in place, new
+        ones are added to `session` (db.session by default). Ingredients and
+        instructions are stored one per line. Returns the rows; the caller
+        commits.
+        """
+        session = session or db.session
+        recipes = [recipe for recipe in recipes if recipe and recipe.get("spoonacular_id")]
+        if not recipes:
+            return []
+
+        existing = {
+            row.spoonacular_id: row
+            for row in session.query(cls).filter(cls.spoonacular_id.in_([r["spoonacular_id"] for r in recipes]))
+        }
+
+        now = datetime.now(timezone.utc)
+        rows = []
+        for recipe in recipes:
+            row = existing.get(recipe["spoonacular_id"])
+            if row is None:
+                row = cls(spoonacular_id=recipe["spoonacular_id"], user_id=None)
+                session.add(row)
+                existing[row.spoonacular_id] = row
+
+            row.title = (recipe.get("title") or "Untitled recipe")[:255]
+            row.image_url = recipe.get("image") or "/static/images/default-food.png"
+            row.source_url = recipe.get("source_url")
+            row.ingredients = "\n".join(recipe.get("ingredients") or [])
+            row.instructions = "\n".join(recipe.get("instructions") or [])
+            row.fetched_at = now
+            rows.append(row)
+
+        return rows
+
+
+    @classmethod
+    def get_spoonacular_recipes(cls, spoonacular_ids):
+        """Get Spoonacular recipes, reading the local copy first.
+
+        Recipes not stored yet are fetched in bulk from the API and written
+        through to the recipes table. Returns recipe dicts in the same order
+        as `spoonacular_ids`, with None for recipes that couldn't be found.
+        """
+        spoonacular_ids = [int(spoonacular_id) for spoonacular_id in spoonacular_ids]
+        if not spoonacular_ids:
+            return []
+
+        local = {
+            row.spoonacular_id: row.to_spoonacular_dict()
+            for row in cls.query.filter(cls.spoonacular_id.in_(set(spoonacular_ids)))
+        }
+
+        missing_ids = [spoonacular_id for spoonacular_id in dict.fromkeys(spoonacular_ids)
+                       if spoonacular_id not in local]
+        if missing_ids:
+            fetched = [recipe for recipe in cls.get_recipes_by_ids(missing_ids) if recipe]
+            if fetched:
+                # Write through in a separate session so committing doesn't expire
+                # objects the caller already loaded (e.g. the favorites being listed)
+                with Session(db.engine) as session:
+                    cls.save_spoonacular_recipes(fetched, session=session)
+                    try:
+                        session.commit()
+                    except IntegrityError:
+                        # Another request stored the same recipe first; theirs is just as good
+                        session.rollback()
+
+            for recipe in fetched:
+                local[recipe["spoonacular_id"]] = recipe
+
+        return [local.get(spoonacular_id) for spoonacular_id in spoonacular_ids]
+
+
+    @classmethod
+    def get_spoonacular_recipe(cls, spoonacular_id):
+        """Get one Spoonacular recipe, reading the local copy first"""
+        return cls.get_spoonacular_recipes([spoonacular_id])[0]
+
+
+    @classmethod
+    def refresh_stale_spoonacular_recipes(cls, cutoff, batch_size=BULK_CHUNK_SIZE):
+        """Re-fetch one batch of local Spoonacular recipes last fetched before `cutoff`.
+
+        Only rows Spoonacular answered for are marked fetched; rows in a chunk
+        whose request failed stay stale for the next run. Returns the number
+        of rows answered for, so callers can loop with the same cutoff until
+        it comes back 0, which also stops them during an outage.
+        """
+        stale = (cls.query
+                 .filter(cls.spoonacular_id.isnot(None))
+                 .filter(db.or_(cls.fetched_at.is_(None), cls.fetched_at < cutoff))
+                 .order_by(cls.fetched_at.asc().nullsfirst())
+                 .limit(batch_size)
+                 .all())
+        if not stale:
+            return 0
+
+        answered = cls._fetch_recipes_by_ids([row.spoonacular_id for row in stale], refresh=True)
+        cls.save_spoonacular_recipes(answered.values())
+
+        # Recipes that no longer exist upstream are pushed to the back of the queue
+        now = datetime.now(timezone.utc)
+        for row in stale:
+            if row.spoonacular_id in answered and answered[row.spoonacular_id] is None:
+                row.fetched_at = now
+
+        db.session.commit()
+        return len(answered)
         
 
 # Favorite Model
 class Favorite(db.Model):
     __tablename__ = 'favorites'
+    __table_args__ = (
+        # A recipe can only be favorited once per user; these also serve lookups by user_id
+        db.UniqueConstraint('user_id', 'recipe_id', name='uq_favorites_user_recipe'),
+        db.UniqueConstraint('user_id', 'spoonacular_id', name='uq_favorites_user_spoonacular'),
+        db.Index('ix_favorites_recipe_id', 'recipe_id'),
+    )
 
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('users.id', ondelete='CASCADE'), nullable=False)
@@ -236,6 +680,14 @@ class Favorite(db.Model):
 # Friend Model
 class Friend(db.Model):
     __tablename__ = 'friends'
+    __table_args__ = (
+        db.UniqueConstraint('user_id', 'friend_id', name='uq_friends_user_friend'),
+        # Pending requests and accepted friends are looked up from the recipient's side
+        db.Index('ix_friends_friend_id_status', 'friend_id', 'status'),
+        # Accepted friends looked up from the sender's side
+        db.Index('ix_friends_user_id_accepted', 'user_id',
+                 postgresql_where=db.text("status = 'accepted'")),
+    )
 
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('users.id', ondelete='CASCADE'), nullable=False)
@@ -247,9 +699,481 @@ class Friend(db.Model):
         return f"<Friendship User {self.user_id} with User {self.friend_id} - Status: {self.status}>"
 
 
+# Friendship Model
+class Friendship(db.Model):
+    """Accepted friendships as a symmetric edge set.
+
+    Every accepted friendship is stored twice, (a, b) and (b, a), so friend
+    lists, friend checks and counts are single primary key lookups instead
+    of ORs across both columns of `friends`. Only change it through `link`
+    and `unlink`, which also keep users.friend_count up to date.
+    """
+    __tablename__ = 'friendships'
+
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id', ondelete='CASCADE'), primary_key=True)
+    friend_id = db.Column(db.Integer, db.ForeignKey('users.id', ondelete='CASCADE'), primary_key=True)
+    created_at = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc))
+
+    def __repr__(self):
+        return f"<Friendship User {self.user_id} -> User {self.friend_id}>"
+    
+
+    @classmethod
+    def are_friends(cls, user_id, friend_id):
+        """Is there an accepted friendship between these two users?"""
+        return db.session.get(cls, (user_id, friend_id)) is not None
+    
+
+    @classmethod
+    def link(cls, user_id, friend_id):
+        """Record an accepted friendship in both directions. The caller commits.
+
+        Returns False if the two were already friends.
+        """
+        if user_id == friend_id or cls.are_friends(user_id, friend_id):
+            return False
+
+        db.session.add_all([cls(user_id=user_id, friend_id=friend_id),
+                            cls(user_id=friend_id, friend_id=user_id)])
+        User.query.filter(User.id.in_([user_id, friend_id])).update(
+            {User.friend_count: User.friend_count + 1}, synchronize_session=False)
+        db.session.flush()
+        FriendSuggestion.friendship_added(user_id, friend_id)
+        Activity.friendship_added(user_id, friend_id)
+        return True
+    
+
+    @classmethod
+    def unlink(cls, user_id, friend_id):
+        """Remove a friendship in both directions. The caller commits.
+
+        Returns False if the two weren't friends.
+        """
+        removed = cls.query.filter(db.or_(
+            (cls.user_id == user_id) & (cls.friend_id == friend_id),
+            (cls.user_id == friend_id) & (cls.friend_id == user_id),
+        )).delete(synchronize_session=False)
+        if not removed:
+            return False
+
+        User.query.filter(User.id.in_([user_id, friend_id])).update(
+            {User.friend_count: User.friend_count - 1}, synchronize_session=False)
+        FriendSuggestion.friendship_removed(user_id, friend_id)
+        Activity.friendship_removed(user_id, friend_id)
+        return True
+    
+
+    @classmethod
+    def backfill(cls):
+        """Rebuild friendships and every users.friend_count from accepted `friends` rows.
+
+        Returns the number of edges written (two per friendship). The caller commits.
+        """
+        accepted = (Friend.status == 'accepted') & (Friend.user_id != Friend.friend_id)
+        edges = db.union(
+            db.select(Friend.user_id, Friend.friend_id).where(accepted),
+            db.select(Friend.friend_id, Friend.user_id).where(accepted),
+        )
+
+        cls.query.delete(synchronize_session=False)
+        db.session.execute(db.insert(cls).from_select(['user_id', 'friend_id'], edges,
+                                                      include_defaults=False))
+        db.session.execute(db.update(User).values(friend_count=(
+            db.select(db.func.count()).where(cls.user_id == User.id).scalar_subquery()
+        )))
+        return cls.query.count()
+
+    
+    @classmethod
+    def friend_ids(cls, user_id):
+        """The set of IDs of everyone `user_id` is friends with."""
+        return {friend_id for (friend_id,) in
+                db.session.query(cls.friend_id).filter(cls.user_id == user_id)}
+
+
+class FriendSuggestion(db.Model):
+    """Precomputed "people you may know" for each user.
+
+    A row means `suggested_id` is a friend of a friend of `user_id` but not
+    their friend. Counts are exact and updated in place as friendships and
+    favorites change, so showing suggestions is one indexed read. Only the
+    best SUGGESTIONS_PER_USER rows per user are kept; a trimmed candidate is
+    recounted from scratch if a later change touches it.
+    """
+    __tablename__ = 'friend_suggestions'
+    __table_args__ = (
+        db.Index('ix_friend_suggestions_user_id_score', 'user_id', 'score'),
+        db.Index('ix_friend_suggestions_suggested_id', 'suggested_id'),
+    )
+
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id', ondelete='CASCADE'), primary_key=True)
+    suggested_id = db.Column(db.Integer, db.ForeignKey('users.id', ondelete='CASCADE'), primary_key=True)
+    mutual_count = db.Column(db.Integer, nullable=False, default=0)
+    shared_favorites = db.Column(db.Integer, nullable=False, default=0)
+    score = db.Column(db.Integer, nullable=False, default=0)
+
+    suggested = db.relationship('User', foreign_keys=[suggested_id])
+
+    def __repr__(self):
+        return f"<FriendSuggestion User {self.suggested_id} for User {self.user_id} ({self.score})>"
+    
+
+    @classmethod
+    def for_user(cls, user_id, limit=10):
+        """Return the top suggestions for `user_id`, best first, skipping anyone they already asked."""
+        requested = db.exists().where((Friend.user_id == user_id) & (Friend.friend_id == cls.suggested_id))
+        return (cls.query
+                .options(db.joinedload(cls.suggested))
+                .filter(cls.user_id == user_id, ~requested)
+                .order_by(cls.score.desc(), cls.suggested_id)
+                .limit(limit)
+                .all())
+    
+
+    @classmethod
+    def friendship_added(cls, user_id, friend_id):
+        """Update suggestions after both friendship edges have been flushed."""
+        user_friends = Friendship.friend_ids(user_id)
+        friend_friends = Friendship.friend_ids(friend_id)
+
+        # Each now has one more mutual friend with the other's friends
+        cls._adjust(user_id, friend_friends - user_friends - {user_id}, 1)
+        cls._adjust(friend_id, user_friends - friend_friends - {friend_id}, 1)
+
+        cls.query.filter(db.or_(
+            (cls.user_id == user_id) & (cls.suggested_id == friend_id),
+            (cls.user_id == friend_id) & (cls.suggested_id == user_id),
+        )).delete(synchronize_session=False)
+        cls._trim(user_friends | friend_friends)
+    
+
+    @classmethod
+    def friendship_removed(cls, user_id, friend_id):
+        """Update suggestions after both friendship edges have been deleted."""
+        user_friends = Friendship.friend_ids(user_id)
+        friend_friends = Friendship.friend_ids(friend_id)
+
+        cls._adjust(user_id, friend_friends - user_friends - {user_id}, -1)
+        cls._adjust(friend_id, user_friends - friend_friends - {friend_id}, -1)
+
+        # Former friends with friends in common are now suggestions for each other
+        if user_friends & friend_friends:
+            cls._adjust(user_id, {friend_id}, 1)
+        cls._trim({user_id, friend_id})
+    
+
+    @classmethod
+    def favorite_changed(cls, user_id, recipe_id=None, spoonacular_id=None, delta=1):
+        """Update shared favorite counts after `user_id` adds (1) or removes (-1) a favorite."""
+        if not (recipe_id or spoonacular_id):
+            return
+
+        def also_favorited(other_id):
+            match = (Favorite.recipe_id == recipe_id) if recipe_id else (Favorite.spoonacular_id == spoonacular_id)
+            return db.exists().where((Favorite.user_id == other_id) & match)
+
+        db.session.execute(
+            db.update(cls)
+            .where(db.or_(
+                (cls.user_id == user_id) & also_favorited(cls.suggested_id),
+                (cls.suggested_id == user_id) & also_favorited(cls.user_id),
+            ))
+            .values(shared_favorites=cls.shared_favorites + delta, score=cls.score + delta)
+            .execution_options(synchronize_session=False)
+        )
+    
+
+    @classmethod
+    def rebuild(cls, user_ids):
+        """Recompute the suggestions of `user_ids` from scratch. The caller commits."""
+        user_ids = list(user_ids)
+        cls.query.filter(cls.user_id.in_(user_ids)).delete(synchronize_session=False)
+
+        mine = db.aliased(Friendship)
+        theirs = db.aliased(Friendship)
+        already = db.aliased(Friendship)
+        mutual = db.func.count()
+        candidates = (
+            db.select(mine.user_id, theirs.friend_id, mutual, db.literal(0), mutual * MUTUAL_FRIEND_WEIGHT)
+            .join(theirs, theirs.user_id == mine.friend_id)
+            .where(mine.user_id.in_(user_ids),
+                   theirs.friend_id != mine.user_id,
+                   ~db.exists().where((already.user_id == mine.user_id) & (already.friend_id == theirs.friend_id)))
+            .group_by(mine.user_id, theirs.friend_id)
+        )
+        db.session.execute(db.insert(cls).from_select(
+            ['user_id', 'suggested_id', 'mutual_count', 'shared_favorites', 'score'], candidates))
+
+        shared = cls._shared_favorites_expr(cls.user_id, cls.suggested_id)
+        db.session.execute(
+            db.update(cls)
+            .where(cls.user_id.in_(user_ids))
+            .values(shared_favorites=shared, score=cls.mutual_count * MUTUAL_FRIEND_WEIGHT + shared)
+            .execution_options(synchronize_session=False)
+        )
+        cls._trim(user_ids)
+    
+
+    @classmethod
+    def _adjust(cls, user_id, other_ids, delta):
+        """Add `delta` mutual friends between `user_id` and each of `other_ids`, in both directions.
+
+        Existing rows are updated in place. Missing rows are only created
+        when the count goes up, with their counts computed exactly.
+        """
+        if not other_ids:
+            return
+        other_ids = list(other_ids)
+        pairs = db.or_(
+            (cls.user_id == user_id) & cls.suggested_id.in_(other_ids),
+            (cls.suggested_id == user_id) & cls.user_id.in_(other_ids),
+        )
+
+        db.session.execute(
+            db.update(cls).where(pairs)
+            .values(mutual_count=cls.mutual_count + delta,
+                    score=cls.score + delta * MUTUAL_FRIEND_WEIGHT)
+            .execution_options(synchronize_session=False)
+        )
+
+        if delta < 0:
+            cls.query.filter(pairs, cls.mutual_count <= 0).delete(synchronize_session=False)
+            return
+
+        existing = set(db.session.query(cls.user_id, cls.suggested_id).filter(pairs))
+        missing = [other_id for other_id in other_ids
+                   if (user_id, other_id) not in existing or (other_id, user_id) not in existing]
+        if not missing:
+            return
+
+        mutual_counts = dict(
+            db.session.query(Friendship.user_id, db.func.count())
+            .filter(Friendship.user_id.in_(missing),
+                    Friendship.friend_id.in_(db.select(Friendship.friend_id).where(Friendship.user_id == user_id)))
+            .group_by(Friendship.user_id)
+        )
+        shared_counts = dict(
+            db.session.query(User.id, cls._shared_favorites_expr(user_id, User.id))
+            .filter(User.id.in_(missing))
+        )
+
+        rows = []
+        for other_id in missing:
+            mutual_count = mutual_counts.get(other_id, 0)
+            if not mutual_count:
+                continue
+            shared_favorites = shared_counts.get(other_id, 0)
+            counts = {'mutual_count': mutual_count, 'shared_favorites': shared_favorites,
+                      'score': mutual_count * MUTUAL_FRIEND_WEIGHT + shared_favorites}
+            for pair in ((user_id, other_id), (other_id, user_id)):
+                if pair not in existing:
+                    rows.append(dict(counts, user_id=pair[0], suggested_id=pair[1]))
+        if rows:
+            db.session.execute(db.insert(cls), rows)
+    
+
+    @staticmethod
+    def _shared_favorites_expr(user_id, other_id):
+        """SQL expression counting the favorites two users have in common."""
+        mine = db.aliased(Favorite)
+        theirs = db.aliased(Favorite)
+        same_recipe = db.or_(
+            (theirs.recipe_id == mine.recipe_id),
+            (theirs.spoonacular_id == mine.spoonacular_id),
+        )
+        return (db.select(db.func.count())
+                .select_from(mine)
+                .join(theirs, (theirs.user_id == other_id) & same_recipe)
+                .where(mine.user_id == user_id)
+                .scalar_subquery())
+    
+
+    @classmethod
+    def _trim(cls, user_ids):
+        """Drop all but the best SUGGESTIONS_PER_USER rows of each of `user_ids`."""
+        if not user_ids:
+            return
+        ranked = (
+            db.select(cls.user_id, cls.suggested_id,
+                      db.func.row_number().over(partition_by=cls.user_id,
+                                                order_by=(cls.score.desc(), cls.suggested_id)).label('rank'))
+            .where(cls.user_id.in_(list(user_ids)))
+            .subquery()
+        )
+        overflow = db.select(ranked.c.user_id, ranked.c.suggested_id).where(ranked.c.rank > SUGGESTIONS_PER_USER)
+        cls.query.filter(db.tuple_(cls.user_id, cls.suggested_id).in_(overflow)).delete(synchronize_session=False)
+
+
+class Activity(db.Model):
+    """Something a user did that their friends see in their feed.
+
+    Activities by users with at most FANOUT_MAX_FRIENDS friends are copied
+    into each friend's timeline when written (fan-out on write). Busier
+    users' activities are left with `fanned_out` false and merged in when
+    a timeline is read (fan-out on read).
+    """
+    __tablename__ = 'activities'
+    __table_args__ = (
+        # Merging un-fanned activities of a reader's friends at read time
+        db.Index('ix_activities_actor_id_id_pull', 'actor_id', 'id',
+                 postgresql_where=db.text('NOT fanned_out'),
+                 sqlite_where=db.text('NOT fanned_out')),
+        db.Index('ix_activities_actor_id', 'actor_id'),
+        db.Index('ix_activities_recipe_id', 'recipe_id'),
+    )
+
+    VERBS = ('recipe', 'favorite', 'rating')
+
+    id = db.Column(db.Integer, primary_key=True)
+    actor_id = db.Column(db.Integer, db.ForeignKey('users.id', ondelete='CASCADE'), nullable=False)
+    verb = db.Column(db.String(20), nullable=False)
+    recipe_id = db.Column(db.Integer, db.ForeignKey('recipes.id', ondelete='CASCADE'))
+    spoonacular_id = db.Column(db.Integer)
+    title = db.Column(db.String(255))
+    rating = db.Column(db.Integer)
+    fanned_out = db.Column(db.Boolean, nullable=False, default=True, server_default=db.true())
+    created_at = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc))
+
+    actor = db.relationship('User')
+
+    def __repr__(self):
+        return f"<Activity {self.id} User {self.actor_id} {self.verb}>"
+    
+
+    @classmethod
+    def record(cls, actor_id, verb, recipe_id=None, spoonacular_id=None, title=None, rating=None):
+        """Record an activity and fan it out to the actor's friends. The caller commits."""
+        friend_count = db.session.query(User.friend_count).filter(User.id == actor_id).scalar() or 0
+
+        activity = cls(actor_id=actor_id, verb=verb, recipe_id=recipe_id, spoonacular_id=spoonacular_id,
+                       title=title, rating=rating, fanned_out=friend_count <= FANOUT_MAX_FRIENDS)
+        db.session.add(activity)
+        db.session.flush()
+
+        if activity.fanned_out:
+            TimelineEntry.fan_out(activity)
+        return activity
+    
+
+    @classmethod
+    def retract(cls, actor_id, verb, recipe_id=None, spoonacular_id=None):
+        """Delete matching activities, e.g. when a favorite is removed. The caller commits."""
+        if not (recipe_id or spoonacular_id):
+            return
+
+        match = (cls.recipe_id == recipe_id) if recipe_id else (cls.spoonacular_id == spoonacular_id)
+        ids = db.select(cls.id).where(cls.actor_id == actor_id, cls.verb == verb, match)
+        TimelineEntry.query.filter(TimelineEntry.activity_id.in_(ids)).delete(synchronize_session=False)
+        cls.query.filter(cls.actor_id == actor_id, cls.verb == verb, match).delete(synchronize_session=False)
+    
+
+    @classmethod
+    def forget_recipe(cls, recipe_id):
+        """Delete every activity about a local recipe that is being deleted. The caller commits."""
+        ids = db.select(cls.id).where(cls.recipe_id == recipe_id)
+        TimelineEntry.query.filter(TimelineEntry.activity_id.in_(ids)).delete(synchronize_session=False)
+        cls.query.filter(cls.recipe_id == recipe_id).delete(synchronize_session=False)
+    
+
+    @classmethod
+    def timeline(cls, user_id, before=None, per_page=20):
+        """Return one page of `user_id`'s feed, newest first, and the cursor for the next page.
+
+        Reads at most `per_page + 1` rows from each of the fanned-out
+        timeline and the busy friends' activities, however many friends
+        `user_id` has. Pass the returned cursor back as `before` for the
+        next page; it is None on the last page.
+        """
+        pushed = db.select(TimelineEntry.activity_id.label('id')).where(TimelineEntry.user_id == user_id)
+        pulled = db.select(cls.id).where(
+            ~cls.fanned_out,
+            cls.actor_id.in_(db.select(Friendship.friend_id).where(Friendship.user_id == user_id)),
+        )
+        if before is not None:
+            pushed = pushed.where(TimelineEntry.activity_id < before)
+            pulled = pulled.where(cls.id < before)
+
+        pushed = pushed.order_by(TimelineEntry.activity_id.desc()).limit(per_page + 1).subquery()
+        pulled = pulled.order_by(cls.id.desc()).limit(per_page + 1).subquery()
+        ids = db.union_all(db.select(pushed.c.id), db.select(pulled.c.id)).subquery()
+
+        activities = (cls.query
+                      .options(db.joinedload(cls.actor))
+                      .filter(cls.id.in_(db.select(ids.c.id)))
+                      .order_by(cls.id.desc())
+                      .limit(per_page + 1)
+                      .all())
+
+        next_cursor = activities[per_page - 1].id if len(activities) > per_page else None
+        return activities[:per_page], next_cursor
+    
+
+    @classmethod
+    def friendship_added(cls, user_id, friend_id):
+        """Give two new friends each other's most recent fanned-out activities."""
+        for reader_id, actor_id in ((user_id, friend_id), (friend_id, user_id)):
+            recent = (db.select(db.literal(reader_id), cls.id)
+                      .where(cls.actor_id == actor_id, cls.fanned_out)
+                      .order_by(cls.id.desc())
+                      .limit(TIMELINE_BACKFILL))
+            db.session.execute(db.insert(TimelineEntry).from_select(['user_id', 'activity_id'], recent))
+    
+
+    @classmethod
+    def friendship_removed(cls, user_id, friend_id):
+        """Remove two former friends' activities from each other's timelines."""
+        for reader_id, actor_id in ((user_id, friend_id), (friend_id, user_id)):
+            TimelineEntry.query.filter(
+                TimelineEntry.user_id == reader_id,
+                TimelineEntry.activity_id.in_(db.select(cls.id).where(cls.actor_id == actor_id)),
+            ).delete(synchronize_session=False)
+
+
+class TimelineEntry(db.Model):
+    """One activity in one reader's precomputed timeline."""
+    __tablename__ = 'timeline_entries'
+
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id', ondelete='CASCADE'), primary_key=True)
+    activity_id = db.Column(db.Integer, db.ForeignKey('activities.id', ondelete='CASCADE'), primary_key=True)
+
+    def __repr__(self):
+        return f"<TimelineEntry User {self.user_id} Activity {self.activity_id}>"
+    
+
+    @classmethod
+    def fan_out(cls, activity):
+        """Copy `activity` into the timeline of each of its actor's friends."""
+        readers = db.select(Friendship.friend_id, db.literal(activity.id)).where(Friendship.user_id == activity.actor_id)
+        db.session.execute(db.insert(cls).from_select(['user_id', 'activity_id'], readers))
+
+        # Trimming every write would double its cost; doing it every so often
+        # keeps each timeline within about TIMELINE_TRIM_INTERVAL of the cap
+        if activity.id % TIMELINE_TRIM_INTERVAL == 0:
+            cls.trim(db.select(Friendship.friend_id).where(Friendship.user_id == activity.actor_id))
+    
+
+    @classmethod
+    def trim(cls, user_ids):
+        """Drop all but the newest TIMELINE_SIZE entries of each of `user_ids`."""
+        ranked = (
+            db.select(cls.user_id, cls.activity_id,
+                      db.func.row_number().over(partition_by=cls.user_id,
+                                                order_by=cls.activity_id.desc()).label('rank'))
+            .where(cls.user_id.in_(user_ids))
+            .subquery()
+        )
+        overflow = db.select(ranked.c.user_id, ranked.c.activity_id).where(ranked.c.rank > TIMELINE_SIZE)
+        cls.query.filter(db.tuple_(cls.user_id, cls.activity_id).in_(overflow)).delete(synchronize_session=False)
+
+
 # Rating Model
 class Rating(db.Model):
     __tablename__ = 'ratings'
+    __table_args__ = (
+        db.Index('ix_ratings_recipe_id', 'recipe_id'),
+        # One rating per user per recipe; rating again replaces it
+        db.UniqueConstraint('user_id', 'recipe_id', name='uq_ratings_user_id_recipe_id'),
+    )
 
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('users.id', ondelete='CASCADE'), nullable=False)
@@ -260,9 +1184,218 @@ class Rating(db.Model):
 
     def __repr__(self):
         return f"<Rating {self.rating} for Recipe {self.recipe_id} by User {self.user_id}>"
+    
+
+    @classmethod
+    def rate(cls, user_id, recipe_id, value, review=None):
+        """Set `user_id`'s rating of a recipe, replacing any earlier one, and update its RecipeRating.
+
+        The recipe's RecipeRating row is locked first, so concurrent ratings
+        of one recipe apply one after another. The caller commits.
+        """
+        summary = RecipeRating.lock(recipe_id)
+        rating = cls.query.filter_by(user_id=user_id, recipe_id=recipe_id).first()
+
+        if rating:
+            summary.apply(rating.rating, -1)
+            rating.rating = value
+            rating.review = review
+            rating.rated_at = datetime.now(timezone.utc)
+        else:
+            rating = cls(user_id=user_id, recipe_id=recipe_id, rating=value, review=review)
+            db.session.add(rating)
+
+        summary.apply(value, 1)
+        return rating
+    
+
+    @classmethod
+    def unrate(cls, user_id, recipe_id):
+        """Delete `user_id`'s rating of a recipe, if any. Returns whether there was one. The caller commits."""
+        summary = RecipeRating.lock(recipe_id)
+        rating = cls.query.filter_by(user_id=user_id, recipe_id=recipe_id).first()
+        if not rating:
+            return False
+
+        summary.apply(rating.rating, -1)
+        db.session.delete(rating)
+        return True
+    
+
+    @classmethod
+    def reviews_for(cls, recipe_id, limit=10):
+        """The most recent ratings of a recipe that have a written review."""
+        return (cls.query
+                .options(db.joinedload(cls.user))
+                .filter(cls.recipe_id == recipe_id, cls.review.isnot(None), cls.review != '')
+                .order_by(cls.id.desc())
+                .limit(limit)
+                .all())
+
+
+class RecipeRating(db.Model):
+    """Running totals of a recipe's ratings, kept up to date by Rating.rate/unrate.
+
+    Showing a recipe's score is a primary key lookup, and "top rated" reads
+    the score index instead of aggregating the ratings table.
+    """
+    __tablename__ = 'recipe_ratings'
+    __table_args__ = (
+        db.Index('ix_recipe_ratings_score', 'score', 'recipe_id'),
+    )
+
+    recipe_id = db.Column(db.Integer, db.ForeignKey('recipes.id', ondelete='CASCADE'), primary_key=True)
+    rating_count = db.Column(db.Integer, nullable=False, default=0)
+    rating_sum = db.Column(db.Integer, nullable=False, default=0)
+    stars_1 = db.Column(db.Integer, nullable=False, default=0)
+    stars_2 = db.Column(db.Integer, nullable=False, default=0)
+    stars_3 = db.Column(db.Integer, nullable=False, default=0)
+    stars_4 = db.Column(db.Integer, nullable=False, default=0)
+    stars_5 = db.Column(db.Integer, nullable=False, default=0)
+    average = db.Column(db.Float, nullable=True)
+    # Average damped towards RATING_PRIOR_MEAN; what "top rated" sorts by
+    score = db.Column(db.Float, nullable=False, default=RATING_PRIOR_MEAN)
+
+    recipe = db.relationship('Recipe')
+
+    def __repr__(self):
+        return f"<RecipeRating {self.average} from {self.rating_count} for Recipe {self.recipe_id}>"
+    
+
+    @property
+    def histogram(self):
+        """{stars: count} for 1-5 stars."""
+        return {stars: getattr(self, f"stars_{stars}") for stars in RATING_VALUES}
+    
+
+    def apply(self, value, delta):
+        """Add (`delta` = 1) or take away (`delta` = -1) one rating of `value` stars."""
+        self.rating_count += delta
+        self.rating_sum += value * delta
+        setattr(self, f"stars_{value}", getattr(self, f"stars_{value}") + delta)
+        self.average = self.rating_sum / self.rating_count if self.rating_count else None
+        self.score = ((self.rating_sum + RATING_PRIOR_MEAN * RATING_PRIOR_COUNT)
+                      / (self.rating_count + RATING_PRIOR_COUNT))
+    
 
+    @classmethod
+    def lock(cls, recipe_id):
+        """Return the recipe's row locked FOR UPDATE, creating it if it's the first rating."""
+        summary = cls.query.filter_by(recipe_id=recipe_id).with_for_update().first()
+        if summary:
+            return summary
+
+        try:
+            with db.session.begin_nested():
+                db.session.add(cls(recipe_id=recipe_id))
+        except IntegrityError:
+            # A concurrent first rating created it; wait for theirs
+            pass
+        return cls.query.filter_by(recipe_id=recipe_id).with_for_update().populate_existing().one()
+    
+
+    @classmethod
+    def backfill(cls):
+        """Rebuild every recipe_ratings row from the ratings table. Returns the row count; the caller commits."""
+        count = db.func.count(Rating.id)
+        total = db.func.sum(Rating.rating)
+        rollups = (db.select(
+            Rating.recipe_id, count, total,
+            *(db.func.sum(db.case((Rating.rating == stars, 1), else_=0)) for stars in RATING_VALUES),
+            db.cast(total, db.Float) / count,
+            (db.cast(total, db.Float) + RATING_PRIOR_MEAN * RATING_PRIOR_COUNT) / (count + RATING_PRIOR_COUNT),
+        ).group_by(Rating.recipe_id))
+
+        cls.query.delete(synchronize_session=False)
+        db.session.execute(db.insert(cls).from_select(
+            ['recipe_id', 'rating_count', 'rating_sum', *(f"stars_{stars}" for stars in RATING_VALUES),
+             'average', 'score'],
+            rollups, include_defaults=False))
+        return cls.query.count()
+    
+
+    @classmethod
+    def top_rated(cls, limit=20):
+        """The public recipes with the highest scores, as (Recipe, RecipeRating) pairs."""
+        return (db.session.query(Recipe, cls)
+                .join(cls, cls.recipe_id == Recipe.id)
+                .filter(Recipe.is_public.is_(True), cls.rating_count > 0)
+                .order_by(cls.score.desc(), cls.recipe_id.desc())
+                .limit(limit)
+                .all())
+
+
+class Ingredient(db.Model):
+    """One normalized ingredient name (see ingredients.normalize), shared by every recipe that uses it."""
+    __tablename__ = 'ingredients'
+
+    id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(100), unique=True, nullable=False)
+
+    def __repr__(self):
+        return f"<Ingredient {self.name}>"
+
+
+    @classmethod
+    def ids_for(cls, names, session=None):
+        """Return {name: id} for `names`, adding the ones that aren't in the vocabulary yet."""
+        session = session or db.session
+        names = set(names)
+        if not names:
+            return {}
+
+        ids = dict(session.execute(db.select(cls.name, cls.id).where(cls.name.in_(names))).all())
+        missing = names - ids.keys()
+        if missing:
+            if session.get_bind().dialect.name == 'postgresql':
+                from sqlalchemy.dialects.postgresql import insert
+            else:
+                from sqlalchemy.dialects.sqlite import insert
+            # Another request may add the same names at the same time; theirs are just as good
+            session.execute(insert(cls).on_conflict_do_nothing(index_elements=['name']),
+                            [{'name': name} for name in missing])
+            ids.update(session.execute(db.select(cls.name, cls.id).where(cls.name.in_(missing))).all())
+        return ids
 
 
+class RecipeIngredient(db.Model):
+    """Which ingredients each recipe uses; the pantry search index is built from this table."""
+    __tablename__ = 'recipe_ingredients'
+    __table_args__ = (
+        # Loading the pantry index reads the table in ingredient order
+        db.Index('ix_recipe_ingredients_ingredient_id_recipe_id', 'ingredient_id', 'recipe_id'),
+    )
+
+    recipe_id = db.Column(db.Integer, db.ForeignKey('recipes.id', ondelete='CASCADE'), primary_key=True)
+    ingredient_id = db.Column(db.Integer, db.ForeignKey('ingredients.id', ondelete='CASCADE'), primary_key=True)
+
+    def __repr__(self):
+        return f"<RecipeIngredient Recipe {self.recipe_id} uses Ingredient {self.ingredient_id}>"
+
+
+    @classmethod
+    def replace(cls, recipes, session=None):
+        """Set the ingredients of each recipe in {recipe id: [normalized names]}; the caller commits."""
+        session = session or db.session
+        if not recipes:
+            return
+
+        ids = Ingredient.ids_for({name for names in recipes.values() for name in names}, session=session)
+        session.execute(db.delete(cls).where(cls.recipe_id.in_(list(recipes))))
+        rows = [{'recipe_id': recipe_id, 'ingredient_id': ids[name]}
+                for recipe_id, names in recipes.items() for name in set(names)]
+        if rows:
+            session.execute(db.insert(cls), rows)
+
+
+
+
+
+# The trigram index on users.username needs the pg_trgm extension
+db.event.listen(
+    User.__table__, 'before_create',
+    db.DDL("CREATE EXTENSION IF NOT EXISTS pg_trgm").execute_if(dialect='postgresql'),
+)
 
 
 # MealTrade Model (Stretch Goal)
@@ -281,3 +1414,32 @@ class MealTrade(db.Model):
         return f"<MealTrade from User {self.sender_id} to User {self.recipient_id} for Recipe {self.recipe_id} - Status: {self.status}>"
 
 
+
+
+class Job(db.Model):
+    """A unit of background work, run by `flask worker` (see jobs.py)."""
+    __tablename__ = 'jobs'
+    __table_args__ = (
+        # Finding running jobs whose lease ran out
+        db.Index('ix_jobs_status_lease_expires_at', 'status', 'lease_expires_at'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(100), nullable=False)
+    payload = db.Column(db.Text, nullable=False, default='{}')
+    priority = db.Column(db.Integer, nullable=False, default=0)
+    status = db.Column(db.String(20), nullable=False, default='queued')
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    max_attempts = db.Column(db.Integer, nullable=False, default=5)
+    run_at = db.Column(db.DateTime, nullable=False)
+    created_at = db.Column(db.DateTime, nullable=False)
+    locked_by = db.Column(db.String(100))
+    lease_expires_at = db.Column(db.DateTime)
+    last_error = db.Column(db.Text)
+
+    def __repr__(self):
+        return f"<Job {self.id} {self.name} ({self.status})>"
+
+
+# Due jobs are taken highest priority first, then oldest first
+db.Index('ix_jobs_dequeue', Job.status, Job.priority.desc(), Job.run_at)
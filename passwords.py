@@ -0,0 +1,126 @@
+import logging, math, os, re, sys, threading, time
+from concurrent.futures import ThreadPoolExecutor
+
+import bcrypt
+from flask import current_app
+
+from metrics import PASSWORD_HASHES_REJECTED
+
+logger = logging.getLogger(__name__)
+
+
+# Calibration never picks a cost outside this range
+MIN_ROUNDS = 10
+MAX_ROUNDS = 16
+DEFAULT_TARGET_MS = 250
+
+_COST = re.compile(r'^\$2[aby]?\$(\d\d)\$')
+
+_hasher_lock = threading.Lock()
+
+
+class PasswordHashingBusy(Exception):
+    """Every hashing slot is taken; the caller should ask the user to try again shortly."""
+
+
+def calibrate(target_ms=DEFAULT_TARGET_MS, min_rounds=MIN_ROUNDS, max_rounds=MAX_ROUNDS):
+    """Return the lowest bcrypt cost whose hashes take at least `target_ms` on this machine.
+
+    Each extra round doubles the work, so one timing at `min_rounds` is
+    enough to extrapolate from.
+    """
+    salt = bcrypt.gensalt(min_rounds)
+    elapsed_ms = float('inf')
+    for _ in range(2):
+        started = time.perf_counter()
+        bcrypt.hashpw(b'calibration', salt)
+        elapsed_ms = min(elapsed_ms, (time.perf_counter() - started) * 1000)
+
+    rounds = min_rounds + max(0, math.ceil(math.log2(target_ms / elapsed_ms)))
+    return min(rounds, max_rounds)
+
+
+def cost_of(hashed):
+    """The cost factor of a bcrypt hash, or None if it isn't one."""
+    match = _COST.match(hashed or '')
+    return int(match.group(1)) if match else None
+
+
+def _make_executor(max_workers):
+    if 'gevent' in sys.modules:
+        from gevent import monkey
+        if monkey.is_module_patched('threading'):
+            # Patched threads are greenlets, which would run bcrypt on the hub and stall
+            # every request in the worker; gevent's pool uses real threads
+            from gevent.threadpool import ThreadPoolExecutor as GeventThreadPoolExecutor
+            return GeventThreadPoolExecutor(max_workers=max_workers)
+    return ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='password-hash')
+
+
+class PasswordHasher:
+    """Runs bcrypt on a small thread pool, so hashing can't take every worker thread.
+
+    bcrypt releases the GIL, so `max_workers` hashes run on separate cores
+    while other threads keep serving requests. At most `max_workers +
+    max_queue` hashes are running or waiting. Past that, `hash` and `check`
+    raise PasswordHashingBusy straight away, so a login storm is turned away
+    instead of queueing until every request times out. Under gevent
+    (SERVING_MODE=async) the waiting request yields to other greenlets.
+    """
+
+    def __init__(self, rounds, max_workers, max_queue):
+        self.rounds = rounds
+        self.max_in_flight = max_workers + max_queue
+        self.in_flight = 0
+        self._lock = threading.Lock()
+        self._executor = _make_executor(max_workers)
+
+    def _run(self, fn, *args):
+        with self._lock:
+            if self.in_flight >= self.max_in_flight:
+                PASSWORD_HASHES_REJECTED.inc()
+                raise PasswordHashingBusy()
+            self.in_flight += 1
+        try:
+            return self._executor.submit(fn, *args).result()
+        finally:
+            with self._lock:
+                self.in_flight -= 1
+
+    def hash(self, password):
+        """Hash `password` at the current cost."""
+        return self._run(bcrypt.hashpw, password.encode(), bcrypt.gensalt(self.rounds)).decode()
+
+    def check(self, hashed, password):
+        """Whether `password` matches `hashed`. Malformed hashes never match."""
+        if cost_of(hashed) is None:
+            return False
+        return self._run(bcrypt.checkpw, password.encode(), hashed.encode())
+
+    def needs_rehash(self, hashed):
+        """Whether `hashed` was made at a lower cost than the current one."""
+        cost = cost_of(hashed)
+        return cost is not None and cost < self.rounds
+
+
+def get_password_hasher():
+    """Return the password hasher for the current app, creating it on first use.
+
+    The cost is BCRYPT_LOG_ROUNDS if set. Otherwise it's calibrated to
+    BCRYPT_TARGET_MS on first use, so starting the app stays cheap.
+    """
+
+    hasher = current_app.extensions.get('password_hasher')
+    if hasher is None:
+        with _hasher_lock:
+            hasher = current_app.extensions.get('password_hasher')
+            if hasher is None:
+                config = current_app.config
+                rounds = config.get('BCRYPT_LOG_ROUNDS')
+                if not rounds:
+                    rounds = calibrate(config.get('BCRYPT_TARGET_MS', DEFAULT_TARGET_MS))
+                    logger.info("Calibrated bcrypt cost to %d rounds", rounds)
+                workers = config.get('PASSWORD_HASH_WORKERS') or os.cpu_count() or 1
+                hasher = PasswordHasher(rounds, workers, config.get('PASSWORD_HASH_MAX_QUEUE') or 4 * workers)
+                current_app.extensions['password_hasher'] = hasher
+    return hasher
@@ -0,0 +1,92 @@
+import collections, hmac, os, sys, threading, time, uuid
+
+from flask import current_app, g, request
+
+
+# Opt in per request by sending this header with the configured PROFILER_TOKEN
+PROFILE_HEADER = 'X-Profile'
+DEFAULT_INTERVAL = 0.005
+
+
+class SamplingProfiler:
+    """Samples one thread's Python stack at a fixed interval from a helper thread.
+
+    The result is in the "folded" format (one `outer;...;inner count` line
+    per distinct stack), which flamegraph.pl and speedscope both read. The
+    profiled thread isn't slowed down apart from the GIL the sampler takes
+    once per interval. Threads only: under gevent every request shares one
+    thread, so samples would mix requests.
+    """
+
+    def __init__(self, thread_id=None, interval=DEFAULT_INTERVAL):
+        self.thread_id = thread_id or threading.get_ident()
+        self.interval = interval
+        self.samples = collections.Counter()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        if self._thread:
+            self._thread.join()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None:
+                break
+            self.samples[self._fold(frame)] += 1
+
+    @staticmethod
+    def _fold(frame):
+        stack = []
+        while frame is not None:
+            code = frame.f_code
+            stack.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+            frame = frame.f_back
+        return ';'.join(reversed(stack))
+
+    def folded(self):
+        return ''.join(f"{stack} {count}\n" for stack, count in self.samples.most_common())
+
+
+def _requested():
+    """Does this request carry the profiling header with the right token?"""
+    token = current_app.config.get('PROFILER_TOKEN')
+    supplied = request.headers.get(PROFILE_HEADER)
+    return bool(token and supplied) and hmac.compare_digest(supplied, token)
+
+
+def init_app(app):
+    """Profile requests that send `X-Profile: <PROFILER_TOKEN>`.
+
+    Each profile is written to PROFILER_DIR as a .folded file named in the
+    response's X-Profile-File header. With no PROFILER_TOKEN set this is
+    a single dict lookup per request.
+    """
+
+    @app.before_request
+    def start_profiler():
+        if _requested():
+            g.profiler = SamplingProfiler(interval=app.config.get('PROFILER_INTERVAL', DEFAULT_INTERVAL)).start()
+
+    @app.after_request
+    def save_profile(response):
+        profiler = g.pop('profiler', None)
+        if profiler is None:
+            return response
+
+        profiler.stop()
+        directory = app.config.get('PROFILER_DIR', os.path.join(app.instance_path, 'profiles'))
+        os.makedirs(directory, exist_ok=True)
+        filename = f"{time.strftime('%Y%m%d-%H%M%S')}-{request.endpoint or 'unmatched'}-{uuid.uuid4().hex[:8]}.folded"
+        with open(os.path.join(directory, filename), 'w') as f:
+            f.write(profiler.folded())
+
+        response.headers['X-Profile-File'] = filename
+        return response
@@ -0,0 +1,167 @@
+import logging, random, threading, time
+from collections import deque
+
+import requests
+from flask import current_app
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+from cache import CacheStats, LRUCache
+from metrics import ERRORS
+from models import db, Recipe
+
+logger = logging.getLogger(__name__)
+
+
+DEFAULT_BATCH_SIZE = 100
+DEFAULT_LOW_WATER = 30
+# Times each recipe is shown (to different users) before it's dropped from the pool
+DEFAULT_MAX_SERVES = 20
+# After a failed refill, requests don't start another one for this long
+DEFAULT_RETRY_SECONDS = 30
+
+# Recipes a user has been shown recently, which they won't be shown again
+SEEN_PER_USER = 300
+SEEN_USERS = 10000
+SEEN_TTL = 24 * 60 * 60
+
+_pool_lock = threading.Lock()
+
+
+class RandomRecipePool:
+    """Random Spoonacular recipes fetched in bulk and handed out from memory.
+
+    The homepage takes a few recipes per view. Each recipe is shown up to
+    `max_serves` times, never twice to the same user while they're in the
+    user's seen list, and then dropped. When fewer than `low_water` recipes
+    are left, one background thread fetches another `batch_size` and writes
+    them through to the recipes table, so the "View Recipe" links are served
+    from the local copy. Views never wait for the API: while the pool is
+    empty they get fewer (or no) recipes.
+    """
+
+    def __init__(self, app, batch_size=DEFAULT_BATCH_SIZE, low_water=DEFAULT_LOW_WATER,
+                 max_serves=DEFAULT_MAX_SERVES, retry_seconds=DEFAULT_RETRY_SECONDS):
+        self.app = app
+        self.batch_size = batch_size
+        self.low_water = low_water
+        self.max_serves = max_serves
+        self.retry_seconds = retry_seconds
+        self.stats = CacheStats()
+        # Each entry is [recipe, serves left]
+        self._entries = []
+        self._seen = LRUCache(max_size=SEEN_USERS)
+        self._lock = threading.Lock()
+        self._thread = None
+        self._retry_at = 0.0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def take(self, user_id, num=3):
+        """Return up to `num` recipes `user_id` hasn't been shown recently, starting a refill if running low."""
+        found, seen = self._seen.get(user_id)
+        if not found:
+            seen = deque(maxlen=SEEN_PER_USER)
+
+        with self._lock:
+            fresh = [entry for entry in self._entries if entry[0]['spoonacular_id'] not in seen]
+            if len(fresh) < num and len(self._entries) >= num:
+                # They've seen everything left; start their list over rather than show fewer
+                seen.clear()
+                fresh = self._entries
+            picked = random.sample(fresh, min(num, len(fresh)))
+
+            for entry in picked:
+                entry[1] -= 1
+                seen.append(entry[0]['spoonacular_id'])
+            exhausted = sum(1 for entry in picked if entry[1] <= 0)
+            if exhausted:
+                self._entries = [entry for entry in self._entries if entry[1] > 0]
+
+        self._seen.set(user_id, seen, SEEN_TTL)
+        self.stats.record(hits=len(picked), misses=num - len(picked), evictions=exhausted)
+        self.maybe_refill()
+        return [entry[0] for entry in picked]
+
+    def add(self, recipes):
+        with self._lock:
+            known = {entry[0]['spoonacular_id'] for entry in self._entries}
+            for recipe in recipes:
+                if recipe['spoonacular_id'] and recipe['spoonacular_id'] not in known:
+                    known.add(recipe['spoonacular_id'])
+                    self._entries.append([recipe, self.max_serves])
+
+    def maybe_refill(self):
+        """Start a background refill if the pool is low and one isn't already running."""
+        with self._lock:
+            if (len(self._entries) >= self.low_water or self._thread is not None
+                    or time.monotonic() < self._retry_at):
+                return
+            self._thread = threading.Thread(target=self._run_refill, name='random-recipe-pool', daemon=True)
+            self._thread.start()
+
+    def _run_refill(self):
+        try:
+            with self.app.app_context():
+                self.refill()
+        except Exception:
+            # e.g. no API key configured: back off rather than start a thread on every view
+            logger.exception("Error refilling the random recipe pool")
+            self._retry_at = time.monotonic() + self.retry_seconds
+        finally:
+            with self._lock:
+                self._thread = None
+
+    def refill(self):
+        """Fetch a batch of random recipes, store them locally and add them to the pool. Returns how many were added."""
+        try:
+            recipes = Recipe.fetch_random_recipes(self.batch_size)
+        except requests.RequestException as e:
+            logger.warning("Error fetching random recipes: %s", e)
+            ERRORS.inc(source='spoonacular')
+            self._retry_at = time.monotonic() + self.retry_seconds
+            return 0
+
+        try:
+            with Session(db.engine) as session:
+                Recipe.save_spoonacular_recipes(recipes, session=session)
+                try:
+                    session.commit()
+                except IntegrityError:
+                    # A request stored some of these first; the pool can still hand them out
+                    session.rollback()
+        except Exception:
+            # Don't throw away a batch we've paid for: recipe pages fall back to the API
+            logger.exception("Error storing random recipes")
+            ERRORS.inc(source='random_pool')
+
+        before = len(self._entries)
+        self.add([{key: recipe[key] for key in ('spoonacular_id', 'title', 'image', 'source_url')}
+                  for recipe in recipes])
+        return len(self._entries) - before
+
+    def wait(self, timeout=None):
+        """Wait for a running refill to finish (for tests and warm-up scripts)."""
+        thread = self._thread
+        if thread is not None:
+            thread.join(timeout)
+
+
+def get_random_pool():
+    """Return this process's random recipe pool, creating it on first use."""
+
+    pool = current_app.extensions.get('random_pool')
+    if pool is None:
+        with _pool_lock:
+            pool = current_app.extensions.get('random_pool')
+            if pool is None:
+                config = current_app.config
+                pool = RandomRecipePool(
+                    current_app._get_current_object(),
+                    batch_size=config.get('RANDOM_POOL_BATCH_SIZE', DEFAULT_BATCH_SIZE),
+                    low_water=config.get('RANDOM_POOL_LOW_WATER', DEFAULT_LOW_WATER),
+                    max_serves=config.get('RANDOM_POOL_MAX_SERVES', DEFAULT_MAX_SERVES),
+                    retry_seconds=config.get('RANDOM_POOL_RETRY_SECONDS', DEFAULT_RETRY_SECONDS))
+                current_app.extensions['random_pool'] = pool
+    return pool
@@ -0,0 +1,200 @@
+import csv, io, json
+from datetime import datetime
+
+from werkzeug.datastructures import MultiDict
+
+import fragments, ingredients
+from forms import RecipeAddForm
+from models import db, Recipe, Favorite
+
+
+FORMATS = ('jsonl', 'csv')
+
+# Rows per INSERT transaction, and per round trip when reading for export
+IMPORT_BATCH_SIZE = 5000
+EXPORT_BATCH_SIZE = 1000
+
+# Only the first few bad rows are reported back
+MAX_REPORTED_ERRORS = 100
+
+IMPORT_FIELDS = ('title', 'ingredients', 'instructions', 'image_url', 'is_public')
+RECIPE_EXPORT_FIELDS = ('id', 'title', 'ingredients', 'instructions', 'image_url', 'source_url',
+                        'is_public', 'created_at')
+FAVORITE_EXPORT_FIELDS = ('recipe_id', 'spoonacular_id', 'title', 'favorited_at')
+
+FALSE_VALUES = {'false', 'f', 'no', 'n', '0', 'off'}
+
+# Recipes without an image get this; it's a path, so RecipeAddForm's URL check would reject it
+DEFAULT_IMAGE_URL = "/static/images/default-food.png"
+
+
+class ImportResult:
+    """What an import did: rows inserted and the (line, errors) of rows that were rejected."""
+
+    def __init__(self):
+        self.imported = 0
+        self.rejected = 0
+        self.errors = []
+
+    def reject(self, line, errors):
+        self.rejected += 1
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append((line, errors))
+
+    def __repr__(self):
+        return f"<ImportResult imported={self.imported} rejected={self.rejected}>"
+
+
+def format_for(filename, default='jsonl'):
+    """Guess the format from a file name's extension."""
+    extension = filename.rsplit('.', 1)[-1].lower() if filename and '.' in filename else ''
+    return {'jsonl': 'jsonl', 'ndjson': 'jsonl', 'json': 'jsonl', 'csv': 'csv'}.get(extension, default)
+
+
+def read_records(stream, format):
+    """Yield (line number, dict) for each record in a text stream, one at a time.
+
+    Lines that aren't valid JSON objects are yielded as (line number, None).
+    """
+    if format == 'csv':
+        reader = csv.DictReader(stream)
+        for record in reader:
+            yield reader.line_num, record
+        return
+
+    for line_number, line in enumerate(stream, start=1):
+        if not line.strip():
+            continue
+        try:
+            record = json.loads(line)
+        except ValueError:
+            record = None
+        yield line_number, record if isinstance(record, dict) else None
+
+
+def _is_public(value):
+    if value is None or value == '':
+        return True
+    if isinstance(value, str):
+        return value.strip().lower() not in FALSE_VALUES
+    return bool(value)
+
+
+def validate(record, form=None):
+    """Check a record with RecipeAddForm's rules. Returns (row values, None) or (None, errors).
+
+    Pass the same `form` for every record of a file: binding a new form's
+    fields costs more than validating them.
+    """
+    if record is None:
+        return None, {'record': ["Not a JSON object."]}
+
+    formdata = MultiDict({field: str(record.get(field) or '') for field in IMPORT_FIELDS[:-1]})
+    if formdata['image_url'] == DEFAULT_IMAGE_URL:
+        formdata['image_url'] = ''
+    if _is_public(record.get('is_public')):
+        formdata['is_public'] = 'y'
+
+    if form is None:
+        form = RecipeAddForm(formdata=None, meta={'csrf': False})
+    form.process(formdata)
+    if not form.validate():
+        return None, form.errors
+
+    return {
+        'title': form.title.data,
+        'ingredients': form.ingredients.data,
+        'instructions': form.instructions.data,
+        'image_url': form.image_url.data or DEFAULT_IMAGE_URL,
+        'is_public': form.is_public.data,
+    }, None
+
+
+def import_recipes(stream, user_id, format='jsonl', batch_size=IMPORT_BATCH_SIZE):
+    """Stream recipes from a JSON Lines or CSV text stream into `user_id`'s recipes.
+
+    Records are read and validated one at a time and inserted batch_size at
+    a time, one executemany and commit per batch, so memory use doesn't grow
+    with the file. Invalid rows are skipped and reported in the result.
+    Imported recipes are not posted to friends' feeds.
+    """
+    result = ImportResult()
+    form = RecipeAddForm(formdata=None, meta={'csrf': False})
+    batch = []
+
+    def flush():
+        recipe_ids = db.session.scalars(
+            db.insert(Recipe).returning(Recipe.id, sort_by_parameter_order=True), batch).all()
+        # Core inserts skip the ORM events that invalidate the owner's cached profile card and index ingredients
+        fragments.touch(db.session, 'user', user_id)
+        ingredients.index_recipes(zip(recipe_ids, (row['ingredients'] for row in batch)))
+        db.session.commit()
+        result.imported += len(batch)
+        batch.clear()
+
+    for line, record in read_records(stream, format):
+        row, errors = validate(record, form)
+        if errors:
+            result.reject(line, errors)
+            continue
+
+        row['user_id'] = user_id
+        batch.append(row)
+        if len(batch) >= batch_size:
+            flush()
+
+    if batch:
+        flush()
+    return result
+
+
+def _serialize(value):
+    return value.isoformat() if isinstance(value, datetime) else value
+
+
+def _write(rows, fields, format):
+    """Yield `rows` (tuples in `fields` order) as JSON Lines or CSV text, a line at a time."""
+    if format == 'csv':
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        writer.writerow(fields)
+        # On its own, so an empty export is still a valid CSV file
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+        for row in rows:
+            writer.writerow([_serialize(value) for value in row])
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+        return
+
+    for row in rows:
+        yield json.dumps({field: _serialize(value) for field, value in zip(fields, row)}) + '\n'
+
+
+def export_recipes(user_id, format='jsonl'):
+    """Yield `user_id`'s recipes as JSON Lines or CSV, reading EXPORT_BATCH_SIZE rows at a time."""
+    rows = db.session.execute(
+        db.select(*(getattr(Recipe, field) for field in RECIPE_EXPORT_FIELDS))
+        .where(Recipe.user_id == user_id)
+        .order_by(Recipe.id)
+        .execution_options(yield_per=EXPORT_BATCH_SIZE)
+    )
+    return _write(rows, RECIPE_EXPORT_FIELDS, format)
+
+
+def export_favorites(user_id, format='jsonl'):
+    """Yield `user_id`'s favorites, with recipe titles where we have a local copy."""
+    local = db.aliased(Recipe)
+    remote = db.aliased(Recipe)
+    rows = db.session.execute(
+        db.select(Favorite.recipe_id, Favorite.spoonacular_id,
+                  db.func.coalesce(local.title, remote.title), Favorite.favorited_at)
+        .outerjoin(local, local.id == Favorite.recipe_id)
+        .outerjoin(remote, remote.spoonacular_id == Favorite.spoonacular_id)
+        .where(Favorite.user_id == user_id)
+        .order_by(Favorite.id)
+        .execution_options(yield_per=EXPORT_BATCH_SIZE)
+    )
+    return _write(rows, FAVORITE_EXPORT_FIELDS, format)
@@ -0,0 +1,198 @@
+import random, threading, time
+
+import requests
+from flask import current_app
+from requests.adapters import HTTPAdapter
+
+from metrics import SPOONACULAR_DURATION, SPOONACULAR_REQUESTS, spoonacular_path_label
+
+
+DEFAULT_BASE_URL = "https://api.spoonacular.com"
+
+# Upstream responses worth retrying: rate limiting and server side failures
+RETRY_STATUSES = frozenset({429, 500, 502, 503, 504})
+
+
+class CircuitOpenError(requests.RequestException):
+    """Raised instead of calling Spoonacular while the circuit breaker is open."""
+
+
+class CircuitBreaker:
+    """Stop calling upstream after repeated failures, then let a trial call through.
+
+    After `failure_threshold` consecutive failed calls the breaker opens and
+    every call fails fast for `reset_timeout` seconds. After that one trial
+    call is allowed (half-open); success closes the breaker, failure opens it
+    again.
+    """
+
+    def __init__(self, failure_threshold=5, reset_timeout=30):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self._trial_in_flight = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        if self.opened_at is None:
+            return 'closed'
+        if time.monotonic() - self.opened_at >= self.reset_timeout:
+            return 'half-open'
+        return 'open'
+
+    def allow(self):
+        with self._lock:
+            state = self.state
+            if state == 'closed':
+                return True
+            if state == 'half-open' and not self._trial_in_flight:
+                self._trial_in_flight = True
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self._trial_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self._trial_in_flight or self.failures >= self.failure_threshold:
+                self.opened_at = time.monotonic()
+            self._trial_in_flight = False
+
+
+class SpoonacularClient:
+    """Shared Spoonacular HTTP client.
+
+    Keeps one pooled keep-alive session, applies connect/read timeouts to
+    every call, retries 429/5xx responses and connection errors with jittered
+    exponential backoff, and fails fast through a circuit breaker while
+    upstream is down.
+    """
+
+    def __init__(self, api_key, base_url=DEFAULT_BASE_URL, pool_size=10,
+                 connect_timeout=3.05, read_timeout=10, max_retries=2,
+                 backoff_base=0.25, backoff_max=4, breaker=None):
+        self.api_key = api_key
+        self.base_url = base_url.rstrip('/')
+        self.timeout = (connect_timeout, read_timeout)
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.breaker = breaker or CircuitBreaker()
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=0)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+
+    def get(self, path, params=None):
+        """GET `path` from Spoonacular and return the response.
+
+        Raises CircuitOpenError without calling upstream while the breaker is
+        open, requests exceptions for connection errors and timeouts once
+        retries are used up, and other requests exceptions straight away.
+        Non-retryable error statuses are returned for the caller to handle.
+        """
+        path_label = spoonacular_path_label(path)
+        started = time.perf_counter()
+        status = 'error'
+        try:
+            response = self._get(path, params)
+            status = response.status_code
+            return response
+        except CircuitOpenError:
+            status = 'circuit_open'
+            raise
+        except requests.RequestException as e:
+            status = type(e).__name__
+            raise
+        finally:
+            SPOONACULAR_REQUESTS.inc(path=path_label, status=status)
+            SPOONACULAR_DURATION.observe(time.perf_counter() - started, path=path_label)
+
+    def _get(self, path, params):
+        if not self.breaker.allow():
+            raise CircuitOpenError("Spoonacular is unavailable, not sending request")
+
+        url = f"{self.base_url}{path}"
+        params = dict(params or {}, apiKey=self.api_key)
+
+        for attempt in range(self.max_retries + 1):
+            retries_left = attempt < self.max_retries
+
+            try:
+                response = self.session.get(url, params=params, timeout=self.timeout)
+            except requests.RequestException as e:
+                # Anything else (a broken chunked body, too many redirects)
+                # won't go away on retry, but must still settle the breaker
+                if not retries_left or not isinstance(e, (requests.ConnectionError, requests.Timeout)):
+                    self.breaker.record_failure()
+                    raise
+                self._sleep(attempt)
+                continue
+
+            if response.status_code in RETRY_STATUSES:
+                if not retries_left:
+                    self.breaker.record_failure()
+                    return response
+                self._sleep(attempt, response.headers.get('Retry-After'))
+                continue
+
+            self.breaker.record_success()
+            return response
+
+    def _sleep(self, attempt, retry_after=None):
+        """Wait before retrying: full jitter exponential backoff, or Retry-After if given."""
+        delay = random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
+        if retry_after:
+            try:
+                delay = min(self.backoff_max, float(retry_after))
+            except ValueError:
+                pass
+        time.sleep(delay)
+
+    def close(self):
+        self.session.close()
+
+
+_client_lock = threading.Lock()
+
+
+def make_client(config):
+    """Build a Spoonacular client from the app config."""
+
+    api_key = config.get('SPOONACULAR_API_KEY')
+    if not api_key:
+        raise ValueError("API key for Spoonacular not found!")
+
+    return SpoonacularClient(
+        api_key,
+        base_url=config.get('SPOONACULAR_BASE_URL', DEFAULT_BASE_URL),
+        pool_size=config.get('SPOONACULAR_POOL_SIZE', 10),
+        connect_timeout=config.get('SPOONACULAR_CONNECT_TIMEOUT', 3.05),
+        read_timeout=config.get('SPOONACULAR_READ_TIMEOUT', 10),
+        max_retries=config.get('SPOONACULAR_MAX_RETRIES', 2),
+        breaker=CircuitBreaker(
+            failure_threshold=config.get('SPOONACULAR_BREAKER_THRESHOLD', 5),
+            reset_timeout=config.get('SPOONACULAR_BREAKER_RESET', 30),
+        ),
+    )
+
+
+def get_client():
+    """Return the Spoonacular client for the current app, creating it on first use."""
+
+    client = current_app.extensions.get('spoonacular_client')
+    if client is None:
+        with _client_lock:
+            client = current_app.extensions.get('spoonacular_client')
+            if client is None:
+                client = make_client(current_app.config)
+                current_app.extensions['spoonacular_client'] = client
+    return client
@@ -0,0 +1,47 @@
+import os
+import subprocess
+import sys
+import unittest
+from unittest import mock
+
+os.environ.setdefault('DATABASE_URL', 'postgresql:///food_friends_test')
+
+from app import app, create_app
+from models import db
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+class CreateAppTests(unittest.TestCase):
+    """Building apps with the factory."""
+
+    def test_import_does_no_io(self):
+        """Test importing the app neither connects to the database nor loads CLI-only and image dependencies"""
+        code = ("import sys; import app; "
+                "print(sorted(m for m in ('flask_migrate', 'alembic', 'PIL', 'numpy') if m in sys.modules))")
+        # Nothing listens on port 1, so any connection attempt would fail the import
+        env = dict(os.environ, DATABASE_URL='postgresql://nobody@127.0.0.1:1/none')
+        result = subprocess.run([sys.executable, '-c', code], cwd=ROOT, env=env, capture_output=True, text=True)
+
+        self.assertEqual(result.returncode, 0, result.stderr)
+        self.assertEqual(result.stdout.strip(), '[]')
+
+    def test_config_overrides(self):
+        """Test each app gets its own config, with `config` applied over the environment"""
+        other = create_app({'TESTING': True, 'SEARCH_MIN_LOCAL_RESULTS': 1})
+
+        self.assertIsNot(other, app)
+        self.assertEqual(other.config['SEARCH_MIN_LOCAL_RESULTS'], 1)
+        self.assertEqual(app.config['SEARCH_MIN_LOCAL_RESULTS'], int(os.environ.get('SEARCH_MIN_LOCAL_RESULTS', 6)))
+        self.assertEqual(other.test_client().get('/login').status_code, 200)
+
+    def test_async_database_pool_size(self):
+        """Test the database pool is sized from DATABASE_POOL_SIZE, which gunicorn.conf.py sets in async mode"""
+        env = {'DATABASE_URL': 'postgresql://nobody@127.0.0.1:1/none', 'DATABASE_POOL_SIZE': '100'}
+        with mock.patch.dict(os.environ, env):
+            other = create_app()
+            with other.app_context():
+                pool_size = db.engine.pool.size()
+
+        self.assertEqual(pool_size, 100)
+        self.assertEqual(other.config['SQLALCHEMY_ENGINE_OPTIONS']['max_overflow'], 0)
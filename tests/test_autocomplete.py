@@ -0,0 +1,86 @@
+import os
+import unittest
+
+os.environ.setdefault('DATABASE_URL', 'postgresql:///food_friends_test')
+
+from app import app
+from autocomplete import UsernameIndex, get_username_index
+from models import db, User
+
+app.config['TESTING'] = True
+
+
+class UsernameIndexTests(unittest.TestCase):
+    """Prefix lookups against the in-memory sorted index."""
+
+    def setUp(self):
+        self.index = UsernameIndex()
+        for user_id, username in enumerate(['carol', 'Bob', 'bobby', 'alice', 'bo'], start=1):
+            self.index.add(username, user_id)
+
+    def test_prefix_is_case_insensitive(self):
+        """Test matches are case-insensitive and in username order"""
+        self.assertEqual([user['username'] for user in self.index.search('BO')], ['bo', 'Bob', 'bobby'])
+        self.assertEqual([user['id'] for user in self.index.search('c')], [1])
+        self.assertEqual(self.index.search('d'), [])
+        self.assertEqual(self.index.search(''), [])
+
+    def test_limit(self):
+        """Test no more than `limit` matches are returned"""
+        self.assertEqual([user['username'] for user in self.index.search('b', limit=2)], ['bo', 'Bob'])
+
+    def test_add_is_idempotent(self):
+        """Test adding a user twice leaves one entry"""
+        self.index.add('alice', 4)
+        self.assertEqual(len(self.index), 5)
+
+
+class AutocompleteViewTests(unittest.TestCase):
+    """The JSON endpoint, served without querying the database."""
+
+    def setUp(self):
+        self.ctx = app.app_context()
+        self.ctx.push()
+        db.drop_all()
+        db.create_all()
+        app.extensions.pop('username_index', None)
+
+        db.session.add_all([User(username=name, email=f"{name}@example.com", password="x")
+                            for name in ('pat', 'patty', 'sam')])
+        db.session.commit()
+        self.client = app.test_client()
+
+    def tearDown(self):
+        app.extensions.pop('username_index', None)
+        db.session.remove()
+        db.drop_all()
+        self.ctx.pop()
+
+    def test_autocomplete(self):
+        """Test matching usernames come back as JSON with no SQL once the index is loaded"""
+        get_username_index()
+
+        queries = []
+        listener = lambda *args: queries.append(args[2])
+        db.event.listen(db.engine, 'before_cursor_execute', listener)
+        try:
+            resp = self.client.get('/users/autocomplete?q=pat')
+        finally:
+            db.event.remove(db.engine, 'before_cursor_execute', listener)
+
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual([user['username'] for user in resp.get_json()], ['pat', 'patty'])
+        self.assertEqual(queries, [])
+
+    def test_catch_up_finds_users_from_other_processes(self):
+        """Test users inserted behind the index's back appear after a refresh"""
+        index = get_username_index()
+        db.session.add(User(username="patrice", email="patrice@example.com", password="x"))
+        db.session.commit()
+
+        self.assertEqual(index.catch_up(), 1)
+        self.assertIn('patrice', [user['username'] for user in index.search('pat')])
+
+
+if __name__ == '__main__':
+    unittest.main()
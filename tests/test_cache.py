@@ -0,0 +1,71 @@
+import os
+import tempfile
+import time
+import unittest
+
+from cache import LRUCache, SQLiteCache
+
+
+class LRUCacheTests(unittest.TestCase):
+    def test_get_and_set(self):
+        """Test a stored value is returned and None can be cached"""
+        cache = LRUCache(max_size=10)
+        cache.set("recipe:1", {"title": "Soup"}, ttl=60)
+        cache.set("recipe:2", None, ttl=60)
+
+        self.assertEqual(cache.get("recipe:1"), (True, {"title": "Soup"}))
+        self.assertEqual(cache.get("recipe:2"), (True, None))
+        self.assertEqual(cache.get("recipe:3"), (False, None))
+        self.assertEqual(cache.stats.as_dict()['hits'], 2)
+        self.assertEqual(cache.stats.as_dict()['misses'], 1)
+
+    def test_expiry(self):
+        """Test entries past their TTL are treated as misses"""
+        cache = LRUCache(max_size=10)
+        cache.set("search:soup", [], ttl=-1)
+
+        self.assertEqual(cache.get("search:soup"), (False, None))
+
+    def test_evicts_least_recently_used(self):
+        """Test the least recently read entry is evicted when full"""
+        cache = LRUCache(max_size=2)
+        cache.set("a", 1, ttl=60)
+        cache.set("b", 2, ttl=60)
+        cache.get("a")
+        cache.set("c", 3, ttl=60)
+
+        self.assertEqual(cache.get("b"), (False, None))
+        self.assertEqual(cache.get("a"), (True, 1))
+        self.assertEqual(cache.stats.as_dict()['evictions'], 1)
+
+
+class SQLiteCacheTests(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmpdir.name, "cache.sqlite3")
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_shared_between_instances(self):
+        """Test a second cache on the same file (another worker) sees stored values"""
+        SQLiteCache(self.path).set("recipe:1", {"title": "Soup"}, ttl=60)
+
+        self.assertEqual(SQLiteCache(self.path).get("recipe:1"), (True, {"title": "Soup"}))
+
+    def test_evicts_past_max_size(self):
+        """Test the table is trimmed back to max_size"""
+        cache = SQLiteCache(self.path, max_size=2)
+        cache.set("a", 1, ttl=60)
+        time.sleep(0.01)
+        cache.set("b", 2, ttl=60)
+        time.sleep(0.01)
+        cache.set("c", 3, ttl=60)
+
+        self.assertEqual(len(cache), 2)
+        self.assertEqual(cache.get("a"), (False, None))
+        self.assertEqual(cache.stats.as_dict()['evictions'], 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
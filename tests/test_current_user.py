@@ -0,0 +1,91 @@
+import os
+import unittest
+
+os.environ.setdefault('DATABASE_URL', 'postgresql:///food_friends_test')
+
+from app import app, CURR_USER_KEY
+from models import db, User
+from current_user import CurrentUser, get_user_cache, load_current_user
+from query_counter import count_queries
+
+app.config['TESTING'] = True
+
+
+class CurrentUserTests(unittest.TestCase):
+    """The cached logged-in user summary behind g.user."""
+
+    def setUp(self):
+        self.ctx = app.app_context()
+        self.ctx.push()
+        db.drop_all()
+        db.create_all()
+        get_user_cache().clear()
+
+        user = User(username="cook", email="cook@example.com", password="x", image_url="/static/cook.png")
+        db.session.add(user)
+        db.session.commit()
+        self.user_id = user.id
+
+    def tearDown(self):
+        get_user_cache().clear()
+        db.session.remove()
+        db.drop_all()
+        self.ctx.pop()
+
+    def user_queries(self, counter):
+        return [statement for statement in counter.statements if 'FROM users' in statement]
+
+    def test_cached_request_skips_user_query(self):
+        """Test only the first request reads the users table to set g.user"""
+        client = app.test_client()
+        with client.session_transaction() as sess:
+            sess[CURR_USER_KEY] = self.user_id
+
+        with count_queries(db.engine) as first:
+            client.get('/login')
+        with count_queries(db.engine) as second:
+            client.get('/login')
+
+        self.assertEqual(len(self.user_queries(first)), 1)
+        self.assertEqual(self.user_queries(second), [])
+
+    def test_summary_fields_need_no_query(self):
+        """Test id, username and image_url come from the cache"""
+        load_current_user(self.user_id)
+
+        with count_queries(db.engine) as counter:
+            user = load_current_user(self.user_id)
+            self.assertIsInstance(user, CurrentUser)
+            self.assertEqual((user.id, user.username, user.image_url), (self.user_id, "cook", "/static/cook.png"))
+
+        self.assertEqual(counter.count, 0)
+
+    def test_other_attributes_load_full_row_once(self):
+        """Test reading a non-cached attribute loads the User row, once"""
+        user = load_current_user(self.user_id)
+
+        with count_queries(db.engine) as counter:
+            self.assertEqual(user.email, "cook@example.com")
+            self.assertEqual(user.password, "x")
+
+        self.assertEqual(counter.count, 1)
+        self.assertIsInstance(user.user, User)
+
+    def test_update_invalidates(self):
+        """Test changing the User row drops its cached summary"""
+        load_current_user(self.user_id)
+
+        db.session.get(User, self.user_id).username = "chef"
+        db.session.commit()
+
+        self.assertEqual(get_user_cache().get(f"user:{self.user_id}"), (False, None))
+        self.assertEqual(load_current_user(self.user_id).username, "chef")
+
+    def test_delete_invalidates(self):
+        """Test deleting the User drops its cached summary, so it's no longer logged in"""
+        load_current_user(self.user_id)
+
+        db.session.delete(db.session.get(User, self.user_id))
+        db.session.commit()
+
+        self.assertIsNone(load_current_user(self.user_id))
@@ -0,0 +1,84 @@
+import os
+import unittest
+from unittest import mock
+
+os.environ.setdefault('DATABASE_URL', 'postgresql:///food_friends_test')
+
+from app import app
+from models import db, User, Friendship, Activity, TimelineEntry
+
+app.config['TESTING'] = True
+
+
+class FeedTests(unittest.TestCase):
+    """Timelines built by fan-out on write, with fan-out on read for busy users."""
+
+    def setUp(self):
+        self.ctx = app.app_context()
+        self.ctx.push()
+        db.drop_all()
+        db.create_all()
+
+        users = [User(username=f"user{i}", email=f"user{i}@example.com", password="x") for i in range(5)]
+        db.session.add_all(users)
+        db.session.commit()
+        self.reader, self.friend, self.busy, self.stranger, self.other = [user.id for user in users]
+
+        for friend_id in (self.friend, self.busy):
+            Friendship.link(self.reader, friend_id)
+        Friendship.link(self.busy, self.other)
+        db.session.commit()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.ctx.pop()
+
+    def record(self, actor_id, count=1):
+        activities = [Activity.record(actor_id, 'recipe', title=f"Recipe {n}") for n in range(count)]
+        db.session.commit()
+        return [activity.id for activity in activities]
+
+    def test_fan_out_on_write(self):
+        """Test a friend's activity is copied into the reader's timeline and not a stranger's"""
+        [activity_id] = self.record(self.friend)
+
+        self.assertTrue(db.session.get(TimelineEntry, (self.reader, activity_id)))
+        self.assertEqual([a.id for a in Activity.timeline(self.reader)[0]], [activity_id])
+        self.assertEqual(Activity.timeline(self.stranger)[0], [])
+
+    def test_busy_users_are_read_at_view_time(self):
+        """Test activities of users over FANOUT_MAX_FRIENDS are merged in on read"""
+        with mock.patch('models.FANOUT_MAX_FRIENDS', 1):
+            busy_ids = self.record(self.busy, 2)
+            friend_ids = self.record(self.friend)
+
+        self.assertEqual(TimelineEntry.query.filter(TimelineEntry.activity_id.in_(busy_ids)).count(), 0)
+        activities, _ = Activity.timeline(self.reader)
+        self.assertEqual([a.id for a in activities], friend_ids[::-1] + busy_ids[::-1])
+
+    def test_cursor_pagination(self):
+        """Test following the cursor walks the whole feed once, newest first"""
+        with mock.patch('models.FANOUT_MAX_FRIENDS', 1):
+            ids = self.record(self.friend, 3) + self.record(self.busy, 3) + self.record(self.friend, 2)
+
+        seen, before = [], None
+        while True:
+            page, before = Activity.timeline(self.reader, before=before, per_page=3)
+            seen += [activity.id for activity in page]
+            if before is None:
+                break
+
+        self.assertEqual(seen, sorted(ids, reverse=True))
+
+    def test_unfriend_removes_activities(self):
+        """Test a former friend's activities leave the timeline"""
+        self.record(self.friend, 2)
+        Friendship.unlink(self.reader, self.friend)
+        db.session.commit()
+
+        self.assertEqual(Activity.timeline(self.reader)[0], [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,118 @@
+import os
+import tempfile
+import unittest
+
+os.environ.setdefault('DATABASE_URL', 'postgresql:///food_friends_test')
+
+from app import app, CURR_USER_KEY
+from models import db, User, Recipe, Favorite
+from cache import LRUCache, SQLiteCache
+from fragments import FragmentCache, get_fragment_cache
+from query_counter import count_queries
+
+app.config['TESTING'] = True
+app.config['WTF_CSRF_ENABLED'] = False
+
+
+class FragmentCacheTests(unittest.TestCase):
+    """Cached template fragments and their invalidation on writes."""
+
+    def setUp(self):
+        self.ctx = app.app_context()
+        self.ctx.push()
+        db.drop_all()
+        db.create_all()
+        get_fragment_cache().backend.clear()
+        get_fragment_cache().versions.clear()
+
+        owner = User(username="owner", email="owner@example.com", password="x")
+        viewer = User(username="viewer", email="viewer@example.com", password="x")
+        db.session.add_all([owner, viewer])
+        db.session.flush()
+        self.recipe = Recipe(title="Soup", ingredients="water", instructions="Boil.", user_id=owner.id)
+        db.session.add(self.recipe)
+        db.session.commit()
+        self.owner_id, self.viewer_id = owner.id, viewer.id
+
+        self.client = app.test_client()
+        with self.client.session_transaction() as sess:
+            sess[CURR_USER_KEY] = self.viewer_id
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.ctx.pop()
+
+    def get(self, url):
+        with count_queries(db.engine) as counter:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return response.get_data(as_text=True), counter.count
+
+    def test_cached_profile_card_skips_count_queries(self):
+        """Test a cached profile card is reused without counting recipes and favorites again"""
+        first, first_queries = self.get(f"/users/{self.owner_id}")
+        second, second_queries = self.get(f"/users/{self.owner_id}")
+
+        self.assertEqual(first, second)
+        self.assertEqual(second_queries, first_queries - 2)
+        self.assertGreaterEqual(get_fragment_cache().stats.hits, 1)
+
+    def test_writes_invalidate(self):
+        """Test ORM writes to recipes and favorites refresh the fragments that show them"""
+        self.get(f"/users/{self.owner_id}")
+        self.get(f"/users/{self.owner_id}/recipes")
+
+        db.session.add(Favorite(user_id=self.owner_id, recipe_id=self.recipe.id))
+        db.session.get(Recipe, self.recipe.id).title = "Stew"
+        db.session.commit()
+
+        profile, _ = self.get(f"/users/{self.owner_id}")
+        self.assertIn('/favorites">1</a>', profile)
+        recipes, _ = self.get(f"/users/{self.owner_id}/recipes")
+        self.assertIn("Stew", recipes)
+
+    def test_rollback_does_not_invalidate(self):
+        """Test writes that are rolled back leave cached fragments in place"""
+        cache = get_fragment_cache()
+        version = cache.version('recipe', self.recipe.id)
+
+        db.session.get(Recipe, self.recipe.id).title = "Stew"
+        db.session.flush()
+        db.session.rollback()
+
+        self.assertEqual(cache.version('recipe', self.recipe.id), version)
+
+    def test_bulk_unfriend_invalidates(self):
+        """Test unfriending, which deletes in bulk, refreshes both profile cards"""
+        self.client.post(f"/users/{self.owner_id}/add")
+        with self.client.session_transaction() as sess:
+            sess[CURR_USER_KEY] = self.owner_id
+        self.client.post(f"/users/{self.viewer_id}/accept")
+        self.assertIn('/friends">1</a>', self.get(f"/users/{self.viewer_id}")[0])
+
+        self.client.post(f"/users/{self.viewer_id}/unfriend")
+        self.assertIn('/friends">0</a>', self.get(f"/users/{self.viewer_id}")[0])
+
+    def test_versions_are_shared_between_processes(self):
+        """Test a write committed in one process refreshes fragments another process cached"""
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'versions.sqlite3')
+            web = FragmentCache(LRUCache(100), versions=SQLiteCache(path))
+            worker = FragmentCache(LRUCache(100), versions=SQLiteCache(path))
+
+            self.assertEqual(web.render('card', lambda: "old", user=1), "old")
+            self.assertEqual(web.render('card', lambda: "new", user=1), "old")
+
+            worker.bump('user', 1)
+            self.assertEqual(web.render('card', lambda: "new", user=1), "new")
+
+    def test_memory_backend_keeps_versions_on_disk(self):
+        """Test the default per-process backend still keeps version tokens in the shared file"""
+        cache = get_fragment_cache()
+        self.assertIsInstance(cache.backend, LRUCache)
+        self.assertIsInstance(cache.versions, SQLiteCache)
+
+
+if __name__ == '__main__':
+    unittest.main()
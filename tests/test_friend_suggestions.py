@@ -0,0 +1,115 @@
+import os
+import random
+import unittest
+from unittest import mock
+
+os.environ.setdefault('DATABASE_URL', 'postgresql:///food_friends_test')
+
+from app import app
+from models import db, User, Favorite, Friendship, FriendSuggestion
+
+app.config['TESTING'] = True
+
+
+class FriendSuggestionTests(unittest.TestCase):
+    """Incrementally maintained suggestions must match a full recompute."""
+
+    def setUp(self):
+        self.ctx = app.app_context()
+        self.ctx.push()
+        db.drop_all()
+        db.create_all()
+
+        users = [User(username=f"user{i}", email=f"user{i}@example.com", password="x") for i in range(12)]
+        db.session.add_all(users)
+        db.session.commit()
+        self.user_ids = [user.id for user in users]
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.ctx.pop()
+
+    def snapshot(self):
+        return {(s.user_id, s.suggested_id): (s.mutual_count, s.shared_favorites, s.score)
+                for s in FriendSuggestion.query.all()}
+
+    def rebuilt(self):
+        incremental = self.snapshot()
+        FriendSuggestion.rebuild(self.user_ids)
+        db.session.commit()
+        return incremental, self.snapshot()
+
+    def test_mutual_friends(self):
+        """Test a friend of a friend is suggested with their mutual friend count"""
+        a, b, c, d = self.user_ids[:4]
+        Friendship.link(a, b)
+        Friendship.link(b, c)
+        Friendship.link(a, d)
+        Friendship.link(d, c)
+        db.session.commit()
+
+        self.assertEqual([s.suggested_id for s in FriendSuggestion.for_user(a)], [c])
+        self.assertEqual(FriendSuggestion.for_user(c)[0].mutual_count, 2)
+
+        Friendship.link(a, c)
+        db.session.commit()
+        self.assertEqual(FriendSuggestion.for_user(a), [])
+
+    def test_shared_favorites_rank(self):
+        """Test shared favorites break ties between equally connected suggestions"""
+        a, b, c, d = self.user_ids[:4]
+        Friendship.link(a, b)
+        Friendship.link(b, c)
+        Friendship.link(b, d)
+        for user_id in (a, d):
+            db.session.add(Favorite(user_id=user_id, spoonacular_id=42))
+            FriendSuggestion.favorite_changed(user_id, spoonacular_id=42, delta=1)
+        db.session.commit()
+
+        suggestions = FriendSuggestion.for_user(a)
+        self.assertEqual([s.suggested_id for s in suggestions], [d, c])
+        self.assertEqual(suggestions[0].shared_favorites, 1)
+
+    def test_incremental_matches_rebuild(self):
+        """Test random links, unlinks and favorites leave the same rows a rebuild would"""
+        rng = random.Random(7)
+
+        with mock.patch('models.SUGGESTIONS_PER_USER', 1000):
+            for _ in range(150):
+                a, b = rng.sample(self.user_ids, 2)
+                action = rng.random()
+                if action < 0.55:
+                    Friendship.link(a, b)
+                elif action < 0.8:
+                    Friendship.unlink(a, b)
+                else:
+                    spoonacular_id = rng.randint(1, 4)
+                    favorite = Favorite.query.filter_by(user_id=a, spoonacular_id=spoonacular_id).first()
+                    if favorite:
+                        FriendSuggestion.favorite_changed(a, spoonacular_id=spoonacular_id, delta=-1)
+                        db.session.delete(favorite)
+                    else:
+                        db.session.add(Favorite(user_id=a, spoonacular_id=spoonacular_id))
+                        FriendSuggestion.favorite_changed(a, spoonacular_id=spoonacular_id, delta=1)
+                db.session.commit()
+
+            incremental, rebuilt = self.rebuilt()
+
+        self.assertTrue(rebuilt)
+        self.assertEqual(incremental, rebuilt)
+
+    def test_trim(self):
+        """Test only the best SUGGESTIONS_PER_USER rows are kept per user"""
+        a, hub, *others = self.user_ids
+        Friendship.link(a, hub)
+        with mock.patch('models.SUGGESTIONS_PER_USER', 3):
+            for other_id in others:
+                Friendship.link(hub, other_id)
+            db.session.commit()
+
+        self.assertEqual(FriendSuggestion.query.filter_by(user_id=a).count(), 3)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,98 @@
+import os
+import unittest
+
+os.environ.setdefault('DATABASE_URL', 'postgresql:///food_friends_test')
+
+from app import app
+from models import db, User, Friend, Friendship
+
+app.config['TESTING'] = True
+
+
+class FriendshipTests(unittest.TestCase):
+    """The symmetric friendships edge table and users.friend_count."""
+
+    def setUp(self):
+        self.ctx = app.app_context()
+        self.ctx.push()
+        db.drop_all()
+        db.create_all()
+
+        users = [User(username=f"user{i}", email=f"user{i}@example.com", password="x") for i in range(3)]
+        db.session.add_all(users)
+        db.session.commit()
+        self.a, self.b, self.c = (user.id for user in users)
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.ctx.pop()
+
+    def edges(self):
+        return {(edge.user_id, edge.friend_id) for edge in Friendship.query}
+
+    def friend_counts(self):
+        db.session.expire_all()
+        return [db.session.get(User, user_id).friend_count for user_id in (self.a, self.b, self.c)]
+
+    def test_link_and_unlink_are_symmetric(self):
+        """Test a friendship is stored in both directions, and unlinking from either side removes both"""
+        self.assertTrue(Friendship.link(self.a, self.b))
+        db.session.commit()
+        self.assertEqual(self.edges(), {(self.a, self.b), (self.b, self.a)})
+        self.assertTrue(Friendship.are_friends(self.b, self.a))
+        self.assertEqual(Friendship.friend_ids(self.b), {self.a})
+
+        self.assertFalse(Friendship.link(self.b, self.a))
+        self.assertTrue(Friendship.unlink(self.b, self.a))
+        db.session.commit()
+        self.assertEqual(self.edges(), set())
+        self.assertFalse(Friendship.are_friends(self.a, self.b))
+
+    def test_friend_count_follows_link_unlink_and_relink(self):
+        """Test friend_count goes up and down with each friendship, and back up when it's restored"""
+        Friendship.link(self.a, self.b)
+        Friendship.link(self.a, self.c)
+        db.session.commit()
+        self.assertEqual(self.friend_counts(), [2, 1, 1])
+
+        Friendship.unlink(self.a, self.b)
+        db.session.commit()
+        self.assertEqual(self.friend_counts(), [1, 0, 1])
+
+        Friendship.link(self.b, self.a)
+        db.session.commit()
+        self.assertEqual(self.friend_counts(), [2, 1, 1])
+
+    def test_unlinking_non_friends_is_a_no_op(self):
+        """Test unfriending someone who isn't a friend changes nothing"""
+        Friendship.link(self.a, self.b)
+        db.session.commit()
+
+        self.assertFalse(Friendship.unlink(self.a, self.c))
+        db.session.commit()
+        self.assertEqual(self.edges(), {(self.a, self.b), (self.b, self.a)})
+        self.assertEqual(self.friend_counts(), [1, 1, 0])
+
+    def test_backfill_fixes_drifted_counts(self):
+        """Test flask backfill-friendships rebuilds the edges and counts from accepted requests"""
+        db.session.add_all([
+            Friend(user_id=self.a, friend_id=self.b, status='accepted'),
+            Friend(user_id=self.c, friend_id=self.a, status='accepted'),
+            Friend(user_id=self.b, friend_id=self.c, status='pending'),
+        ])
+        Friendship.link(self.b, self.c)
+        db.session.commit()
+        db.session.execute(db.update(User).where(User.id == self.a).values(friend_count=7))
+        db.session.commit()
+
+        result = app.test_cli_runner().invoke(args=['backfill-friendships'])
+
+        self.assertEqual(result.exit_code, 0, result.output)
+        self.assertIn("Wrote 4 friendship edges.", result.output)
+        self.assertEqual(self.edges(), {(self.a, self.b), (self.b, self.a), (self.a, self.c), (self.c, self.a)})
+        self.assertEqual(self.friend_counts(), [2, 1, 1])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,178 @@
+import io
+import os
+import shutil
+import socket
+import tempfile
+import threading
+import time
+import unittest
+from unittest import mock
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+os.environ.setdefault('DATABASE_URL', 'postgresql:///food_friends_test')
+
+from PIL import Image
+
+from app import app
+from images import ThumbnailStore, thumbnail_url, THUMBNAIL_SIZES
+
+app.config['TESTING'] = True
+
+
+def png(width=1200, height=800):
+    out = io.BytesIO()
+    Image.new('RGB', (width, height), (200, 80, 40)).save(out, 'PNG')
+    return out.getvalue()
+
+
+class ImageServer(BaseHTTPRequestHandler):
+    """Serves /photo.png and counts requests."""
+
+    hits = 0
+    host = None
+    body = png()
+
+    def do_GET(self):
+        type(self).hits += 1
+        type(self).host = self.headers['Host']
+        if self.path != '/photo.png':
+            self.send_error(404)
+            return
+        self.send_response(200)
+        self.send_header('Content-Type', 'image/png')
+        self.send_header('Content-Length', str(len(self.body)))
+        self.end_headers()
+        self.wfile.write(self.body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class ImageProxyTests(unittest.TestCase):
+    """The signed image proxy and its on-disk thumbnail cache."""
+
+    @classmethod
+    def setUpClass(cls):
+        cls.server = ThreadingHTTPServer(('127.0.0.1', 0), ImageServer)
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+        cls.url = f"http://127.0.0.1:{cls.server.server_port}/photo.png"
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        app.config.update(IMAGE_CACHE_DIR=self.directory, IMAGE_PROXY_ALLOW_PRIVATE=True)
+        app.extensions.pop('image_cache', None)
+        ImageServer.hits = 0
+        self.client = app.test_client()
+
+    def tearDown(self):
+        app.config.update(IMAGE_PROXY_ALLOW_PRIVATE=False)
+        app.extensions.pop('image_cache', None)
+        shutil.rmtree(self.directory)
+
+    def proxied(self, url, size):
+        with app.test_request_context():
+            return thumbnail_url(url, size)
+
+    def test_local_paths_are_not_proxied(self):
+        """Test static paths and empty URLs pass through"""
+        self.assertEqual(self.proxied('/static/images/default-food.png', 'sm'), '/static/images/default-food.png')
+        self.assertEqual(self.proxied(None, 'sm'), '')
+
+    def test_fetches_once_and_serves_every_size(self):
+        """Test one fetch makes all sizes, served with a strong ETag and long cache headers"""
+        for size, longest_side in THUMBNAIL_SIZES.items():
+            resp = self.client.get(self.proxied(self.url, size))
+            self.assertEqual(resp.status_code, 200)
+            self.assertEqual(resp.mimetype, 'image/webp')
+            self.assertIn('immutable', resp.headers['Cache-Control'])
+            self.assertEqual(max(Image.open(io.BytesIO(resp.data)).size), longest_side)
+        self.assertEqual(ImageServer.hits, 1)
+
+        etag = resp.headers['ETag']
+        self.assertFalse(etag.startswith('W/'))
+        resp = self.client.get(self.proxied(self.url, size), headers={'If-None-Match': etag})
+        self.assertEqual(resp.status_code, 304)
+
+    def test_unsigned_urls_are_refused(self):
+        """Test the proxy only fetches URLs the app signed"""
+        resp = self.client.get(f"/images/sm/{'0' * 32}?url={self.url}")
+        self.assertEqual(resp.status_code, 404)
+        self.assertEqual(ImageServer.hits, 0)
+
+    def test_private_addresses_are_refused(self):
+        """Test sources on private addresses are not fetched, and the browser is sent to the source"""
+        app.config['IMAGE_PROXY_ALLOW_PRIVATE'] = False
+        resp = self.client.get(self.proxied(self.url, 'sm'))
+
+        self.assertEqual(resp.status_code, 302)
+        self.assertEqual(resp.location, self.url)
+        self.assertEqual(ImageServer.hits, 0)
+
+    def test_connects_to_the_checked_address(self):
+        """Test the host is resolved once and that address is used, so DNS rebinding can't redirect the fetch"""
+        resolve = socket.getaddrinfo
+        lookups = []
+
+        def rebinding(host, *args, **kwargs):
+            if host != 'images.test':
+                return resolve(host, *args, **kwargs)
+            lookups.append(host)
+            if len(lookups) > 1:
+                raise socket.gaierror("rebound")
+            return resolve('127.0.0.1', *args, **kwargs)
+
+        url = f"http://images.test:{self.server.server_port}/photo.png"
+        with mock.patch('socket.getaddrinfo', side_effect=rebinding):
+            resp = self.client.get(self.proxied(url, 'sm'))
+
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(len(lookups), 1)
+        self.assertEqual(ImageServer.host, f"images.test:{self.server.server_port}")
+
+    def test_dns_rebinding_is_refused(self):
+        """Test a host that resolves to a public address for the check, then to loopback, isn't fetched from loopback"""
+        app.config['IMAGE_PROXY_ALLOW_PRIVATE'] = False
+        port = self.server.server_port
+        lookups = []
+
+        def rebinding(host, *args, **kwargs):
+            lookups.append(host)
+            address = '93.184.216.34' if len(lookups) == 1 else '127.0.0.1'
+            return [(socket.AF_INET, socket.SOCK_STREAM, 6, '', (address, port))]
+
+        connected = []
+
+        def unreachable(address, *args, **kwargs):
+            connected.append(address)
+            raise OSError("unreachable")
+
+        url = f"http://images.test:{port}/photo.png"
+        with mock.patch('socket.getaddrinfo', side_effect=rebinding), \
+                mock.patch('urllib3.util.connection.create_connection', side_effect=unreachable):
+            resp = self.client.get(self.proxied(url, 'sm'))
+
+        self.assertEqual(resp.status_code, 302)
+        self.assertEqual(connected, [('93.184.216.34', port)])
+        self.assertEqual(ImageServer.hits, 0)
+
+    def test_eviction_keeps_recently_served(self):
+        """Test going over max_bytes evicts the least recently served thumbnails"""
+        store = ThumbnailStore(self.directory, max_bytes=3000)
+        store.put('http://a/1', {'sm': b'1' * 1000})
+        store.put('http://a/2', {'sm': b'2' * 1000})
+        time.sleep(0.01)
+        store.get('http://a/1', 'sm')
+        store.put('http://a/3', {'sm': b'3' * 1500})
+
+        self.assertIsNotNone(store.get('http://a/1', 'sm'))
+        self.assertIsNone(store.get('http://a/2', 'sm'))
+        self.assertIsNotNone(store.get('http://a/3', 'sm'))
+        self.assertLessEqual(store.total_bytes, 3000)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,174 @@
+import io
+import json
+import os
+import time
+import unittest
+from unittest import mock
+
+os.environ.setdefault('DATABASE_URL', 'postgresql:///food_friends_test')
+
+from app import app
+from models import db, User, Recipe, Ingredient, RecipeIngredient
+import ingredients
+from ingredients import PantryIndex, get_pantry_index, normalize, parse
+from recipe_io import import_recipes
+
+app.config['TESTING'] = True
+app.config['WTF_CSRF_ENABLED'] = False
+
+
+class IngredientParsingTests(unittest.TestCase):
+    """Reducing ingredient lines to vocabulary names."""
+
+    def test_normalize(self):
+        """Test quantities, units, descriptors and plurals are dropped"""
+        self.assertEqual(normalize("2 cups Fresh Tomatoes, diced (about 3)"), "tomato")
+        self.assertEqual(normalize("3 large eggs"), "egg")
+        self.assertEqual(normalize("1 tbsp extra-virgin olive oil"), "extra-virgin olive oil")
+        self.assertEqual(normalize("1/2 tsp ground cloves"), "ground clove")
+        self.assertEqual(normalize("1 lb asparagus"), "asparagus")
+        self.assertEqual(normalize("1 cup berries"), "berry")
+        self.assertIsNone(normalize("2, chopped (optional)"))
+
+    def test_parse(self):
+        """Test one ingredient per line, or a single comma separated line"""
+        self.assertEqual(parse("2 eggs\n1 cup flour\n\n2 eggs"), ["egg", "flour"])
+        self.assertEqual(parse("flour, water, salt"), ["flour", "salt", "water"])
+        self.assertEqual(parse(""), [])
+
+
+class PantryIndexTests(unittest.TestCase):
+    """Ranking recipes in an in-memory pantry index."""
+
+    def setUp(self):
+        names = {'egg': 1, 'flour': 2, 'milk': 3, 'butter': 4, 'saffron': 5}
+        recipes = {
+            10: [1, 2, 3],        # pancakes
+            20: [1, 2, 3, 4],     # crepes
+            30: [1],              # boiled egg
+            40: [2, 4, 5],        # saffron shortbread
+        }
+        pairs = [(ingredient_id, recipe_id) for recipe_id, ids in recipes.items() for ingredient_id in ids]
+        self.index = PantryIndex(names, [i for i, _ in pairs], [r for _, r in pairs])
+
+    def test_lookup(self):
+        """Test pantry items are normalized and unknown ones reported"""
+        self.assertEqual(self.index.lookup(["Eggs", "2 cups flour", "caviar"]), ([1, 2], ["caviar"]))
+
+    def test_ranks_fewest_missing_then_most_matched(self):
+        """Test recipes missing fewer ingredients come first"""
+        results = self.index.search([1, 2, 3])
+
+        self.assertEqual(results, [(10, 3, 0), (30, 1, 0), (20, 3, 1), (40, 1, 2)])
+
+    def test_max_missing_and_limit(self):
+        """Test max_missing filters and limit keeps the best ones"""
+        self.assertEqual(self.index.search([1, 2, 3], max_missing=0), [(10, 3, 0), (30, 1, 0)])
+        self.assertEqual(self.index.search([1, 2, 3], limit=1), [(10, 3, 0)])
+        self.assertEqual(self.index.search([99]), [])
+
+
+class IngredientIndexingTests(unittest.TestCase):
+    """Keeping recipe_ingredients in step with recipes, and the pantry search endpoints."""
+
+    def setUp(self):
+        self.ctx = app.app_context()
+        self.ctx.push()
+        db.drop_all()
+        db.create_all()
+        app.extensions.pop('pantry_index', None)
+
+        user = User(username="cook", email="cook@example.com", password="x")
+        db.session.add(user)
+        db.session.commit()
+        self.user_id = user.id
+
+    def tearDown(self):
+        app.extensions.pop('pantry_index', None)
+        db.session.remove()
+        db.drop_all()
+        self.ctx.pop()
+
+    def add_recipe(self, title, ingredients, **fields):
+        recipe = Recipe(title=title, ingredients=ingredients, instructions="Cook.", user_id=self.user_id, **fields)
+        db.session.add(recipe)
+        db.session.commit()
+        return recipe
+
+    def indexed(self, recipe_id):
+        return set(db.session.scalars(
+            db.select(Ingredient.name)
+            .join(RecipeIngredient, RecipeIngredient.ingredient_id == Ingredient.id)
+            .where(RecipeIngredient.recipe_id == recipe_id)
+        ))
+
+    def test_orm_writes_are_indexed(self):
+        """Test new, edited and deleted recipes update recipe_ingredients"""
+        recipe = self.add_recipe("Pancakes", "2 eggs\n1 cup flour\n1 cup milk")
+        self.assertEqual(self.indexed(recipe.id), {"egg", "flour", "milk"})
+
+        recipe.ingredients = "2 eggs\n1 cup flour\n2 tbsp butter"
+        db.session.commit()
+        self.assertEqual(self.indexed(recipe.id), {"egg", "flour", "butter"})
+
+        recipe.title = "Crepes"
+        db.session.commit()
+        self.assertEqual(self.indexed(recipe.id), {"egg", "flour", "butter"})
+
+        recipe_id = recipe.id
+        db.session.delete(recipe)
+        db.session.commit()
+        self.assertEqual(self.indexed(recipe_id), set())
+        self.assertEqual(db.session.scalar(db.select(db.func.count()).select_from(Ingredient)), 4)
+
+    def test_import_is_indexed(self):
+        """Test bulk imported recipes are indexed"""
+        records = [{'title': "Bread", 'ingredients': "flour, water, salt", 'instructions': "Bake."},
+                   {'title': "Brine", 'ingredients': "water, salt", 'instructions': "Stir."}]
+        import_recipes(io.StringIO(''.join(json.dumps(record) + '\n' for record in records)), self.user_id)
+
+        ids = {recipe.title: recipe.id for recipe in Recipe.query}
+        self.assertEqual(self.indexed(ids["Bread"]), {"flour", "water", "salt"})
+        self.assertEqual(self.indexed(ids["Brine"]), {"water", "salt"})
+
+    def test_pantry_search_endpoints(self):
+        """Test the JSON and HTML pantry search rank public recipes"""
+        pancakes = self.add_recipe("Pancakes", "eggs, flour, milk")
+        self.add_recipe("Crepes", "eggs, flour, milk, butter")
+        self.add_recipe("Secret Cake", "eggs, flour", is_public=False)
+
+        with app.test_client() as client:
+            resp = client.get('/recipes/pantry.json?items=Eggs,%20flour,%20milk,%20unobtainium')
+            self.assertEqual(resp.status_code, 200)
+            data = resp.get_json()
+            self.assertEqual(data['unknown'], ["unobtainium"])
+            self.assertEqual([(r['title'], r['matched'], r['missing']) for r in data['results']],
+                             [("Pancakes", 3, 0), ("Crepes", 3, 1)])
+            self.assertEqual(data['results'][0]['id'], pancakes.id)
+            self.assertEqual(data['results'][1]['coverage'], 0.75)
+
+            resp = client.get('/recipes/pantry.json?items=eggs,flour,milk&max_missing=0')
+            self.assertEqual([r['title'] for r in resp.get_json()['results']], ["Pancakes"])
+
+            resp = client.get('/recipes/pantry?items=eggs,flour,milk')
+            html = resp.get_data(as_text=True)
+            self.assertEqual(resp.status_code, 200)
+            self.assertIn("Pancakes", html)
+            self.assertIn("You have 3 of 4 ingredients", html)
+            self.assertNotIn("Secret Cake", html)
+
+    def test_failed_rebuild_backs_off(self):
+        """Test a failed background rebuild keeps the old index and isn't retried until the next interval"""
+        index = get_pantry_index()
+        index.built_at -= app.config['PANTRY_INDEX_REFRESH_SECONDS'] + 1
+
+        with mock.patch.object(ingredients, 'build_index', side_effect=RuntimeError("db down")) as build, \
+                mock.patch.object(ingredients.threading, 'Thread') as thread:
+            # Run the rebuild inline instead of on a thread
+            thread.side_effect = lambda target, args, **kwargs: mock.Mock(start=lambda: target(*args))
+            with self.assertLogs('ingredients', 'ERROR'):
+                self.assertIs(get_pantry_index(), index)
+            self.assertIs(get_pantry_index(), index)
+
+        self.assertEqual(build.call_count, 1)
+        self.assertAlmostEqual(index.built_at, time.monotonic(), delta=5)
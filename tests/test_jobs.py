@@ -0,0 +1,96 @@
+import os
+import unittest
+from datetime import timedelta
+from unittest import mock
+
+os.environ.setdefault('DATABASE_URL', 'postgresql:///food_friends_test')
+
+from app import app
+from models import db, Job
+import jobs
+from jobs import JobQueue, Worker, HANDLERS, PRIORITY_HIGH, PRIORITY_LOW, utcnow
+
+app.config['TESTING'] = True
+
+
+class JobQueueTests(unittest.TestCase):
+    """Leases, retries and priorities of the database-backed job queue."""
+
+    def setUp(self):
+        self.ctx = app.app_context()
+        self.ctx.push()
+        db.drop_all()
+        db.create_all()
+        self.queue = JobQueue(db.engine, lease_seconds=60, max_attempts=2)
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.ctx.pop()
+
+    def test_priority_order(self):
+        """Test higher priority jobs are dequeued first, then oldest first"""
+        low = self.queue.enqueue('noop', priority=PRIORITY_LOW)
+        first = self.queue.enqueue('noop')
+        second = self.queue.enqueue('noop')
+        high = self.queue.enqueue('noop', priority=PRIORITY_HIGH)
+
+        order = [self.queue.dequeue('w')['id'] for _ in range(4)]
+        self.assertEqual(order, [high, first, second, low])
+        self.assertIsNone(self.queue.dequeue('w'))
+
+    def test_delayed_jobs_wait(self):
+        """Test a job isn't handed out before its run_at"""
+        self.queue.enqueue('noop', delay=60)
+        self.assertIsNone(self.queue.dequeue('w'))
+
+    def test_retry_then_fail(self):
+        """Test a failing job is retried until max_attempts, then kept as failed"""
+        self.queue.enqueue('noop', {'x': 1})
+
+        job = self.queue.dequeue('w')
+        self.assertEqual(job['payload'], {'x': 1})
+        self.assertEqual(self.queue.fail(job, 'w', "boom"), 'retried')
+
+        # Make the retry due now instead of after its backoff
+        db.session.execute(db.update(Job).values(run_at=utcnow()))
+        db.session.commit()
+
+        job = self.queue.dequeue('w')
+        self.assertEqual(job['attempts'], 2)
+        self.assertEqual(self.queue.fail(job, 'w', "boom"), 'failed')
+        self.assertEqual(self.queue.depth()['failed'], 1)
+
+    def test_expired_lease_is_reclaimed(self):
+        """Test a job whose worker stopped renewing goes back to the queue for another worker"""
+        self.queue.enqueue('noop')
+        job = self.queue.dequeue('dead')
+
+        db.session.execute(db.update(Job).values(lease_expires_at=utcnow() - timedelta(seconds=1)))
+        db.session.commit()
+        self.assertEqual(self.queue.reclaim_expired(), 1)
+
+        retaken = self.queue.dequeue('alive')
+        self.assertEqual(retaken['id'], job['id'])
+        # The first worker lost its lease, so it can't complete the job any more
+        self.assertFalse(self.queue.complete(job, 'dead'))
+        self.assertTrue(self.queue.complete(retaken, 'alive'))
+        self.assertEqual(self.queue.depth()['running'], 0)
+
+    def test_worker_runs_handler(self):
+        """Test a worker runs the registered handler with the payload and deletes the job"""
+        calls = []
+        with mock.patch.dict(HANDLERS, {'record': lambda value: calls.append(value)}), \
+             mock.patch.object(jobs, 'get_queue', return_value=self.queue):
+            self.queue.enqueue('record', {'value': 42})
+            worker = Worker(app)
+            self.assertTrue(worker.run_once())
+            self.assertFalse(worker.run_once())
+
+        self.assertEqual(calls, [42])
+        self.assertEqual(self.queue.stats.as_dict()['completed'], 1)
+        self.assertEqual(Job.query.count(), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,155 @@
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import unittest
+
+os.environ.setdefault('DATABASE_URL', 'postgresql:///food_friends_test')
+
+from app import app
+from models import db
+from metrics import Counter, Gauge, Histogram, Registry, spoonacular_path_label
+from profiling import PROFILE_HEADER
+
+app.config['TESTING'] = True
+
+
+class MetricTypeTests(unittest.TestCase):
+    """Prometheus text rendering of the metric types."""
+
+    def test_histogram_buckets_are_cumulative(self):
+        """Test histogram buckets count every observation at or below their bound"""
+        histogram = Histogram('h', "Help.", ['route'], buckets=(0.1, 1))
+        for value in (0.05, 0.1, 0.5, 3):
+            histogram.observe(value, route='a')
+
+        self.assertEqual(histogram.render(), [
+            '# HELP h Help.',
+            '# TYPE h histogram',
+            'h_bucket{route="a",le="0.1"} 2',
+            'h_bucket{route="a",le="1"} 3',
+            'h_bucket{route="a",le="+Inf"} 4',
+            'h_sum{route="a"} 3.65',
+            'h_count{route="a"} 4',
+        ])
+
+    def test_counter_labels_are_escaped(self):
+        """Test label values are escaped"""
+        counter = Counter('c', "Help.", ['path'])
+        counter.inc(path='say "hi"')
+        self.assertEqual(counter.render()[-1], 'c{path="say \\"hi\\""} 1')
+
+    def test_spoonacular_ids_are_collapsed(self):
+        """Test recipe ids in Spoonacular paths don't become separate label values"""
+        self.assertEqual(spoonacular_path_label('/recipes/716429/information'), '/recipes/{id}/information')
+        self.assertEqual(spoonacular_path_label('/recipes/random'), '/recipes/random')
+
+
+class MultiprocessTests(unittest.TestCase):
+    """Merging the metrics that several processes saved to one directory."""
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.registry = Registry()
+        self.counter = self.registry.register(Counter('c', "Help.", ['path']))
+        self.histogram = self.registry.register(Histogram('h', "Help.", buckets=(1,)))
+        self.gauge = self.registry.register(Gauge('g', "Help."))
+        self.total = self.registry.register(Gauge('t', "Help.", multiprocess_mode='sum'))
+
+    def save(self, pid, **values):
+        data = {'c': [[['/a'], values['c']]], 'h': [[[], values['h']]], 'g': [[[], values['g']]],
+                't': [[[], values['t']]]}
+        with open(os.path.join(self.directory, f"{pid}_1.json"), 'w') as f:
+            json.dump(data, f)
+
+    def test_counters_are_summed_and_gauges_labelled(self):
+        """Test counters include exited processes, and gauges only live ones"""
+        exited = subprocess.Popen([sys.executable, '-c', 'pass'])
+        exited.wait()
+        self.save(exited.pid, c=5, h=[1, 0, 0.5], g=7, t=7)
+        self.save(os.getppid(), c=2, h=[0, 1, 3.0], g=2, t=2)
+        self.counter.inc(path='/a')
+        self.histogram.observe(0.25)
+        self.gauge.set(1)
+        self.total.set(1)
+        self.registry.write(os.path.join(self.directory, f"{os.getpid()}_2.json"))
+
+        lines = self.registry.render_multiprocess(self.directory).splitlines()
+
+        self.assertIn('c{path="/a"} 8', lines)
+        self.assertIn('h_bucket{le="1"} 2', lines)
+        self.assertIn('h_sum 3.75', lines)
+        self.assertIn('h_count 3', lines)
+        self.assertIn(f'g{{pid="{os.getpid()}"}} 1', lines)
+        self.assertIn(f'g{{pid="{os.getppid()}"}} 2', lines)
+        self.assertNotIn(f'g{{pid="{exited.pid}"}} 7', lines)
+        self.assertIn('t 3', lines)
+
+
+class InstrumentationTests(unittest.TestCase):
+    """Request, SQL and template metrics, the /metrics endpoint and the profiler header."""
+
+    def setUp(self):
+        with app.app_context():
+            db.drop_all()
+            db.create_all()
+        self.client = app.test_client()
+
+    def tearDown(self):
+        app.config['METRICS_TOKEN'] = None
+        app.config['PROFILER_TOKEN'] = None
+        with app.app_context():
+            db.session.remove()
+            db.drop_all()
+
+    def test_metrics_endpoint(self):
+        """Test requests are timed, their SQL counted, and their templates timed"""
+        self.client.get('/users')
+        body = self.client.get('/metrics').get_data(as_text=True)
+
+        self.assertIn('foodfriends_request_duration_seconds_count{endpoint="main.find_users",method="GET",status="200"}', body)
+        self.assertIn('foodfriends_request_db_queries_count{endpoint="main.find_users"}', body)
+        self.assertIn('foodfriends_template_render_seconds_count{template="/users/all_users.html"}', body)
+        self.assertIn('foodfriends_job_queue_depth{status="queued"} 0', body)
+
+    def test_metrics_token(self):
+        """Test /metrics requires the bearer token when one is configured"""
+        app.config['METRICS_TOKEN'] = 'secret'
+        self.assertEqual(self.client.get('/metrics').status_code, 401)
+        response = self.client.get('/metrics', headers={'Authorization': 'Bearer secret'})
+        self.assertEqual(response.status_code, 200)
+
+    def test_multiple_processes_need_a_directory(self):
+        """Test /metrics needs a shared directory to answer for one of several processes"""
+        response = self.client.get('/metrics', environ_overrides={'wsgi.multiprocess': True})
+        self.assertEqual(response.status_code, 503)
+
+        directory = tempfile.mkdtemp()
+        self.addCleanup(app.config.__setitem__, 'METRICS_MULTIPROC_DIR', None)
+        self.addCleanup(lambda: app.extensions.pop('metrics_writer').stop())
+        app.config['METRICS_MULTIPROC_DIR'] = directory
+        with open(os.path.join(directory, "1_1.json"), 'w') as f:
+            json.dump({'foodfriends_errors_total': [[["other"], 4]]}, f)
+
+        response = self.client.get('/metrics', environ_overrides={'wsgi.multiprocess': True})
+        body = response.get_data(as_text=True)
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('foodfriends_errors_total{source="other"} 4', body)
+        self.assertIn('foodfriends_job_queue_depth{status="queued"} 0', body)
+        self.assertEqual(len(os.listdir(directory)), 2)
+
+    def test_profiler_header(self):
+        """Test only requests with the right token are profiled"""
+        app.config['PROFILER_TOKEN'] = 'secret'
+        app.config['PROFILER_DIR'] = tempfile.mkdtemp()
+
+        self.assertNotIn('X-Profile-File', self.client.get('/users', headers={PROFILE_HEADER: 'wrong'}).headers)
+
+        response = self.client.get('/users', headers={PROFILE_HEADER: 'secret'})
+        path = os.path.join(app.config['PROFILER_DIR'], response.headers['X-Profile-File'])
+        self.assertTrue(os.path.exists(path))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,105 @@
+import os
+import threading
+import unittest
+
+import bcrypt
+
+os.environ.setdefault('DATABASE_URL', 'postgresql:///food_friends_test')
+
+from app import app
+from models import db, User
+from passwords import MAX_ROUNDS, MIN_ROUNDS, PasswordHasher, PasswordHashingBusy, calibrate, cost_of, \
+    get_password_hasher
+
+app.config['TESTING'] = True
+app.config['WTF_CSRF_ENABLED'] = False
+
+
+class PasswordHasherTests(unittest.TestCase):
+    """Hashing on the bounded pool, cost calibration and rehash checks."""
+
+    def test_hash_and_check(self):
+        """Test hashes use the configured cost and only match their password"""
+        hasher = PasswordHasher(rounds=4, max_workers=1, max_queue=1)
+        hashed = hasher.hash("secret")
+
+        self.assertEqual(cost_of(hashed), 4)
+        self.assertTrue(hasher.check(hashed, "secret"))
+        self.assertFalse(hasher.check(hashed, "wrong"))
+        self.assertFalse(hasher.check("not a hash", "secret"))
+
+    def test_needs_rehash(self):
+        """Test only hashes below the current cost need upgrading"""
+        hasher = PasswordHasher(rounds=5, max_workers=1, max_queue=1)
+        self.assertTrue(hasher.needs_rehash(bcrypt.hashpw(b"pw", bcrypt.gensalt(4)).decode()))
+        self.assertFalse(hasher.needs_rehash(bcrypt.hashpw(b"pw", bcrypt.gensalt(5)).decode()))
+        self.assertFalse(hasher.needs_rehash("not a hash"))
+
+    def test_turns_work_away_when_saturated(self):
+        """Test hashing fails fast once every slot is running or queued"""
+        hasher = PasswordHasher(rounds=4, max_workers=1, max_queue=0)
+        release = threading.Event()
+        thread = threading.Thread(target=hasher._run, args=(release.wait,))
+        thread.start()
+        try:
+            while hasher.in_flight == 0:
+                release.wait(0.01)
+            with self.assertRaises(PasswordHashingBusy):
+                hasher.hash("secret")
+        finally:
+            release.set()
+            thread.join()
+        self.assertEqual(hasher.in_flight, 0)
+
+    def test_calibrate_bounds(self):
+        """Test calibration stays within MIN_ROUNDS..MAX_ROUNDS"""
+        self.assertEqual(calibrate(target_ms=0.001), MIN_ROUNDS)
+        self.assertEqual(calibrate(target_ms=10 ** 9), MAX_ROUNDS)
+
+
+class LoginRehashTests(unittest.TestCase):
+    """Logins upgrade old hashes and back off when hashing is saturated."""
+
+    def setUp(self):
+        self.ctx = app.app_context()
+        self.ctx.push()
+        db.drop_all()
+        db.create_all()
+        app.config['BCRYPT_LOG_ROUNDS'] = 5
+        app.extensions.pop('password_hasher', None)
+
+        weak = bcrypt.hashpw(b"secret1", bcrypt.gensalt(4)).decode()
+        db.session.add(User(username="cook", email="cook@example.com", password=weak))
+        db.session.commit()
+        self.client = app.test_client()
+
+    def tearDown(self):
+        app.extensions.pop('password_hasher', None)
+        app.config['BCRYPT_LOG_ROUNDS'] = int(os.environ.get('BCRYPT_LOG_ROUNDS', 0)) or None
+        db.session.remove()
+        db.drop_all()
+        self.ctx.pop()
+
+    def login(self, password):
+        return self.client.post("/login", data={"username": "cook", "password": password})
+
+    def test_login_upgrades_hash(self):
+        """Test a successful login re-hashes a password stored at a lower cost"""
+        self.assertEqual(self.login("secret1").status_code, 302)
+        db.session.expire_all()
+        user = db.session.query(User).filter_by(username="cook").one()
+        self.assertEqual(cost_of(user.password), 5)
+        self.assertTrue(get_password_hasher().check(user.password, "secret1"))
+
+    def test_failed_login_keeps_hash(self):
+        """Test a wrong password leaves the stored hash alone"""
+        self.assertEqual(self.login("wrong12").status_code, 200)
+        db.session.expire_all()
+        self.assertEqual(cost_of(db.session.query(User.password).scalar()), 4)
+
+    def test_busy(self):
+        """Test logins get a 503 with the form when hashing is saturated"""
+        get_password_hasher().max_in_flight = 0
+        response = self.login("secret1")
+        self.assertEqual(response.status_code, 503)
+        self.assertIn("try again in a moment", response.get_data(as_text=True))
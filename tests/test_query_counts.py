@@ -0,0 +1,81 @@
+import os
+import unittest
+
+os.environ.setdefault('DATABASE_URL', 'postgresql:///food_friends_test')
+
+from app import app, CURR_USER_KEY
+from models import db, User, Recipe, Favorite, Friend
+from current_user import get_user_cache
+from query_counter import count_queries
+
+app.config['TESTING'] = True
+app.config['WTF_CSRF_ENABLED'] = False
+
+
+class QueryCountTests(unittest.TestCase):
+    """The profile and favorites pages must not issue more queries as data grows."""
+
+    def setUp(self):
+        with app.app_context():
+            db.drop_all()
+            db.create_all()
+
+            user = User.signup(username="owner", email="owner@example.com",
+                               password="password", image_url=None)
+            db.session.commit()
+            self.user_id = user.id
+
+        self.client = app.test_client()
+        with self.client.session_transaction() as sess:
+            sess[CURR_USER_KEY] = self.user_id
+
+    def tearDown(self):
+        with app.app_context():
+            db.session.remove()
+            db.drop_all()
+
+    def add_data(self, start, count):
+        """Give the owner `count` more favorites and pending friend requests."""
+        with app.app_context():
+            for i in range(start, start + count):
+                sender = User(username=f"sender{i}", email=f"sender{i}@example.com", password="x")
+                recipe = Recipe(title=f"Recipe {i}", ingredients="salt", instructions="Cook.",
+                                user_id=self.user_id)
+                db.session.add_all([sender, recipe])
+                db.session.flush()
+
+                db.session.add(Favorite(user_id=self.user_id, recipe_id=recipe.id))
+                db.session.add(Friend(user_id=sender.id, friend_id=self.user_id, status='pending'))
+
+            db.session.commit()
+
+    def query_count(self, url):
+        with app.app_context():
+            # Start every measured request from the same cold g.user cache
+            get_user_cache().clear()
+            with count_queries(db.engine) as counter:
+                response = self.client.get(url)
+
+        self.assertEqual(response.status_code, 200)
+        return counter.count
+
+    def assert_constant_queries(self, url):
+        self.add_data(0, 2)
+        small = self.query_count(url)
+
+        self.add_data(2, 10)
+        large = self.query_count(url)
+
+        self.assertEqual(small, large, f"{url} ran {small} queries with 2 rows but {large} with 12")
+
+    def test_user_homepage(self):
+        """Test the profile page runs the same number of queries regardless of data size"""
+        self.assert_constant_queries(f"/users/{self.user_id}")
+
+    def test_user_favorites(self):
+        """Test the favorites page runs the same number of queries regardless of data size"""
+        self.assert_constant_queries(f"/users/{self.user_id}/favorites")
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,130 @@
+import os
+import unittest
+from unittest import mock
+
+import requests
+from sqlalchemy.exc import OperationalError
+
+os.environ.setdefault('DATABASE_URL', 'postgresql:///food_friends_test')
+
+from app import app, CURR_USER_KEY
+from models import db, User, Recipe
+from random_pool import RandomRecipePool, get_random_pool
+
+app.config['TESTING'] = True
+
+
+def make_recipes(start, count):
+    return [{"spoonacular_id": i, "title": f"Recipe {i}", "image": f"https://img.example.com/{i}.jpg",
+             "source_url": None, "instructions": ["Cook."], "ingredients": ["salt"]}
+            for i in range(start, start + count)]
+
+
+class RandomRecipePoolTests(unittest.TestCase):
+    """Handing out pooled recipes without repeats."""
+
+    def setUp(self):
+        self.pool = RandomRecipePool(app, low_water=0, max_serves=2)
+        self.pool.add(make_recipes(1, 9))
+
+    def ids(self, recipes):
+        return {recipe['spoonacular_id'] for recipe in recipes}
+
+    def test_no_repeats_per_user(self):
+        """Test a user isn't shown the same recipe twice until they've seen them all"""
+        shown = [self.ids(self.pool.take(1, 3)) for _ in range(3)]
+        self.assertEqual(set.union(*shown), set(range(1, 10)))
+        self.assertEqual(sum(len(ids) for ids in shown), 9)
+
+    def test_serve_budget(self):
+        """Test a recipe is dropped once it has been served max_serves times"""
+        pool = RandomRecipePool(app, low_water=0, max_serves=1)
+        pool.add(make_recipes(1, 9))
+        for user_id in range(1, 4):
+            pool.take(user_id, 3)
+        self.assertEqual(len(pool), 0)
+        self.assertEqual(pool.take(4, 3), [])
+        self.assertEqual(pool.stats.evictions, 9)
+
+    def test_starts_over_when_everything_seen(self):
+        """Test a user who has seen every pooled recipe still gets a full set"""
+        pool = RandomRecipePool(app, low_water=0, max_serves=100)
+        pool.add(make_recipes(1, 4))
+        pool.take(1, 3)
+        self.assertEqual(len(pool.take(1, 3)), 3)
+
+
+class HomepagePoolTests(unittest.TestCase):
+    """The homepage takes recipes from the pool and refills it in the background."""
+
+    def setUp(self):
+        self.ctx = app.app_context()
+        self.ctx.push()
+        db.drop_all()
+        db.create_all()
+        app.extensions.pop('random_pool', None)
+
+        user = User(username="cook", email="cook@example.com", password="x")
+        db.session.add(user)
+        db.session.commit()
+
+        self.client = app.test_client()
+        with self.client.session_transaction() as sess:
+            sess[CURR_USER_KEY] = user.id
+
+    def tearDown(self):
+        get_random_pool().wait()
+        app.extensions.pop('random_pool', None)
+        db.session.remove()
+        db.drop_all()
+        self.ctx.pop()
+
+    def test_refills_in_background(self):
+        """Test an empty pool renders right away and is filled, and stored, off the request"""
+        with mock.patch.object(Recipe, 'fetch_random_recipes', return_value=make_recipes(1, 100)) as fetch:
+            response = self.client.get("/")
+            self.assertEqual(response.status_code, 200)
+            self.assertIn("Fresh recipe picks are on their way", response.get_data(as_text=True))
+
+            get_random_pool().wait()
+            fetch.assert_called_once_with(100)
+            self.assertEqual(db.session.query(Recipe).filter(Recipe.spoonacular_id.isnot(None)).count(), 100)
+
+            html = self.client.get("/").get_data(as_text=True)
+            self.assertEqual(html.count("/recipes/spoonacular/"), 3)
+            fetch.assert_called_once()
+
+    def test_failed_refill_backs_off(self):
+        """Test a failed fetch leaves the page working and isn't retried on the next view"""
+        error = requests.ConnectionError("down")
+        with mock.patch.object(Recipe, 'fetch_random_recipes', side_effect=error) as fetch:
+            self.client.get("/")
+            get_random_pool().wait()
+            response = self.client.get("/")
+            get_random_pool().wait()
+
+        self.assertEqual(response.status_code, 200)
+        fetch.assert_called_once()
+
+    def test_any_refill_error_backs_off(self):
+        """Test errors other than request failures (e.g. no API key) also stop a refill on every view"""
+        with mock.patch.object(Recipe, 'fetch_random_recipes', side_effect=ValueError("no API key")) as fetch:
+            for _ in range(3):
+                self.assertEqual(self.client.get("/").status_code, 200)
+                get_random_pool().wait()
+
+        fetch.assert_called_once()
+
+    def test_failed_store_still_fills_pool(self):
+        """Test a batch that can't be written through is still served rather than fetched again"""
+        with mock.patch.object(Recipe, 'fetch_random_recipes', return_value=make_recipes(1, 100)) as fetch, \
+                mock.patch.object(Recipe, 'save_spoonacular_recipes', side_effect=OperationalError("INSERT", {}, None)):
+            self.client.get("/")
+            get_random_pool().wait()
+            html = self.client.get("/").get_data(as_text=True)
+            get_random_pool().wait()
+
+        self.assertEqual(html.count("/recipes/spoonacular/"), 3)
+        self.assertEqual(len(get_random_pool()), 100)
+        fetch.assert_called_once()
+
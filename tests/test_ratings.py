@@ -0,0 +1,116 @@
+import os
+import unittest
+
+os.environ.setdefault('DATABASE_URL', 'postgresql:///food_friends_test')
+
+from app import app, CURR_USER_KEY
+from models import db, User, Recipe, Rating, RecipeRating, Activity, RATING_PRIOR_COUNT, RATING_PRIOR_MEAN
+
+app.config['TESTING'] = True
+app.config['WTF_CSRF_ENABLED'] = False
+
+
+class RatingTests(unittest.TestCase):
+    """Ratings and the RecipeRating rollups maintained alongside them."""
+
+    def setUp(self):
+        self.ctx = app.app_context()
+        self.ctx.push()
+        db.drop_all()
+        db.create_all()
+
+        users = [User(username=f"user{i}", email=f"user{i}@example.com", password="x") for i in range(3)]
+        db.session.add_all(users)
+        db.session.flush()
+        recipes = [Recipe(title=f"Recipe {i}", ingredients="a", instructions="b", user_id=users[0].id)
+                   for i in range(3)]
+        db.session.add_all(recipes)
+        db.session.commit()
+        self.user_ids = [user.id for user in users]
+        self.recipe_ids = [recipe.id for recipe in recipes]
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.ctx.pop()
+
+    def assert_rollup_matches(self, recipe_id):
+        ratings = [rating.rating for rating in Rating.query.filter_by(recipe_id=recipe_id)]
+        summary = db.session.get(RecipeRating, recipe_id)
+        self.assertEqual(summary.rating_count, len(ratings))
+        self.assertEqual(summary.rating_sum, sum(ratings))
+        self.assertEqual(summary.histogram, {stars: ratings.count(stars) for stars in range(1, 6)})
+        self.assertAlmostEqual(summary.score, (sum(ratings) + RATING_PRIOR_MEAN * RATING_PRIOR_COUNT)
+                               / (len(ratings) + RATING_PRIOR_COUNT))
+
+    def test_rate_rerate_and_unrate(self):
+        """Test the rollup follows new, changed and removed ratings"""
+        recipe_id = self.recipe_ids[0]
+        Rating.rate(self.user_ids[0], recipe_id, 5)
+        Rating.rate(self.user_ids[1], recipe_id, 3, "Fine")
+        db.session.commit()
+        self.assert_rollup_matches(recipe_id)
+        self.assertEqual(db.session.get(RecipeRating, recipe_id).average, 4)
+
+        Rating.rate(self.user_ids[1], recipe_id, 1)
+        db.session.commit()
+        self.assertEqual(Rating.query.filter_by(recipe_id=recipe_id).count(), 2)
+        self.assert_rollup_matches(recipe_id)
+
+        self.assertTrue(Rating.unrate(self.user_ids[0], recipe_id))
+        self.assertFalse(Rating.unrate(self.user_ids[2], recipe_id))
+        db.session.commit()
+        self.assert_rollup_matches(recipe_id)
+
+    def test_top_rated(self):
+        """Test top rated orders by damped score and skips private and unrated recipes"""
+        one_five, many_fours, private = self.recipe_ids
+        Rating.rate(self.user_ids[0], one_five, 5)
+        for user_id in self.user_ids:
+            Rating.rate(user_id, many_fours, 4)
+            Rating.rate(user_id, private, 5)
+        db.session.get(Recipe, private).is_public = False
+        Rating.unrate(self.user_ids[0], one_five)
+        db.session.commit()
+
+        self.assertEqual([recipe.id for recipe, _ in RecipeRating.top_rated()], [many_fours])
+
+        Rating.rate(self.user_ids[0], one_five, 5)
+        db.session.commit()
+        self.assertEqual([recipe.id for recipe, _ in RecipeRating.top_rated()], [many_fours, one_five])
+
+    def test_backfill_matches_maintained_rollups(self):
+        """Test rebuilding from the ratings table gives the same rollups"""
+        for n, user_id in enumerate(self.user_ids):
+            Rating.rate(user_id, self.recipe_ids[0], n + 2)
+            Rating.rate(user_id, self.recipe_ids[1], 5)
+        db.session.commit()
+        maintained = [(r.recipe_id, r.rating_count, r.histogram, r.average, r.score)
+                      for r in RecipeRating.query.order_by(RecipeRating.recipe_id)]
+
+        self.assertEqual(RecipeRating.backfill(), 2)
+        db.session.commit()
+        db.session.expire_all()
+        rebuilt = [(r.recipe_id, r.rating_count, r.histogram, r.average, r.score)
+                   for r in RecipeRating.query.order_by(RecipeRating.recipe_id)]
+        self.assertEqual(rebuilt, maintained)
+
+    def test_rate_view(self):
+        """Test the rate route stores the rating, updates the rollup and records one activity"""
+        recipe_id = self.recipe_ids[0]
+        with app.test_client() as client:
+            with client.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.user_ids[1]
+
+            client.post(f"/recipes/{recipe_id}/rate", data={'rating': 2})
+            resp = client.post(f"/recipes/{recipe_id}/rate", data={'rating': 4, 'review': "Tasty"},
+                               follow_redirects=True)
+
+        self.assertEqual(resp.status_code, 200)
+        self.assertIn(b"Tasty", resp.data)
+        self.assertEqual(db.session.get(RecipeRating, recipe_id).rating_count, 1)
+        self.assertEqual([activity.rating for activity in Activity.query.filter_by(verb='rating')], [4])
+
+
+if __name__ == '__main__':
+    unittest.main()
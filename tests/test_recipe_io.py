@@ -0,0 +1,144 @@
+import io
+import json
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+os.environ.setdefault('DATABASE_URL', 'postgresql:///food_friends_test')
+
+from app import app, CURR_USER_KEY
+from models import db, User, Recipe, Favorite, Job
+from recipe_io import import_recipes, export_recipes, export_favorites, RECIPE_EXPORT_FIELDS
+import jobs
+
+app.config['TESTING'] = True
+app.config['WTF_CSRF_ENABLED'] = False
+
+
+def recipe(n, **fields):
+    return {'title': f"Recipe {n}", 'ingredients': "flour, water", 'instructions': "Mix. Bake.", **fields}
+
+
+class RecipeImportExportTests(unittest.TestCase):
+    """Streaming recipe import and export."""
+
+    def setUp(self):
+        self.ctx = app.app_context()
+        self.ctx.push()
+        db.drop_all()
+        db.create_all()
+
+        user = User(username="importer", email="importer@example.com", password="x")
+        db.session.add(user)
+        db.session.commit()
+        self.user_id = user.id
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.ctx.pop()
+
+    def jsonl(self, records):
+        return io.StringIO(''.join(json.dumps(record) + '\n' for record in records))
+
+    def test_jsonl_import_validates_and_batches(self):
+        """Test valid rows are inserted in batches and invalid ones reported by line"""
+        records = [recipe(n) for n in range(7)]
+        records[2] = {'title': "No ingredients", 'instructions': "?"}
+        records[4] = recipe(4, image_url="not a url", is_public=False)
+        stream = self.jsonl(records)
+        stream = io.StringIO(stream.getvalue() + "not json\n")
+
+        result = import_recipes(stream, self.user_id, batch_size=2)
+
+        self.assertEqual(result.imported, 5)
+        self.assertEqual([line for line, _ in result.errors], [3, 5, 8])
+        self.assertIn('ingredients', result.errors[0][1])
+        self.assertIn('image_url', result.errors[1][1])
+        self.assertEqual(Recipe.query.filter_by(user_id=self.user_id).count(), 5)
+
+    def test_csv_import(self):
+        """Test CSV rows are imported, with is_public read from text"""
+        stream = io.StringIO("title,ingredients,instructions,is_public\n"
+                             "Soup,\"water, salt\",Boil.,no\n"
+                             "Bread,flour,Bake.,\n")
+
+        result = import_recipes(stream, self.user_id, format='csv')
+
+        self.assertEqual(result.imported, 2)
+        self.assertEqual({r.title: r.is_public for r in Recipe.query}, {'Soup': False, 'Bread': True})
+        self.assertEqual(Recipe.query.filter_by(title="Soup").one().ingredients, "water, salt")
+
+    def test_export_round_trip(self):
+        """Test an exported file imports back to the same recipes"""
+        import_recipes(self.jsonl([recipe(n, is_public=n % 2 == 0) for n in range(3)]), self.user_id)
+
+        for format in ('jsonl', 'csv'):
+            exported = ''.join(export_recipes(self.user_id, format))
+            other = User(username=f"other-{format}", email=f"{format}@example.com", password="x")
+            db.session.add(other)
+            db.session.commit()
+
+            result = import_recipes(io.StringIO(exported), other.id, format)
+
+            self.assertEqual(result.imported, 3)
+            self.assertEqual(
+                [(r.title, r.is_public) for r in Recipe.query.filter_by(user_id=other.id).order_by(Recipe.id)],
+                [(r.title, r.is_public) for r in Recipe.query.filter_by(user_id=self.user_id).order_by(Recipe.id)])
+
+    def test_empty_csv_export_has_header(self):
+        """Test exporting nothing still gives a CSV header row"""
+        self.assertEqual(''.join(export_recipes(self.user_id, 'csv')).strip(), ','.join(RECIPE_EXPORT_FIELDS))
+        self.assertEqual(''.join(export_recipes(self.user_id, 'jsonl')), '')
+
+    def test_failed_import_job_removes_upload(self):
+        """Test an import job that fails still deletes its uploaded file"""
+        with tempfile.NamedTemporaryFile('w', suffix='.jsonl', delete=False) as upload:
+            upload.write(json.dumps(recipe(1)) + '\n')
+
+        with mock.patch('jobs.import_recipe_stream', side_effect=OSError("disk full")):
+            with self.assertRaises(OSError):
+                jobs.HANDLERS['import_recipes'](path=upload.name, user_id=self.user_id, format='jsonl')
+
+        self.assertFalse(os.path.exists(upload.name))
+
+    def test_export_favorites(self):
+        """Test favorites export with local and Spoonacular recipe titles"""
+        import_recipes(self.jsonl([recipe(1)]), self.user_id)
+        db.session.add(Recipe(spoonacular_id=99, title="Remote", ingredients="a", instructions="b"))
+        db.session.add_all([Favorite(user_id=self.user_id, recipe_id=Recipe.query.filter_by(title="Recipe 1").one().id),
+                            Favorite(user_id=self.user_id, spoonacular_id=99),
+                            Favorite(user_id=self.user_id, spoonacular_id=100)])
+        db.session.commit()
+
+        rows = [json.loads(line) for line in export_favorites(self.user_id)]
+        self.assertEqual([row['title'] for row in rows], ["Recipe 1", "Remote", None])
+
+    def test_upload(self):
+        """Test a small upload is imported inline and a large one is queued for a worker"""
+        body = ''.join(json.dumps(recipe(n)) + '\n' for n in range(3)).encode()
+
+        with app.test_client() as client, tempfile.TemporaryDirectory() as directory:
+            with client.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.user_id
+
+            resp = client.post('/recipes/import', data={'file': (io.BytesIO(body), 'recipes.jsonl')},
+                               follow_redirects=True)
+            self.assertIn(b"Imported 3 recipes.", resp.data)
+
+            app.config.update(IMPORT_INLINE_MAX_BYTES=0, IMPORT_DIR=directory)
+            try:
+                client.post('/recipes/import', data={'file': (io.BytesIO(body), 'recipes.jsonl')})
+            finally:
+                app.config.update(IMPORT_INLINE_MAX_BYTES=5 * 1024 * 1024)
+
+            job = Job.query.filter_by(name='import_recipes').one()
+            jobs.HANDLERS['import_recipes'](**json.loads(job.payload))
+            self.assertEqual(os.listdir(directory), [])
+
+        self.assertEqual(Recipe.query.filter_by(user_id=self.user_id).count(), 6)
+
+
+if __name__ == '__main__':
+    unittest.main()
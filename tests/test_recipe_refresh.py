@@ -0,0 +1,94 @@
+import json
+import os
+import unittest
+from datetime import datetime
+from unittest import mock
+
+import requests
+
+os.environ.setdefault('DATABASE_URL', 'postgresql:///food_friends_test')
+
+from app import app
+from models import db, Recipe
+import jobs
+
+app.config['TESTING'] = True
+
+
+class FakeSpoonacular:
+    """Answers informationBulk, failing every request that includes a `down` ID."""
+
+    def __init__(self):
+        self.down = set()
+        self.gone = set()
+
+    def get(self, path, params=None):
+        ids = [int(recipe_id) for recipe_id in params['ids'].split(',')]
+        if self.down & set(ids):
+            raise requests.ConnectionError("down")
+        response = requests.Response()
+        response.status_code = 200
+        response._content = json.dumps([{'id': recipe_id, 'title': f"Fresh {recipe_id}"}
+                                        for recipe_id in ids if recipe_id not in self.gone]).encode()
+        return response
+
+
+class RefreshStaleRecipesTests(unittest.TestCase):
+    """Refreshing local copies of Spoonacular recipes."""
+
+    def setUp(self):
+        self.ctx = app.app_context()
+        self.ctx.push()
+        db.drop_all()
+        db.create_all()
+
+        db.session.add_all([Recipe(spoonacular_id=i, title=f"Stale {i}", ingredients="", instructions="",
+                                   fetched_at=datetime(2020, 1, 1)) for i in range(1, 7)])
+        db.session.commit()
+        self.cutoff = datetime(2021, 1, 1)
+
+        # Three IDs per informationBulk request, so one batch of six is two chunks
+        self.spoonacular = FakeSpoonacular()
+        fetch = Recipe._fetch_recipes_by_ids
+        mock.patch('models.get_client', return_value=self.spoonacular).start()
+        mock.patch.object(Recipe, '_fetch_recipes_by_ids',
+                          side_effect=lambda ids, refresh=False: fetch(ids, chunk_size=3, refresh=refresh)).start()
+        self.addCleanup(mock.patch.stopall)
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.ctx.pop()
+
+    def stale_ids(self):
+        return sorted(recipe.spoonacular_id for recipe in Recipe.query.filter(Recipe.fetched_at < self.cutoff))
+
+    def test_outage_leaves_rows_stale(self):
+        """Test a batch that got no answers marks nothing fresh and reports no progress"""
+        self.spoonacular.down = {1, 4}
+
+        self.assertEqual(Recipe.refresh_stale_spoonacular_recipes(self.cutoff, batch_size=6), 0)
+        self.assertEqual(self.stale_ids(), [1, 2, 3, 4, 5, 6])
+
+    def test_only_answered_chunks_are_marked(self):
+        """Test rows in a failed chunk stay stale, while answered ones (including upstream misses) are done"""
+        self.spoonacular.down = {5}
+        self.spoonacular.gone = {2}
+
+        self.assertEqual(Recipe.refresh_stale_spoonacular_recipes(self.cutoff, batch_size=6), 3)
+        self.assertEqual(self.stale_ids(), [4, 5, 6])
+        self.assertEqual(Recipe.query.filter_by(spoonacular_id=1).one().title, "Fresh 1")
+        self.assertEqual(Recipe.query.filter_by(spoonacular_id=2).one().title, "Stale 2")
+
+    def test_job_stops_without_progress(self):
+        """Test the refresh job re-enqueues itself after progress, but not during an outage"""
+        self.spoonacular.down = {1, 4}
+        with mock.patch('jobs.enqueue') as enqueue:
+            jobs.HANDLERS['refresh_recipes'](cutoff=self.cutoff.isoformat(), batch_size=6)
+        enqueue.assert_not_called()
+
+        self.spoonacular.down = {6}
+        with mock.patch('jobs.enqueue') as enqueue:
+            jobs.HANDLERS['refresh_recipes'](cutoff=self.cutoff.isoformat(), batch_size=6)
+        enqueue.assert_called_once()
+        self.assertEqual(self.stale_ids(), [4, 5, 6])
@@ -0,0 +1,92 @@
+import os
+import unittest
+from unittest import mock
+
+os.environ.setdefault('DATABASE_URL', 'postgresql:///food_friends_test')
+
+from app import app
+from models import db, User, Recipe
+
+app.config['TESTING'] = True
+app.config['WTF_CSRF_ENABLED'] = False
+
+
+class LocalSearchTests(unittest.TestCase):
+    """Full-text search over users' public recipes, and the /search route."""
+
+    def setUp(self):
+        self.ctx = app.app_context()
+        self.ctx.push()
+        db.drop_all()
+        db.create_all()
+
+        user = User(username="cook", email="cook@example.com", password="x")
+        db.session.add(user)
+        db.session.flush()
+        db.session.add_all([
+            Recipe(title="Chicken Soup", ingredients="chicken\nwater", instructions="Simmer.", user_id=user.id),
+            Recipe(title="Roast Dinner", ingredients="chicken\npotatoes", instructions="Roast.", user_id=user.id),
+            Recipe(title="Lentil Stew", ingredients="lentils", instructions="Stir in the chicken stock.",
+                   user_id=user.id),
+            Recipe(title="Secret Chicken", ingredients="chicken", instructions="Fry.", user_id=user.id,
+                   is_public=False),
+            Recipe(title="Spoonacular Chicken", ingredients="chicken", instructions="Bake.", spoonacular_id=99),
+            Recipe(title="Tofu Bowl", ingredients="tofu\nrice", instructions="Steam.", user_id=user.id),
+        ])
+        db.session.commit()
+
+        self.spoonacular = mock.patch.object(Recipe, 'search_recipes', return_value=[]).start()
+        self.addCleanup(mock.patch.stopall)
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.ctx.pop()
+
+    def test_search_local_matches_public_user_recipes(self):
+        """Test only public user-created recipes match, title matches first on Postgres"""
+        recipes, has_next = Recipe.search_local("chicken")
+
+        titles = [recipe.title for recipe in recipes]
+        self.assertEqual(sorted(titles), ["Chicken Soup", "Lentil Stew", "Roast Dinner"])
+        if db.engine.dialect.name == 'postgresql':
+            self.assertEqual(titles[0], "Chicken Soup")
+        self.assertFalse(has_next)
+        self.assertEqual(Recipe.search_local("quinoa"), ([], False))
+
+    def test_search_local_pages(self):
+        """Test pages don't overlap and has_next is set on all but the last"""
+        first, first_has_next = Recipe.search_local("chicken", page=1, per_page=2)
+        second, second_has_next = Recipe.search_local("chicken", page=2, per_page=2)
+
+        self.assertEqual((len(first), first_has_next), (2, True))
+        self.assertEqual((len(second), second_has_next), (1, False))
+        self.assertFalse({recipe.id for recipe in first} & {recipe.id for recipe in second})
+
+    def test_search_route(self):
+        """Test /search lists local results and only calls Spoonacular on a thin first page"""
+        self.addCleanup(app.config.__setitem__, 'SEARCH_MIN_LOCAL_RESULTS', app.config['SEARCH_MIN_LOCAL_RESULTS'])
+        app.config['SEARCH_MIN_LOCAL_RESULTS'] = 6
+
+        with app.test_client() as client:
+            resp = client.get('/search?query=chicken')
+            html = resp.get_data(as_text=True)
+            self.assertEqual(resp.status_code, 200)
+            self.assertIn("Chicken Soup", html)
+            self.assertNotIn("Secret Chicken", html)
+            self.spoonacular.assert_called_once_with("chicken")
+
+            resp = client.get('/search?query=chicken&page=2')
+            self.assertEqual(resp.status_code, 200)
+            self.assertNotIn("Chicken Soup", resp.get_data(as_text=True))
+            self.spoonacular.assert_called_once()
+
+    def test_search_route_clamps_page(self):
+        """Test zero and negative pages show the first page instead of failing"""
+        with app.test_client() as client, \
+                mock.patch.object(Recipe, 'search_local', wraps=Recipe.search_local) as search_local:
+            for page in (0, -3):
+                resp = client.get(f'/search?query=chicken&page={page}')
+                self.assertEqual(resp.status_code, 200)
+                self.assertIn("Chicken Soup", resp.get_data(as_text=True))
+                search_local.assert_called_with("chicken", page=1)
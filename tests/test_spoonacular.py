@@ -0,0 +1,102 @@
+import unittest
+from unittest import mock
+
+import requests
+
+from spoonacular import CircuitBreaker, CircuitOpenError, SpoonacularClient
+
+
+def make_response(status_code, headers=None):
+    response = requests.Response()
+    response.status_code = status_code
+    response.headers.update(headers or {})
+    return response
+
+
+class SpoonacularClientTests(unittest.TestCase):
+    def setUp(self):
+        self.client = SpoonacularClient("test-key", base_url="http://spoonacular.test",
+                                        max_retries=2, backoff_base=0)
+        self.sleep = mock.patch("spoonacular.time.sleep").start()
+        self.addCleanup(mock.patch.stopall)
+
+    def test_sends_api_key_and_timeout(self):
+        """Test every request carries the API key and a timeout"""
+        with mock.patch.object(self.client.session, "get", return_value=make_response(200)) as get:
+            self.client.get("/recipes/random", params={"number": 3})
+
+        get.assert_called_once_with("http://spoonacular.test/recipes/random",
+                                    params={"number": 3, "apiKey": "test-key"},
+                                    timeout=self.client.timeout)
+
+    def test_retries_server_errors(self):
+        """Test 5xx responses are retried until one succeeds"""
+        responses = [make_response(503), make_response(502), make_response(200)]
+        with mock.patch.object(self.client.session, "get", side_effect=responses) as get:
+            response = self.client.get("/recipes/1/information")
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(get.call_count, 3)
+
+    def test_does_not_retry_not_found(self):
+        """Test a 404 is returned straight away"""
+        with mock.patch.object(self.client.session, "get", return_value=make_response(404)) as get:
+            response = self.client.get("/recipes/1/information")
+
+        self.assertEqual(response.status_code, 404)
+        self.assertEqual(get.call_count, 1)
+
+    def test_honours_retry_after(self):
+        """Test a 429 waits for the Retry-After header"""
+        responses = [make_response(429, {"Retry-After": "2"}), make_response(200)]
+        with mock.patch.object(self.client.session, "get", side_effect=responses):
+            self.client.get("/recipes/random")
+
+        self.sleep.assert_called_once_with(2.0)
+
+    def test_circuit_opens_after_failures(self):
+        """Test the client fails fast once upstream keeps failing"""
+        self.client.breaker = CircuitBreaker(failure_threshold=2, reset_timeout=60)
+        with mock.patch.object(self.client.session, "get",
+                               side_effect=requests.ConnectionError("down")) as get:
+            for _ in range(2):
+                with self.assertRaises(requests.ConnectionError):
+                    self.client.get("/recipes/random")
+
+            with self.assertRaises(CircuitOpenError):
+                self.client.get("/recipes/random")
+
+        self.assertEqual(get.call_count, 6)
+
+    def test_other_request_errors_settle_half_open_trial(self):
+        """Test a trial call failing with a non-connection error reopens the breaker instead of wedging it"""
+        self.client.breaker = CircuitBreaker(failure_threshold=1, reset_timeout=0)
+        self.client.breaker.record_failure()
+
+        with mock.patch.object(self.client.session, "get",
+                               side_effect=requests.exceptions.ChunkedEncodingError("cut off")) as get:
+            with self.assertRaises(requests.exceptions.ChunkedEncodingError):
+                self.client.get("/recipes/random")
+        self.assertEqual(get.call_count, 1)
+        self.assertFalse(self.client.breaker._trial_in_flight)
+
+        with mock.patch.object(self.client.session, "get", return_value=make_response(200)):
+            self.assertEqual(self.client.get("/recipes/random").status_code, 200)
+        self.assertEqual(self.client.breaker.state, 'closed')
+
+
+class CircuitBreakerTests(unittest.TestCase):
+    def test_half_open_allows_one_trial(self):
+        """Test a single trial call is let through after the reset timeout"""
+        breaker = CircuitBreaker(failure_threshold=1, reset_timeout=0)
+        breaker.record_failure()
+
+        self.assertTrue(breaker.allow())
+        self.assertFalse(breaker.allow())
+
+        breaker.record_success()
+        self.assertEqual(breaker.state, 'closed')
+
+
+if __name__ == '__main__':
+    unittest.main()
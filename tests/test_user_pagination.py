@@ -0,0 +1,70 @@
+import os
+import unittest
+
+os.environ.setdefault('DATABASE_URL', 'postgresql:///food_friends_test')
+
+from app import app
+from models import db, User
+
+app.config['TESTING'] = True
+
+
+class UserPaginationTests(unittest.TestCase):
+    """Keyset pagination of the user list and search results."""
+
+    def setUp(self):
+        self.ctx = app.app_context()
+        self.ctx.push()
+        db.drop_all()
+        db.create_all()
+
+        # Added out of order so id order and username order differ
+        names = [f"cook{n:02d}" for n in range(25)] + [f"baker{n:02d}" for n in range(5)]
+        db.session.add_all([User(username=name, email=f"{name}@example.com", password="x") for name in names[::-1]])
+        db.session.commit()
+        self.names = sorted(names)
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.ctx.pop()
+
+    def walk(self, **kwargs):
+        pages = [User.keyset_page(per_page=7, **kwargs)]
+        while pages[-1].has_next:
+            pages.append(User.keyset_page(after=pages[-1].next_cursor, per_page=7, **kwargs))
+        return pages
+
+    def test_pages_cover_every_user_once(self):
+        """Test walking forward visits every user once, in username order"""
+        pages = self.walk()
+
+        self.assertEqual([user.username for page in pages for user in page], self.names)
+        self.assertFalse(pages[0].has_prev)
+        self.assertTrue(all(page.has_prev for page in pages[1:]))
+
+    def test_previous_cursor_returns_the_page_before(self):
+        """Test following prev_cursor from page N gives back page N - 1"""
+        pages = self.walk()
+
+        for before, page in zip(pages, pages[1:]):
+            previous = User.keyset_page(before=page.prev_cursor, per_page=7)
+            self.assertEqual(previous.items, before.items)
+            self.assertEqual(previous.has_prev, before.has_prev)
+            self.assertTrue(previous.has_next)
+
+    def test_search(self):
+        """Test search results are paged with the filter applied"""
+        pages = self.walk(search="bak")
+
+        self.assertEqual([user.username for page in pages for user in page], self.names[:5])
+        self.assertEqual(len(pages), 1)
+
+    def test_invalid_cursor_is_first_page(self):
+        """Test a malformed cursor falls back to the first page"""
+        self.assertEqual(User.keyset_page(after="nonsense", per_page=7).items,
+                         User.keyset_page(per_page=7).items)
+
+
+if __name__ == '__main__':
+    unittest.main()